@@ -0,0 +1,281 @@
+"""
+Semantic cache of the primary assistant's plain answers.
+
+General questions about CTS ("what areas do you cover?", "do you do airport
+transfers?") get the same answer whoever asks them, yet each one costs a full
+LLM call. When the first user message of a thread goes to the primary
+assistant (so the answer depends on the question alone, not on earlier turns
+or a search) and names no town, date or party size, it is embedded and looked
+up among the past answers for the same language, currency and token scope
+(tools.cache.token_scope). Above the similarity threshold the past answer is
+served without calling the LLM; otherwise the new answer is stored if it
+needed no tools and mentions no guest data (e-mails, phone or document
+numbers, bookings) and no town, date or party size either. Questions that
+differ only in such a value embed close together, yet need different answers.
+Towns are found in the hotel and transport catalogs (Gazetteer.mentions());
+until both are loaded no turn is cacheable.
+
+    CTS_ANSWER_CACHE            'off' disables it
+    CTS_ANSWER_CACHE_MODEL      embedding model (default text-embedding-3-small)
+    CTS_ANSWER_CACHE_THRESHOLD  cosine similarity to reuse an answer (default 0.92)
+    CTS_ANSWER_CACHE_TTL        seconds an answer is served (default 86400)
+    CTS_ANSWER_CACHE_SIZE       answers kept, least recently used out (default 1000)
+
+flush() empties it, e.g. after a change of services or prices (see the admin
+endpoint in main.py), and stats() reports its counters.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import faiss
+import numpy as np
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_openai import OpenAIEmbeddings
+
+from tools import excursion_tools, hotel_tools, prefetch, session
+from tools.cache import token_scope
+
+# Questions are short: send them as they are, without tokenizing and chunking them first.
+embeddings = OpenAIEmbeddings(
+    model=os.getenv('CTS_ANSWER_CACHE_MODEL', 'text-embedding-3-small'),
+    check_embedding_ctx_length=False,
+)
+
+
+def enabled() -> bool:
+    return os.getenv('CTS_ANSWER_CACHE', 'on').lower() != 'off'
+
+
+def threshold() -> float:
+    return float(os.getenv('CTS_ANSWER_CACHE_THRESHOLD', '0.92'))
+
+
+def ttl() -> float:
+    return float(os.getenv('CTS_ANSWER_CACHE_TTL', '86400'))
+
+
+def max_entries() -> int:
+    return max(int(os.getenv('CTS_ANSWER_CACHE_SIZE', '1000')), 1)
+
+
+# Answers that mention any of these are about one guest: never stored.
+GUEST_DATA = re.compile(
+    r'[\w.+-]+@[\w-]+\.[\w.]+'  # e-mail
+    r'|\+?\d[\d .()-]{6,}\d'  # phone, RUT or passport number
+    r'|\b(?:booking|reservation|reserva|file|localizador|voucher|confirmation|confirmaci[oó]n)\b[^\d\n]{0,25}\d{3,}',  # booking
+    re.IGNORECASE,
+)
+
+# Dates and party sizes, in English and Spanish, make a question about one trip.
+DATES = re.compile(
+    r'\b\d{1,4}[/.-]\d{1,2}(?:[/.-]\d{1,4})?\b'
+    r'|\b(?:january|february|march|april|june|july|august|september|october|november|december'
+    r'|enero|febrero|marzo|abril|mayo|junio|julio|agosto|sept?iembre|octubre|noviembre|diciembre)\b'
+    r'|\bmay\s+\d|\d\s*(?:st|nd|rd|th)?\s+(?:of\s+)?may\b'
+    r'|\b(?:today|tonight|tomorrow|weekend|next\s+(?:week|month)|hoy|ma[nñ]ana|fin\s+de\s+semana|pr[oó]xim[oa]\s+(?:semana|mes)'
+    r'|monday|tuesday|wednesday|thursday|friday|saturday|sunday|lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo)\b',
+    re.IGNORECASE,
+)
+OCCUPANCY = re.compile(
+    r'\b(?:\d+|one|two|three|four|five|six|seven|eight|nine|ten|una?|dos|tres|cuatro|cinco|seis|siete|ocho|nueve|diez)\s+'
+    r'(?:adults?|adultos?|people|persons?|personas?|pax|guests?|hu[eé]sped(?:es)?|children|child|kids?|ni[nñ][oa]s?'
+    r'|infants?|beb[eé]s?|rooms?|habitaci[oó]n(?:es)?|nights?|noches?)\b',
+    re.IGNORECASE,
+)
+
+# The answers of one language, currency and token scope.
+Scope = tuple[str, str, str]
+
+
+@dataclass
+class Entry:
+    scope: Scope
+    question: str
+    answer: str
+    expires_at: float
+
+
+@dataclass
+class Lookup:
+    """A cacheable turn: its scope, question, embedding and, on a hit, the cached answer."""
+    scope: Scope
+    question: str
+    vector: np.ndarray
+    answer: Optional[str] = None
+
+
+class AnswerCache:
+    """Answers by question embedding, one faiss inner-product index per scope."""
+
+    def __init__(self):
+        self._indexes: dict[Scope, faiss.IndexIDMap2] = {}
+        self._entries: OrderedDict[int, Entry] = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expirations': 0, 'skipped': 0, 'errors': 0, 'flushes': 0}
+
+    def get(self, scope: Scope, vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            self._stats['lookups'] += 1
+            index = self._indexes.get(scope)
+            if index is None or index.ntotal == 0:
+                self._stats['misses'] += 1
+                return None
+            scores, ids = index.search(vector[None, :], 1)
+            entry_id = int(ids[0][0])
+            entry = self._entries.get(entry_id)
+            if entry is None or scores[0][0] < threshold():
+                self._stats['misses'] += 1
+                return None
+            if entry.expires_at < time.monotonic():
+                self._drop(entry_id)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self._stats['hits'] += 1
+            return entry.answer
+
+    def put(self, scope: Scope, vector: np.ndarray, question: str, answer: str) -> None:
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                index = self._indexes[scope] = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[0]))
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(vector[None, :], np.array([entry_id], dtype='int64'))
+            self._entries[entry_id] = Entry(scope, question, answer, time.monotonic() + ttl())
+            self._stats['stores'] += 1
+            while len(self._entries) > max_entries():
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def flush(self, language: Optional[str] = None) -> int:
+        """Drop every answer, or those of one language. Returns how many."""
+        with self._lock:
+            ids = [entry_id for entry_id, entry in self._entries.items() if language is None or entry.scope[0] == language]
+            for entry_id in ids:
+                self._drop(entry_id)
+            self._stats['flushes'] += 1
+            return len(ids)
+
+    def error(self) -> None:
+        with self._lock:
+            self._stats['errors'] += 1
+
+    def skipped(self) -> None:
+        with self._lock:
+            self._stats['skipped'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                'entries': len(self._entries),
+                'languages': sorted({scope[0] for scope in self._indexes}),
+                'hit_ratio': round(self._stats['hits'] / max(self._stats['lookups'], 1), 3),
+            }
+
+    def _drop(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._indexes[entry.scope].remove_ids(np.array([entry_id], dtype='int64'))
+
+
+answers = AnswerCache()
+
+
+def lookup(state: dict, config) -> Optional[Lookup]:
+    """The cache lookup for the turn, None if the turn is not cacheable."""
+    question = _question(state, config)
+    if question is None:
+        return None
+    try:
+        vector = _normalize(embeddings.embed_query(question))
+    except Exception:
+        answers.error()
+        return None
+    return _lookup(config, question, vector)
+
+
+async def alookup(state: dict, config) -> Optional[Lookup]:
+    question = _question(state, config)
+    if question is None:
+        return None
+    try:
+        vector = _normalize(await embeddings.aembed_query(question))
+    except Exception:
+        answers.error()
+        return None
+    return _lookup(config, question, vector)
+
+
+def remember(turn: Lookup, result: AIMessage) -> None:
+    """Store the assistant's answer to a cacheable turn, if it needed no tools and is about no guest or trip."""
+    if result.tool_calls or not isinstance(result.content, str) or not result.content:
+        return
+    if GUEST_DATA.search(result.content) or _about_a_trip(result.content):
+        answers.skipped()
+        return
+    answers.put(turn.scope, turn.vector, turn.question, result.content)
+
+
+def flush(language: Optional[str] = None) -> int:
+    return answers.flush(_language_key(language) if language else None)
+
+
+def stats() -> dict:
+    return answers.stats()
+
+
+# Helpers
+
+def _question(state: dict, config) -> Optional[str]:
+    """The user's question, if it is the first turn of the thread and about no trip."""
+    if not enabled() or state.get("dialog_state"):
+        return None
+    messages = state["messages"]
+    if not messages or not isinstance(messages[-1], HumanMessage) or not isinstance(messages[-1].content, str):
+        return None
+    # Later answers depend on the earlier turns too.
+    if any(isinstance(message, (AIMessage, ToolMessage)) for message in messages[:-1]):
+        return None
+    question = messages[-1].content.strip()
+    with session.bind(config):
+        for towns in _towns():
+            if not towns.loaded:
+                prefetch.submit('towns', towns.warm)
+    if not question or _about_a_trip(question):
+        return None
+    return question
+
+
+def _about_a_trip(text: str) -> bool:
+    """Whether text names a town, a date or a party size. Without the town catalogs it can't tell, so it says yes."""
+    if DATES.search(text) or OCCUPANCY.search(text):
+        return True
+    return any(not towns.loaded or towns.mentions(text) for towns in _towns())
+
+
+def _towns():
+    return hotel_tools.hotel_towns, excursion_tools.transport_towns
+
+
+def _lookup(config, question: str, vector: np.ndarray) -> Lookup:
+    with session.bind(config):
+        scope = (_language_key(session.language()), str(session.currency_id()), token_scope(session.token()))
+    return Lookup(scope, question, vector, answers.get(scope, vector))
+
+
+def _language_key(language: Optional[str]) -> str:
+    return (language or '').strip().lower()
+
+
+def _normalize(vector: list[float]) -> np.ndarray:
+    array = np.array(vector, dtype='float32')
+    return array / max(float(np.linalg.norm(array)), 1e-12)
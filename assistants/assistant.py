@@ -1,32 +1,133 @@
-from langchain_openai import ChatOpenAI
+import os
+import threading
+import time
+
+from langchain_core.messages import AIMessage
 from langchain_core.pydantic_v1 import BaseModel
 from langchain_core.runnables import Runnable, RunnableConfig
 from state import State
+from assistants import answer_cache, context, prompts
+from tools import formatting, session
 from dotenv import load_dotenv
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+# Canned answer, per session language, when the model keeps answering nothing.
+FALLBACK_ANSWERS = {
+    'es': "Lo siento, no pude preparar una respuesta. ¿Puedes repetir o reformular tu consulta?",
+    'en': "Sorry, I couldn't put an answer together. Could you repeat or rephrase your request?",
+}
+
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def max_attempts() -> int:
+    """LLM calls per step when the model answers nothing, the first one included."""
+    return max(int(os.getenv('CTS_REPROMPT_ATTEMPTS', '3')), 1)
+
+
+def time_budget() -> float:
+    """Seconds after which an empty answer is not retried."""
+    return float(os.getenv('CTS_REPROMPT_BUDGET', '30'))
+
+
+def stats() -> dict[str, dict[str, int]]:
+    """Per assistant: steps, empty answers, retries and canned fallbacks."""
+    with _stats_lock:
+        return {assistant: dict(values) for assistant, values in _stats.items()}
+
 
 class Assistant:
-    def __init__(self, runnable: Runnable):
+    def __init__(self, runnable: Runnable, name: str = "assistant", cache_answers: bool = False):
         self.runnable = runnable
+        self.name = name
+        # Serve and store plain answers through the semantic answer cache.
+        self.cache_answers = cache_answers
 
     def __call__(self, state: State, config: RunnableConfig):
+        turn = answer_cache.lookup(state, config) if self.cache_answers else None
+        if turn and turn.answer:
+            return {"messages": AIMessage(content=turn.answer)}
+        # Send the summary and the last turns, not the whole history.
+        window = context.window(state, self.name)
+        update = context.fold(state, window, self.name)
+        state = context.apply(state, window, update, self.name)
+        _count(self.name, 'calls')
+        started = time.monotonic()
+        attempt, attempts = state, 1
+        while True:
+            # The prompts read the session's language and currency.
+            with session.bind(config):
+                result = self.runnable.invoke(attempt, config)
+            prompts.record_usage(self.name, result)
+
+            if not self._is_empty(result):
+                break
+            if not self._retry(attempts, started):
+                result, turn = self._fallback(config), None
+                break
+            attempt, attempts = self._reprompt(state), attempts + 1
+        if turn:
+            answer_cache.remember(turn, result)
+        return {"messages": result, **update}
+
+    async def acall(self, state: State, config: RunnableConfig):
+        turn = await answer_cache.alookup(state, config) if self.cache_answers else None
+        if turn and turn.answer:
+            return {"messages": AIMessage(content=turn.answer)}
+        window = context.window(state, self.name)
+        update = await context.afold(state, window, self.name)
+        state = context.apply(state, window, update, self.name)
+        _count(self.name, 'calls')
+        started = time.monotonic()
+        attempt, attempts = state, 1
         while True:
-            result = self.runnable.invoke(state)
-
-            if not result.tool_calls and (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
-            else:
+            with session.bind(config):
+                result = await self.runnable.ainvoke(attempt, config)
+            prompts.record_usage(self.name, result)
+
+            if not self._is_empty(result):
+                break
+            if not self._retry(attempts, started):
+                result, turn = self._fallback(config), None
                 break
-        return {"messages": result}
+            attempt, attempts = self._reprompt(state), attempts + 1
+        if turn:
+            answer_cache.remember(turn, result)
+        return {"messages": result, **update}
+
+    def _retry(self, attempts: int, started: float) -> bool:
+        """Whether an empty answer is worth another call, within the attempts and the time budget."""
+        _count(self.name, 'empty')
+        if attempts < max_attempts() and time.monotonic() - started < time_budget():
+            _count(self.name, 'retries')
+            return True
+        _count(self.name, 'fallbacks')
+        return False
+
+    @staticmethod
+    def _is_empty(result) -> bool:
+        return not result.tool_calls and (
+            not result.content
+            or isinstance(result.content, list)
+            and not result.content[0].get("text")
+        )
+
+    @staticmethod
+    def _reprompt(state: State) -> State:
+        # Always one nudge on top of the same state, however many retries.
+        return {**state, "messages": state["messages"] + [("user", "Respond with a real output.")]}
+
+    @staticmethod
+    def _fallback(config: RunnableConfig) -> AIMessage:
+        with session.bind(config):
+            return AIMessage(content=FALLBACK_ANSWERS[formatting.session_language()])
+
+
+def _count(assistant: str, key: str) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(assistant, {'calls': 0, 'empty': 0, 'retries': 0, 'fallbacks': 0})
+        stats[key] += 1
 
 
 class CompleteOrEscalate(BaseModel):
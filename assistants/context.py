@@ -0,0 +1,295 @@
+"""
+Rolling context window for the assistants.
+
+Before each LLM call the conversation is cut down to what the assistant needs:
+
+- The last CTS_CONTEXT_TURNS turns (default 6). A turn starts at a user
+  message, so a tool call always travels with its tool results.
+- The older turns are folded into a running summary, kept in the state
+  (context_summary, plus context_folded, the ID of the last message folded)
+  and sent ahead of the window. Turns are folded CTS_CONTEXT_FOLD_TURNS at a
+  time (default 2), so the summary is not rewritten on every turn, with
+  CTS_CONTEXT_SUMMARY_MODEL (default gpt-4o-mini, see assistants/models.py).
+- A token budget for the messages sent, CTS_CONTEXT_BUDGET (default 16000),
+  or CTS_CONTEXT_BUDGET_<ASSISTANT> for one assistant (e.g.
+  CTS_CONTEXT_BUDGET_BOOK_HOTEL). Over budget, older turns leave the window,
+  down to the current one, and then the oldest tool results in it are cut.
+- Tool results from before the last CTS_COMPACT_KEEP_TURNS turns (default 1)
+  and larger than CTS_COMPACT_MIN_TOKENS (default 300) are replaced by a
+  digest: the key columns of the rows that later tool calls used (all rows
+  if none was used), and the tool_call_id to pass to expand_tool_result for
+  the whole result. Only the prompt is compacted, the state keeps the
+  originals, and every tool call keeps its result.
+
+The system prompt is not part of the messages and is always sent. stats()
+reports, per assistant, the tokens of the full history against the tokens
+sent.
+"""
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from assistants import models
+from tools.formatting import count_tokens
+
+summary_llm = models.llm('context_summary')
+
+summary_prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You maintain the running summary of a conversation between a user and the CTS Travel Assistant, "
+            "which books hotels, excursions and transfers in Chile. "
+            "Update the summary with the new messages. Keep every fact the assistant may need later: "
+            "the user's requests and preferences, towns, dates, occupancy, hotel and service names and IDs, "
+            "prices and currency, and booking or file numbers. Drop greetings and search results that were discarded. "
+            "Answer with the updated summary only, in the language of the conversation.",
+        ),
+        ("human", "Current summary:\n{summary}\n\nNew messages:\n{messages}"),
+    ]
+)
+
+# The summary is internal: keep its tokens out of the websocket stream. Newer
+# langgraph versions skip "nostream" runs in stream_mode="messages";
+# main.stream_turn drops the ones flagged in the metadata.
+summarizer = (summary_prompt | summary_llm).with_config(tags=["nostream"], metadata={"nostream": True})
+
+# Characters of each tool result shown to the summarizer.
+SUMMARY_TOOL_CHARS = 2000
+# Tool results are never cut below this many tokens.
+MIN_TOOL_TOKENS = 200
+# Columns of a tabular tool result kept in its digest.
+DIGEST_COLUMNS = {
+    'id', 'n', 'room_id', 'service_code', 'name', 'town', 'town_id', 'checkin', 'checkout', 'date',
+    'travel_date', 'guests', 'adults', 'children', 'price', 'price_from', 'type',
+}
+# Characters kept from a tool result that is not a table.
+DIGEST_CHARS = 300
+# Tool call arguments that name a row of an earlier result (its id, room_id or
+# service_code). Other IDs, such as townId, would match unrelated rows.
+ROW_ID_ARGS = ('hotelId', 'roomId', 'serviceCode')
+
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def max_turns() -> int:
+    return max(int(os.getenv('CTS_CONTEXT_TURNS', '6')), 1)
+
+
+def fold_turns() -> int:
+    return max(int(os.getenv('CTS_CONTEXT_FOLD_TURNS', '2')), 1)
+
+
+def compact_keep_turns() -> int:
+    return max(int(os.getenv('CTS_COMPACT_KEEP_TURNS', '1')), 1)
+
+
+def compact_min_tokens() -> int:
+    return int(os.getenv('CTS_COMPACT_MIN_TOKENS', '300'))
+
+
+def budget(assistant: str) -> int:
+    return int(os.getenv(f'CTS_CONTEXT_BUDGET_{assistant.upper()}', os.getenv('CTS_CONTEXT_BUDGET', '16000')))
+
+
+def message_tokens(message: BaseMessage) -> int:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    tokens = count_tokens(content) + 4
+    if isinstance(message, AIMessage) and message.tool_calls:
+        tokens += count_tokens(json.dumps([[call['name'], call['args']] for call in message.tool_calls]))
+    return tokens
+
+
+@dataclass
+class Window:
+    # Messages older than the window and not in the summary yet.
+    fold: list[BaseMessage] = field(default_factory=list)
+    # Messages sent to the assistant, summary not included.
+    messages: list[BaseMessage] = field(default_factory=list)
+    full_tokens: int = 0
+
+
+def window(state: dict, assistant: str) -> Window:
+    """Split the conversation into the messages to fold and the ones to send."""
+    messages = state["messages"]
+    folded = _folded_count(state)
+    starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage) and i >= folded]
+    # The current turn always stays, even without a user message (e.g. a specialist at work).
+    start = starts[0] if starts else folded
+    if len(starts) - max_turns() >= fold_turns():
+        start = starts[-max_turns()]
+    tokens = [message_tokens(message) for message in messages]
+    summary_tokens = count_tokens(state.get("context_summary") or "")
+    limit = budget(assistant)
+    later_starts = [i for i in starts if i > start]
+    while later_starts and summary_tokens + sum(tokens[start:]) > limit:
+        start = later_starts.pop(0)
+    return Window(fold=messages[folded:start], messages=messages[start:], full_tokens=sum(tokens))
+
+
+def fold(state: dict, window: Window, assistant: str) -> dict:
+    """
+    The state update that folds window.fold into the summary. Empty if there
+    is nothing to fold, or if folding failed: apply() then sends those turns
+    as they are, and the next call tries again.
+    """
+    if not window.fold:
+        return {}
+    try:
+        summary = summarizer.invoke(_summary_inputs(state, window)).content
+    except Exception:
+        _count(assistant, 'fold_failures')
+        return {}
+    _count(assistant, 'folds')
+    return {"context_summary": summary, "context_folded": window.fold[-1].id}
+
+
+async def afold(state: dict, window: Window, assistant: str) -> dict:
+    if not window.fold:
+        return {}
+    try:
+        summary = (await summarizer.ainvoke(_summary_inputs(state, window))).content
+    except Exception:
+        _count(assistant, 'fold_failures')
+        return {}
+    _count(assistant, 'folds')
+    return {"context_summary": summary, "context_folded": window.fold[-1].id}
+
+
+def apply(state: dict, window: Window, update: dict, assistant: str) -> dict:
+    """The state the assistant sees: the summary, then the window, within budget."""
+    summary = update.get("context_summary", state.get("context_summary"))
+    prefix = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] if summary else []
+    # A failed fold leaves its turns out of the summary: send them instead.
+    sent = window.messages if update else window.fold + window.messages
+    messages, compacted = compact(sent)
+    messages, truncated = _fit(prefix + messages, budget(assistant))
+    _count(assistant, 'calls')
+    _count(assistant, 'full_tokens', window.full_tokens)
+    _count(assistant, 'sent_tokens', sum(message_tokens(message) for message in messages))
+    _count(assistant, 'compacted', compacted)
+    _count(assistant, 'truncated', truncated)
+    return {**state, "messages": messages}
+
+
+def compact(messages: list[BaseMessage]) -> tuple[list[BaseMessage], int]:
+    """Replace the stale tool results with digests. Returns the messages and how many were compacted."""
+    starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+    if len(starts) < compact_keep_turns():
+        return messages, 0
+    boundary = starts[-compact_keep_turns()]
+    messages = list(messages)
+    compacted = 0
+    # IDs passed to the tool calls after each message, to spot the rows that were chosen.
+    used: set[str] = set()
+    for i in range(len(messages) - 1, -1, -1):
+        message = messages[i]
+        if isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                used |= _ids(call['args'])
+        elif i < boundary and isinstance(message, ToolMessage) and isinstance(message.content, str):
+            if message_tokens(message) >= compact_min_tokens():
+                messages[i] = message.model_copy(update={"content": digest(message, used)})
+                compacted += 1
+    return messages, compacted
+
+
+def digest(message: ToolMessage, used: set[str]) -> str:
+    note = (
+        f"[Compacted result of an earlier {message.name or 'tool'} call."
+        f" Call expand_tool_result with tool_call_id='{message.tool_call_id}' for all of it.]"
+    )
+    lines = message.content.strip().split("\n")
+    if " Columns: " not in lines[0]:
+        return f"{note}\n{message.content[:DIGEST_CHARS]} ..."
+    header, columns = lines[0].split(" Columns: ", 1)
+    columns = columns.split("|")
+    kept = [i for i, column in enumerate(columns) if column in DIGEST_COLUMNS]
+    rows = [line.split("|") for line in lines[1:]]
+    rows = [row for row in rows if len(row) == len(columns)]
+    chosen = [row for row in rows if any(row[i] in used for i in kept if columns[i] in ('id', 'room_id', 'service_code'))]
+    lines = [note, f"{header.split('. ')[0].rstrip('.')}. Columns: {'|'.join(columns[i] for i in kept)}"]
+    lines += ["|".join(row[i] for i in kept) for row in chosen or rows]
+    if chosen:
+        lines.append(f"({len(rows) - len(chosen)} other rows omitted.)")
+    return "\n".join(lines)
+
+
+def stats() -> dict[str, dict[str, int]]:
+    with _stats_lock:
+        return {
+            assistant: {
+                **values,
+                'saved_tokens': values['full_tokens'] - values['sent_tokens'],
+                'saved_per_call': (values['full_tokens'] - values['sent_tokens']) // max(values['calls'], 1),
+            }
+            for assistant, values in _stats.items()
+        }
+
+
+# Helpers
+
+def _folded_count(state: dict) -> int:
+    """Number of leading messages already in the summary."""
+    folded = state.get("context_folded")
+    if folded:
+        for i, message in enumerate(state["messages"]):
+            if message.id == folded:
+                return i + 1
+    return 0
+
+
+def _summary_inputs(state: dict, window: Window) -> dict:
+    lines = []
+    for message in window.fold:
+        if isinstance(message, HumanMessage):
+            lines.append(f"User: {message.content}")
+        elif isinstance(message, AIMessage):
+            if message.content:
+                lines.append(f"Assistant: {message.content}")
+            for call in message.tool_calls:
+                lines.append(f"Assistant called {call['name']}({json.dumps(call['args'], ensure_ascii=False)})")
+        elif isinstance(message, ToolMessage):
+            lines.append(f"Tool result: {str(message.content)[:SUMMARY_TOOL_CHARS]}")
+    return {"summary": state.get("context_summary") or "(empty)", "messages": "\n".join(lines)}
+
+
+def _ids(args: dict) -> set[str]:
+    """Values of the arguments of a tool call that pick a result row: a hotel, a room or a service."""
+    return {str(args[key]) for key in ROW_ID_ARGS if args.get(key) is not None}
+
+
+def _fit(messages: list[BaseMessage], limit: int) -> tuple[list[BaseMessage], int]:
+    """Cut the oldest tool results until the messages fit the budget. Returns them and how many were cut."""
+    excess = sum(message_tokens(message) for message in messages) - limit
+    truncated = 0
+    for i, message in enumerate(messages):
+        if excess <= 0:
+            break
+        if not isinstance(message, ToolMessage) or not isinstance(message.content, str):
+            continue
+        tokens = message_tokens(message)
+        keep = max(tokens - excess, MIN_TOOL_TOKENS)
+        if keep >= tokens:
+            continue
+        chars = len(message.content) * keep // tokens
+        content = f"{message.content[:chars]}\n[... truncated, {tokens - keep} tokens omitted]"
+        messages[i] = message.model_copy(update={"content": content})
+        excess -= tokens - keep
+        truncated += 1
+    return messages, truncated
+
+
+def _count(assistant: str, key: str, value: int = 1) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(
+            assistant,
+            {'calls': 0, 'full_tokens': 0, 'sent_tokens': 0, 'folds': 0, 'fold_failures': 0, 'compacted': 0, 'truncated': 0},
+        )
+        stats[key] += value
@@ -1,86 +1,80 @@
 #mport __init__
 from assistants.assistant import CompleteOrEscalate
-from langchain_core.prompts import ChatPromptTemplate
-from tools.hotel_tools import get_availability_for_hotels, get_town_id_for_hotels, get_hotel_info, get_hotel_rooms_available, create_hotel_booking, update_hotel_booking, cancel_hotel_booking
-from datetime import datetime
-from langchain_openai import ChatOpenAI
+from assistants.primary import ToBookExcursion
+from assistants import models
+from assistants.prompts import assistant_prompt
+from tools.hotel_tools import get_availability_for_hotels, search_hotels_availability, get_town_id_for_hotels, get_hotel_info, get_hotel_rooms_available, create_hotel_booking, update_hotel_booking, cancel_hotel_booking
+from tools.history_tools import expand_tool_result
 from dotenv import load_dotenv
-import os
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+llm = models.llm("book_hotel")
 
-book_hotel_prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            "You are a specialized assistant for handling hotel bookings. "
-            "The primary assistant delegates work to you whenever the user needs help booking a hotel. "
-            "You have to guide the user through the process of finding and booking a hotel. "
-            "for that purpose, you have access to the following steps:\n\n"
-            "1. Search for available hotels based on the user's preferences.\n"
-            "You have to get from the user:\n"
-            "\ta) The city.\n"
-            "\tb) The check-in date.\n"
-            "\tc) The check-out date.\n"
-            "\td) The number of adults.\n"
-            "\td) Any additional request.\n"
-            "Use the 'get_availability_for_hotels' tool to search for available hotels. "
-            "To get the town or city ID, use the 'get_town_id_for_hotels' tool. Never ask it to the user. "
-            "Return to the user a maximum of 3 hotel options (unless the number of results is less). "
-            "Choose randomnly the hotels to show from results, but if the user indicates any additional request or preference, "
-            "you have to show the hotels that match the user's preferences. "
-            "You can filter the hotels by category, stars, price, location/adress, category, ammenities and other features. "
-            "If you are not sure what to show, you can ask to user one of those filter options, but only if the user requested and additional information.\n\n"
-            "2. When user is interested in a hotel option, show the hotel information.\n"
-            "You have two options:\n"
-            "\ta) If the user wants to know more information about a specific hotel, use the 'get_hotel_info' tool. "
-            "You can use the 'get_hotel_info' tool to get the hotel information available for the hotel id. "
-            "Use it especially when the user asks, for example: 'give me more information about this hotel', "
-            "'what are the services of this hotel', "
-            "or 'what can you tell me about this hotel'. "
-            "\tb) Show the rooms available for that hotel. "
-            "Use the 'get_hotel_rooms_available' tool to get the rooms available for the hotel id. "
-            "This option is necessary to book a hotel, so always have to use this option before booking a hotel. "
-            "If you are not sure what of the two options to use, you can ask to user in order to choose one option. "
-            "3. Make the hotel booking/reservation. "
-            "When the user has chosen a hotel and a room, you have to make the hotel booking. "
-            "For that purpose, you always have to ask the user the following information: "
-            "a. The guest first name. "
-            "b. The guest last name. "
-            "c. The guest email. "
-            "d. The guest phone number. "
-            "e. The guest ID Card (DNI) or Passport number. "
-            "f. The guest country. "
-            "g. Any observation, note or special request for the hotel. "
-            "Ask this information to the user even if the user has already provided it or you have it. "
-            "Before you make the booking, you have to have to give a resume of the booking to the user. "
-            "Then you have to ask the user if he/she wants to confirm the booking. "
-            "If user says yes, use the 'create_hotel_booking' tool to make the hotel booking. "
-            "When searching, be persistent. Expand your query bounds if the first search returns no results. "
-            "If you need more information or the customer changes their mind, escalate the task back to the main assistant. "
-            "Remember that a booking isn't completed until after the relevant tool has successfully been used."
-            "When you return an answer, use the python string format to make it more readable."
-            "\nCurrent time: {time}. "
-            "\nCurrency: {currency}. "
-            "\nLanguage: {language}. "
-            "If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. "
-            '\n\nIf the user needs help, and none of your tools are appropriate for it, then "CompleteOrEscalate" the dialog to the host assistant.'
-            " Do not waste the user's time. Do not make up invalid tools or functions."
-            "\n\nSome examples for which you should CompleteOrEscalate:\n"
-            " - 'what's the weather like this time of year?'\n"
-            " - 'nevermind i think I'll book separately'\n"
-            " - 'i need to figure out transportation while i'm there'\n"
-            #" - 'Oh wait i haven't booked my flight yet i'll do that first'\n"
-            " - 'Hotel booking confirmed'",
-        ),
-        ("placeholder", "{messages}"),
-    ]
-).partial(time=datetime.now(), language=os.getenv("LANGUAGE"), currency=os.getenv("CURRENCY"))
+book_hotel_prompt = assistant_prompt(
+    "You are a specialized assistant for handling hotel bookings. "
+    "The primary assistant delegates work to you whenever the user needs help booking a hotel. "
+    "You have to guide the user through the process of finding and booking a hotel. "
+    "for that purpose, you have access to the following steps:\n\n"
+    "1. Search for available hotels based on the user's preferences.\n"
+    "You have to get from the user:\n"
+    "\ta) The city.\n"
+    "\tb) The check-in date.\n"
+    "\tc) The check-out date.\n"
+    "\td) The number of adults.\n"
+    "\td) Any additional request.\n"
+    "Use the 'get_availability_for_hotels' tool to search for available hotels. "
+    "To get the town or city ID, use the 'get_town_id_for_hotels' tool. Never ask it to the user. "
+    "Return to the user a maximum of 3 hotel options (unless the number of results is less). "
+    "If the user indicates any additional request or preference, pass it to the 'get_availability_for_hotels' tool "
+    "with its filter arguments (min_stars, max_stars, max_price, amenities) and sort_by, so the tool only returns the hotels that match. "
+    "Do not ask for more results than you are going to show. "
+    "When you need the same tool for several hotels (e.g. the information of the options shown), call it for all of them at once, in parallel. "
+    "If the user is flexible about the city, the dates or the number of guests (e.g. 'any weekend in March', 'Santiago or Valparaiso'), "
+    "use the 'search_hotels_availability' tool once with all the towns, date ranges and occupancies instead of searching them one by one. "
+    "If you are not sure what to show, you can ask to user one of those filter options, but only if the user requested and additional information.\n\n"
+    "2. When user is interested in a hotel option, show the hotel information.\n"
+    "You have two options:\n"
+    "\ta) If the user wants to know more information about a specific hotel, use the 'get_hotel_info' tool. "
+    "You can use the 'get_hotel_info' tool to get the hotel information available for the hotel id. "
+    "Use it especially when the user asks, for example: 'give me more information about this hotel', "
+    "'what are the services of this hotel', "
+    "or 'what can you tell me about this hotel'. "
+    "\tb) Show the rooms available for that hotel. "
+    "Use the 'get_hotel_rooms_available' tool to get the rooms available for the hotel id. "
+    "This option is necessary to book a hotel, so always have to use this option before booking a hotel. "
+    "If you are not sure what of the two options to use, you can ask to user in order to choose one option. "
+    "3. Make the hotel booking/reservation. "
+    "When the user has chosen a hotel and a room, you have to make the hotel booking. "
+    "For that purpose, you always have to ask the user the following information: "
+    "a. The guest first name. "
+    "b. The guest last name. "
+    "c. The guest email. "
+    "d. The guest phone number. "
+    "e. The guest ID Card (DNI) or Passport number. "
+    "f. The guest country. "
+    "g. Any observation, note or special request for the hotel. "
+    "Ask this information to the user even if the user has already provided it or you have it. "
+    "Before you make the booking, you have to have to give a resume of the booking to the user. "
+    "Then you have to ask the user if he/she wants to confirm the booking. "
+    "If user says yes, use the 'create_hotel_booking' tool to make the hotel booking. "
+    "When searching, be persistent. Expand your query bounds if the first search returns no results. "
+    "If you need more information or the customer changes their mind, escalate the task back to the main assistant. "
+    "Remember that a booking isn't completed until after the relevant tool has successfully been used."
+    "When you return an answer, use the python string format to make it more readable. "
+    "If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. "
+    '\n\nIf the user needs help, and none of your tools are appropriate for it, then "CompleteOrEscalate" the dialog to the host assistant.'
+    " Do not waste the user's time. Do not make up invalid tools or functions."
+    "\n\nIf the user wants an excursion or a transfer, call ToBookExcursion directly instead, with the town, date and travelers you already know."
+    "\n\nSome examples for which you should CompleteOrEscalate:\n"
+    " - 'what's the weather like this time of year?'\n"
+    " - 'nevermind i think I'll book separately'\n"
+    #" - 'Oh wait i haven't booked my flight yet i'll do that first'\n"
+    " - 'Hotel booking confirmed'"
+)
 
-book_hotel_safe_tools = [get_availability_for_hotels, get_town_id_for_hotels, get_hotel_info, get_hotel_rooms_available, create_hotel_booking, update_hotel_booking, cancel_hotel_booking]
+book_hotel_safe_tools = [get_availability_for_hotels, search_hotels_availability, get_town_id_for_hotels, get_hotel_info, get_hotel_rooms_available, create_hotel_booking, update_hotel_booking, cancel_hotel_booking, expand_tool_result]
 book_hotel_sensitive_tools = []
 book_hotel_tools = book_hotel_safe_tools + book_hotel_sensitive_tools
 book_hotel_runnable = book_hotel_prompt | llm.bind_tools(
-    book_hotel_tools + [CompleteOrEscalate]
+    book_hotel_tools + [CompleteOrEscalate, ToBookExcursion]
 )
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""
+The LLM behind each graph node.
+
+Every node that calls a model gets it from llm(node), configured per node so
+the light work (e.g. routing and small talk in the primary assistant) can run
+on a small, fast model while the bookings stay on gpt-4o:
+
+    CTS_MODEL_<NODE>             model, default CTS_MODEL (gpt-4o)
+    CTS_MODEL_TIMEOUT_<NODE>     request timeout in seconds, default CTS_MODEL_TIMEOUT (60)
+    CTS_MODEL_MAX_TOKENS_<NODE>  output token limit, default CTS_MODEL_MAX_TOKENS (none)
+
+<NODE> is the node name in upper case: PRIMARY_ASSISTANT, BOOK_HOTEL,
+BOOK_EXCURSION or CONTEXT_SUMMARY (the summarizer of assistants/context.py,
+which defaults to CTS_CONTEXT_SUMMARY_MODEL, gpt-4o-mini). For instance
+CTS_MODEL_PRIMARY_ASSISTANT=gpt-4o-mini.
+
+stats() reports, per node, the model, the calls and errors, the latency
+percentiles and the input and output tokens, to weigh a model change.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_openai import ChatOpenAI
+
+from tools.resilience import LatencyWindow
+
+_llms: dict[str, ChatOpenAI] = {}
+_stats: dict[str, dict[str, int]] = {}
+_latency: dict[str, LatencyWindow] = {}
+_stats_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ModelConfig:
+    model: str
+    timeout: float
+    max_tokens: Optional[int]
+
+
+def config(node: str) -> ModelConfig:
+    key = node.upper()
+    if node == 'context_summary':
+        default = os.getenv('CTS_CONTEXT_SUMMARY_MODEL', 'gpt-4o-mini')
+    else:
+        default = os.getenv('CTS_MODEL', 'gpt-4o')
+    max_tokens = os.getenv(f'CTS_MODEL_MAX_TOKENS_{key}', os.getenv('CTS_MODEL_MAX_TOKENS'))
+    return ModelConfig(
+        model=os.getenv(f'CTS_MODEL_{key}', default),
+        timeout=float(os.getenv(f'CTS_MODEL_TIMEOUT_{key}', os.getenv('CTS_MODEL_TIMEOUT', '60'))),
+        max_tokens=int(max_tokens) if max_tokens else None,
+    )
+
+
+def llm(node: str) -> ChatOpenAI:
+    """The node's chat model, created once per process."""
+    with _stats_lock:
+        if node not in _llms:
+            settings = config(node)
+            _llms[node] = ChatOpenAI(
+                model=settings.model,
+                temperature=0,
+                timeout=settings.timeout,
+                max_tokens=settings.max_tokens,
+                # Streamed calls report their usage too.
+                stream_usage=True,
+                callbacks=[NodeMetrics(node)],
+            )
+        return _llms[node]
+
+
+class NodeMetrics(BaseCallbackHandler):
+    """Records the latency and the tokens of every call of a node's model."""
+
+    # Cheap and thread safe, no need for the executor in async runs.
+    run_inline = True
+
+    def __init__(self, node: str):
+        self.node = node
+        self._started: dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs) -> None:
+        self._started[run_id] = time.monotonic()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        started = self._started.pop(run_id, None)
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or usage
+        _record(self.node, started, 'calls', usage)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        _record(self.node, self._started.pop(run_id, None), 'errors', {})
+
+
+def stats() -> dict[str, dict]:
+    with _stats_lock:
+        counts = {node: dict(values) for node, values in _stats.items()}
+    return {
+        node: {'model': config(node).model, **values, 'latency': _latency[node].stats()}
+        for node, values in counts.items()
+    }
+
+
+# Helpers
+
+def _record(node: str, started: Optional[float], counter: str, usage: dict) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(node, {'calls': 0, 'errors': 0, 'input_tokens': 0, 'output_tokens': 0})
+        latency = _latency.setdefault(node, LatencyWindow())
+        stats[counter] += 1
+        stats['input_tokens'] += usage.get('input_tokens') or 0
+        stats['output_tokens'] += usage.get('output_tokens') or 0
+    if started is not None:
+        latency.add(time.monotonic() - started)
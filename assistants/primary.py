@@ -1,13 +1,13 @@
-import os
-from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel, Field
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+from assistants import models
+from assistants.prompts import assistant_prompt
+from tools.history_tools import expand_tool_result
 from langchain_community.tools.tavily_search import TavilySearchResults
 from dotenv import load_dotenv
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+llm = models.llm("primary_assistant")
 
 class ToHotelBookingAssistant(BaseModel):
     """Transfer work to a specialized assistant to handle hotel bookings."""
@@ -17,6 +17,8 @@ class ToHotelBookingAssistant(BaseModel):
     )
     checkin_date: str = Field(description="The check-in date for the hotel.")
     checkout_date: str = Field(description="The check-out date for the hotel.")
+    adults: Optional[int] = Field(default=None, description="The number of adults, if known.")
+    children: Optional[int] = Field(default=None, description="The number of children, if known.")
     request: str = Field(
         description="Any additional information or requests from the user regarding the hotel booking."
     )
@@ -38,6 +40,9 @@ class ToBookExcursion(BaseModel):
     location: str = Field(
         description="The location where the user wants to book a recommended trip."
     )
+    date: Optional[str] = Field(default=None, description="The date of the trip or transfer, if known.")
+    adults: Optional[int] = Field(default=None, description="The number of adults, if known.")
+    children: Optional[int] = Field(default=None, description="The number of children, if known.")
     request: str = Field(
         description="Any additional information or requests from the user regarding the trip recommendation."
     )
@@ -51,43 +56,36 @@ class ToBookExcursion(BaseModel):
         }
 
 
-primary_assistant_prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            "Your name is CTS Travel Assistant."
-            "You are a customer service assistant for CTS Turismo (Chilean Travel Services). "
-            "CTS Turismo is a tourism company that offers varied tourism services in Chile. "
-            "The services they offer are the following: hotels, excursions and transferss. "
-            "Hotels: Hotel reservations throughout Chile. "
-            "Excursions: Tours and activities in different cities and locations in Chile. "
-            "Transfers: Transportation from one point to another, such as to and from the airport or the bus terminal, or to and from the snow or the beach, etc. "
-            "Your goal is to help users find the services described above and all other relevant information. "
-            "For that purpose, you have to determine the user's needs, "
-            "and then, if necessary, delegate the task to the appropriate specialized assistant. "
-            "You have two specialized assistants available to help you: "
-            "1. Hotel Booking Assistant: Specialized in handling hotel bookings. "
-            "2. Excursion and Transfers Booking Assistant: Specialized in handling trip recommendations/excursion bookings, and transfer services. "
-            "By default, you must give your answers in {language}. However, if the user writes to you in a different language, your answers should be in that language. "
-            "Use the tools provided to search for hotels, excursions and transfers, and other information that will help in the user's queries. "
-            #"If a customer requests to create, update or cancel a hotel, transfer or excursion reservation; or, when searching for a hotel, excursion or transfer, needs specialized recommendations, "
-            #"delegate the task to the appropriate specialized assistant by invoking the corresponding tool. You are not able to make these types of changes yourself. "
-            "The user is not aware of the different specialized assistants, so do not mention them; just quietly delegate through function calls. "
-            "Provide detailed information to the customer, and always double-check the database before concluding that information is unavailable. "
-            "When searching, be persistent. Expand your query bounds if the first search returns no results. "
-            "If a search comes up empty, expand your search before giving up. "
-            "When you return an answer, use the markdown format to make it more readable."
-            #"\n\nCurrent user flight information:\n<Flights>\n{user_info}\n</Flights>"
-            "\nCurrent time: {time}. "
-            "\nCurrency: {currency}. "
-            "If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. ",
-        ),
-        ("placeholder", "{messages}"),
-    ]
-).partial(time=datetime.now(), language=os.getenv("LANGUAGE"), currency=os.getenv("CURRENCY"))
+primary_assistant_prompt = assistant_prompt(
+    "Your name is CTS Travel Assistant."
+    "You are a customer service assistant for CTS Turismo (Chilean Travel Services). "
+    "CTS Turismo is a tourism company that offers varied tourism services in Chile. "
+    "The services they offer are the following: hotels, excursions and transferss. "
+    "Hotels: Hotel reservations throughout Chile. "
+    "Excursions: Tours and activities in different cities and locations in Chile. "
+    "Transfers: Transportation from one point to another, such as to and from the airport or the bus terminal, or to and from the snow or the beach, etc. "
+    "Your goal is to help users find the services described above and all other relevant information. "
+    "For that purpose, you have to determine the user's needs, "
+    "and then, if necessary, delegate the task to the appropriate specialized assistant. "
+    "You have two specialized assistants available to help you: "
+    "1. Hotel Booking Assistant: Specialized in handling hotel bookings. "
+    "2. Excursion and Transfers Booking Assistant: Specialized in handling trip recommendations/excursion bookings, and transfer services. "
+    "By default, you must give your answers in the session language given at the end. However, if the user writes to you in a different language, your answers should be in that language. "
+    "Use the tools provided to search for hotels, excursions and transfers, and other information that will help in the user's queries. "
+    #"If a customer requests to create, update or cancel a hotel, transfer or excursion reservation; or, when searching for a hotel, excursion or transfer, needs specialized recommendations, "
+    #"delegate the task to the appropriate specialized assistant by invoking the corresponding tool. You are not able to make these types of changes yourself. "
+    "The user is not aware of the different specialized assistants, so do not mention them; just quietly delegate through function calls. "
+    "Provide detailed information to the customer, and always double-check the database before concluding that information is unavailable. "
+    "When searching, be persistent. Expand your query bounds if the first search returns no results. "
+    "If a search comes up empty, expand your search before giving up. "
+    "When you return an answer, use the markdown format to make it more readable. "
+    #"\n\nCurrent user flight information:\n<Flights>\n{user_info}\n</Flights>"
+    "If user doesn't provide a year, always assume is a future date. Never use past dates to search availability. "
+)
 
 primary_assistant_tools = [
     #TavilySearchResults(max_results=1)
+    expand_tool_result,
 ]
 assistant_runnable = primary_assistant_prompt | llm.bind_tools(
     primary_assistant_tools
@@ -0,0 +1,71 @@
+"""
+Prompt assembly for the assistants, laid out for provider-side prompt caching.
+
+OpenAI reuses the longest prompt prefix it has already seen (from 1024 tokens
+on), which cuts the latency and the cost of the cached part. So every prompt
+goes, from the most stable part to the least:
+
+1. The assistant's instructions: a static system message, the same bytes for
+   every session and every call.
+2. The tool schemas, bound once at import time from fixed lists.
+3. The conversation (summary and window, see assistants/context.py).
+4. A last system message with the session and turn fields: the current time,
+   and the session's currency and language. They are read on every call, so
+   the time is no longer the one the process started at.
+
+record_usage() keeps, per assistant, the input tokens sent and the cached
+ones reported back by the API; stats() adds the hit ratio.
+"""
+import threading
+from datetime import datetime
+
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from tools import session
+
+SESSION_FIELDS = (
+    "Current time: {time}. "
+    "Currency: {currency}. "
+    "Session language: {language}."
+)
+
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def assistant_prompt(instructions: str) -> ChatPromptTemplate:
+    """The static instructions, the conversation, then the session fields."""
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", instructions),
+            ("placeholder", "{messages}"),
+            ("system", SESSION_FIELDS),
+        ]
+    ).partial(time=current_time, language=session.language, currency=session.currency)
+
+
+def current_time() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M')
+
+
+def record_usage(assistant: str, message: BaseMessage) -> None:
+    """Count the input and cached tokens the API reported for a call, if any."""
+    usage = getattr(message, 'usage_metadata', None)
+    if not usage:
+        return
+    cached = (usage.get('input_token_details') or {}).get('cache_read') or 0
+    with _stats_lock:
+        stats = _stats.setdefault(assistant, {'calls': 0, 'input_tokens': 0, 'cached_tokens': 0, 'cache_hits': 0})
+        stats['calls'] += 1
+        stats['input_tokens'] += usage.get('input_tokens') or 0
+        stats['cached_tokens'] += cached
+        stats['cache_hits'] += 1 if cached else 0
+
+
+def stats() -> dict[str, dict]:
+    with _stats_lock:
+        return {
+            assistant: {**values, 'cached_ratio': round(values['cached_tokens'] / max(values['input_tokens'], 1), 3)}
+            for assistant, values in _stats.items()
+        }
@@ -0,0 +1,86 @@
+"""
+Entry routing for each user turn.
+
+While a specialist holds the dialog (the top of State.dialog_state), the
+user's next message goes straight to it instead of through the primary
+assistant, which saves an LLM call per turn. A keyword guard sends the
+message back to the primary assistant only on an explicit request for another
+specialist's service (a request verb and its noun, e.g. "book a transfer"
+while booking a hotel) that mentions nothing of the current topic. Anything
+subtler is left to the specialist, which can still call CompleteOrEscalate.
+"""
+import re
+import threading
+import unicodedata
+from typing import Optional
+
+# Word stems of each specialist's topic, lowercase and without accents.
+# A message that mentions any of them stays with that specialist.
+TOPICS = {
+    "book_hotel": (
+        "hotel", "hostal", "hosped", "aloja", "habitac", "room", "noche", "night", "check", "cama", "bed",
+        "desayuno", "breakfast", "suite", "resort", "lodge",
+    ),
+    "book_excursion": (
+        "excursi", "tour", "traslad", "transfer", "aeropuert", "airport", "paseo", "actividad", "activit",
+        "trekking", "vinedo", "winery", "terminal", "pick", "recog",
+    ),
+}
+# Stems of the services each specialist books: asked for with a request verb,
+# they call for another specialist.
+SERVICES = {
+    "book_hotel": ("hotel", "hostal", "hosped", "aloja", "habitac", "room", "suite", "resort", "lodge"),
+    "book_excursion": ("excursi", "tour", "traslad", "transfer", "paseo", "actividad", "activit", "trekking"),
+}
+# Stems of the verbs of a new request: book, reserve, quote, search, want, need.
+REQUEST_VERBS = (
+    "book", "reserv", "cotiz", "quote", "search", "find", "encontr", "quier", "quisier", "want", "need",
+    "necesit", "contrat", "agend",
+)
+
+_stats = {"primary": 0, "specialist": 0, "escalated": 0, "handoffs": 0}
+_stats_lock = threading.Lock()
+
+
+def entry(dialog_state: Optional[list[str]], message) -> str:
+    """The node for a new user message: the active specialist, the primary assistant, or leave_skill to escalate."""
+    if not dialog_state:
+        route, counter = "primary_assistant", "primary"
+    elif off_topic(message, dialog_state[-1]):
+        route, counter = "leave_skill", "escalated"
+    else:
+        route, counter = dialog_state[-1], "specialist"
+    record(counter)
+    return route
+
+
+def record(counter: str) -> None:
+    with _stats_lock:
+        _stats[counter] += 1
+
+
+def off_topic(message, specialist: str) -> bool:
+    """True when the message asks for another specialist's service and mentions nothing of this one's topic."""
+    if specialist not in TOPICS:
+        return False
+    words = _words(message.content if isinstance(message.content, str) else str(message.content))
+    if any(word.startswith(TOPICS[specialist]) for word in words):
+        return False
+    if not any(word.startswith(REQUEST_VERBS) for word in words):
+        return False
+    return any(word.startswith(stems) for name, stems in SERVICES.items() if name != specialist for word in words)
+
+
+def stats() -> dict[str, int]:
+    """
+    Turns routed to the primary assistant, straight to a specialist (one LLM
+    call saved each), or escalated, and specialist-to-specialist handoffs
+    (one LLM call saved each too).
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _words(text: str) -> list[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return re.findall(r"\w+", "".join(char for char in text if not unicodedata.combining(char)))
@@ -0,0 +1,106 @@
+"""
+Checkpoint storage benchmark: full checkpoints against compact ones (message
+references plus compressed tool outputs), in memory and in SQLite.
+
+Replays a synthetic conversation through each checkpointer the way
+part_4_graph does: one checkpoint per graph step with the whole message list,
+each turn adding a user message, a tool call, a large availability listing
+and an answer. Reports the bytes written, the put() latency and the latency
+of loading the latest checkpoint.
+
+    poetry run python benchmark_checkpoints.py --turns 30
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.base import create_checkpoint, empty_checkpoint
+
+from checkpointer import BoundedMemorySaver, SqliteSaver
+
+
+def availability_listing(turn: int, hotels: int) -> str:
+    """A tool output shaped like the verbose hotel availability responses."""
+    lines = [f'Disponibilidad de hoteles en Santiago, búsqueda {turn}:']
+    for hotel in range(hotels):
+        lines.append(
+            f'- Hotel {hotel} (ID {1000 + hotel}), {3 + hotel % 3} estrellas, Av. Providencia {100 + hotel * 7}.\n'
+            f'  Habitación doble estándar, desayuno incluido: {85000 + hotel * 1250} CLP por noche, cancelación gratuita hasta 48 horas antes.\n'
+            f'  Habitación doble superior, media pensión: {112000 + hotel * 1410} CLP por noche, no reembolsable.'
+        )
+    return '\n'.join(lines)
+
+
+def conversation_steps(turns: int, hotels: int):
+    """The message list after each graph step."""
+    messages = []
+    for turn in range(turns):
+        call_id = f'call_{uuid.uuid4().hex[:12]}'
+        new_messages = [
+            HumanMessage(content=f'Busca hoteles en Santiago para la semana {turn}', id=str(uuid.uuid4())),
+            AIMessage(
+                content='',
+                tool_calls=[{'name': 'search_hotels', 'args': {'townId': '1', 'week': turn}, 'id': call_id}],
+                id=str(uuid.uuid4()),
+            ),
+            ToolMessage(content=availability_listing(turn, hotels), tool_call_id=call_id, id=str(uuid.uuid4())),
+            AIMessage(content=f'Encontré {hotels} hoteles disponibles para la semana {turn}.', id=str(uuid.uuid4())),
+        ]
+        for message in new_messages:
+            messages = [*messages, message]
+            yield messages
+
+
+def run(saver, turns: int, hotels: int) -> dict:
+    config = {'configurable': {'thread_id': 'benchmark', 'checkpoint_ns': ''}}
+    checkpoint = empty_checkpoint()
+    put_latencies = []
+    for step, messages in enumerate(conversation_steps(turns, hotels)):
+        checkpoint = create_checkpoint({**checkpoint, 'channel_values': {'messages': messages}}, None, step)
+        started = time.perf_counter()
+        config = saver.put(config, checkpoint, {'source': 'loop', 'step': step, 'writes': {}}, {})
+        put_latencies.append(time.perf_counter() - started)
+    get_latencies = []
+    for _ in range(20):
+        started = time.perf_counter()
+        latest = saver.get_tuple({'configurable': {'thread_id': 'benchmark', 'checkpoint_ns': ''}})
+        get_latencies.append(time.perf_counter() - started)
+    assert [message.content for message in latest.checkpoint['channel_values']['messages']] == [message.content for message in messages]
+    put_latencies.sort()
+    return {
+        'bytes_written': saver.stats()['bytes_written'],
+        'put_mean_ms': statistics.mean(put_latencies) * 1000,
+        'put_p95_ms': put_latencies[int(len(put_latencies) * 0.95)] * 1000,
+        'get_mean_ms': statistics.mean(get_latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--turns', type=int, default=30, help='conversation turns (4 checkpoints each)')
+    parser.add_argument('--hotels', type=int, default=20, help='hotels per availability listing')
+    args = parser.parse_args()
+
+    print(f'{"checkpointer":<20}{"bytes written":>16}{"put mean ms":>14}{"put p95 ms":>12}{"get mean ms":>13}')
+    with tempfile.TemporaryDirectory() as directory:
+        for name, saver in (
+            ('memory, full', BoundedMemorySaver(compact=False)),
+            ('memory, compact', BoundedMemorySaver(compact=True)),
+            ('sqlite, full', SqliteSaver(os.path.join(directory, 'full.db'), compact=False)),
+            ('sqlite, compact', SqliteSaver(os.path.join(directory, 'compact.db'), compact=True)),
+        ):
+            result = run(saver, args.turns, args.hotels)
+            print(
+                f'{name:<20}{result["bytes_written"]:>16,}{result["put_mean_ms"]:>14.2f}'
+                f'{result["put_p95_ms"]:>12.2f}{result["get_mean_ms"]:>13.2f}'
+            )
+            if isinstance(saver, SqliteSaver):
+                saver.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,803 @@
+"""
+Checkpointers for part_4_graph.
+
+With CTS_CHECKPOINT_DB set to a file path, conversations are stored in that
+SQLite database (SqliteSaver) and survive restarts, and every worker process
+on the host shares them. Otherwise they are kept in memory by the process
+that runs them (BoundedMemorySaver). create_checkpointer() picks one.
+
+MemorySaver keeps every checkpoint of every thread forever, and every
+websocket session is a new thread. Both checkpointers cap that:
+
+- Only the last CTS_CHECKPOINT_KEEP checkpoints (default 3, at least 2) of
+  each thread are kept. Resuming after an interrupt only needs the latest one
+  and its parent.
+- Threads idle for more than CTS_CHECKPOINT_TTL seconds (default 3600) are
+  evicted, and so are the least recently used ones beyond
+  CTS_CHECKPOINT_MAX_THREADS (default 1000).
+
+Checkpoints don't repeat the conversation. Every message list in a
+checkpoint (State.messages) is stored as references to messages saved once
+per thread, so each step only writes its new messages. Messages serialize
+with msgpack, and the ones larger than CTS_CHECKPOINT_COMPRESS_MIN bytes
+(default 1024, in practice the tool outputs) are zlib-compressed.
+CTS_CHECKPOINT_COMPACT=0 stores full checkpoints instead.
+
+stats() reports total and per-thread sizes of the serialized checkpoints, and
+the bytes written so far. delete_thread() drops a thread right away. benchmark_checkpoints.py compares both formats.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Container, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.types import TASKS, ChannelProtocol
+
+
+def create_checkpointer() -> Union['SqliteSaver', 'BoundedMemorySaver']:
+    """SqliteSaver on CTS_CHECKPOINT_DB when it is set, BoundedMemorySaver otherwise."""
+    path = os.getenv('CTS_CHECKPOINT_DB')
+    return SqliteSaver(path) if path else BoundedMemorySaver()
+
+
+def _keep_checkpoints(keep_checkpoints: Optional[int]) -> int:
+    keep = keep_checkpoints if keep_checkpoints is not None else int(os.getenv('CTS_CHECKPOINT_KEEP', '3'))
+    return max(keep, 2)
+
+
+def _compact(compact: Optional[bool]) -> bool:
+    return compact if compact is not None else os.getenv('CTS_CHECKPOINT_COMPACT', '1') != '0'
+
+
+# Key of a compact checkpoint holding its message references: channel -> message keys.
+MESSAGE_REFS = 'message_refs'
+
+
+class MessageKeys:
+    """
+    The key of each message object already serialized, for as long as the
+    object lives, so a step doesn't serialize the whole conversation again.
+    Messages in the graph state are never modified in place.
+    """
+
+    def __init__(self):
+        self._keys: Dict[int, Tuple[weakref.ref, str]] = {}
+
+    def get(self, message: BaseMessage) -> Optional[str]:
+        ref, key = self._keys.get(id(message), (None, None))
+        return key if ref is not None and ref() is message else None
+
+    def set(self, message: BaseMessage, key: str) -> None:
+        def forget(ref, message_id=id(message)):
+            if self._keys.get(message_id, (None,))[0] is ref:
+                del self._keys[message_id]
+
+        self._keys[id(message)] = (weakref.ref(message, forget), key)
+
+
+def split_messages(
+    serde: SerializerProtocol, checkpoint: Checkpoint, stored: Container[str], keys: Optional[MessageKeys] = None
+) -> Tuple[Checkpoint, Dict[str, Tuple[str, bytes]]]:
+    """
+    The checkpoint with its message lists replaced by message keys, and the
+    messages that are not in `stored` yet, serialized, by key.
+    """
+    channel_values = dict(checkpoint['channel_values'])
+    refs: Dict[str, List[str]] = {}
+    new: Dict[str, Tuple[str, bytes]] = {}
+    for channel, value in checkpoint['channel_values'].items():
+        if not (isinstance(value, list) and value and all(isinstance(message, BaseMessage) and message.id for message in value)):
+            continue
+        channel_refs = []
+        for message in value:
+            key = keys.get(message) if keys else None
+            if key is None or (key not in stored and key not in new):
+                value_type, data = serde.dumps_typed(message)
+                # add_messages replaces a message by ID: the key covers its content too.
+                key = f'{message.id}:{hashlib.blake2b(data, digest_size=8).hexdigest()}'
+                if key not in stored and key not in new:
+                    new[key] = _compress(value_type, data)
+                if keys:
+                    keys.set(message, key)
+            channel_refs.append(key)
+        refs[channel] = channel_refs
+        del channel_values[channel]
+    if not refs:
+        return checkpoint, new
+    return {**checkpoint, 'channel_values': channel_values, MESSAGE_REFS: refs}, new
+
+
+def known_keys(checkpoint: Checkpoint, keys: MessageKeys) -> List[str]:
+    """The keys already computed for the checkpoint's messages."""
+    return [
+        key
+        for value in checkpoint['channel_values'].values()
+        if isinstance(value, list)
+        for message in value
+        if isinstance(message, BaseMessage) and (key := keys.get(message))
+    ]
+
+
+def join_messages(serde: SerializerProtocol, checkpoint: Checkpoint, messages: Mapping[str, Tuple[str, bytes]]) -> Checkpoint:
+    """The full checkpoint from a compact one, given the thread's messages by key."""
+    refs = checkpoint.pop(MESSAGE_REFS, None)
+    if refs:
+        checkpoint['channel_values'] = {
+            **checkpoint['channel_values'],
+            **{channel: [_decompress(serde, messages[key]) for key in keys] for channel, keys in refs.items()},
+        }
+    return checkpoint
+
+
+def _compress(value_type: str, data: bytes) -> Tuple[str, bytes]:
+    if len(data) < int(os.getenv('CTS_CHECKPOINT_COMPRESS_MIN', '1024')):
+        return value_type, data
+    return f'{value_type}+zlib', zlib.compress(data, 1)
+
+
+def _decompress(serde: SerializerProtocol, blob: Tuple[str, bytes]) -> Any:
+    value_type, data = blob
+    if value_type.endswith('+zlib'):
+        value_type, data = value_type[:-len('+zlib')], zlib.decompress(data)
+    return serde.loads_typed((value_type, data))
+
+
+class BoundedMemorySaver(MemorySaver):
+    def __init__(
+        self,
+        *,
+        max_threads: Optional[int] = None,
+        thread_ttl: Optional[float] = None,
+        keep_checkpoints: Optional[int] = None,
+        compact: Optional[bool] = None,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> None:
+        super().__init__(serde=serde)
+        self.max_threads = max_threads if max_threads is not None else int(os.getenv('CTS_CHECKPOINT_MAX_THREADS', '1000'))
+        self.thread_ttl = thread_ttl if thread_ttl is not None else float(os.getenv('CTS_CHECKPOINT_TTL', '3600'))
+        self.keep_checkpoints = _keep_checkpoints(keep_checkpoints)
+        self.compact = _compact(compact)
+        # thread_id -> message key -> serialized message, for compact checkpoints.
+        self.messages: Dict[str, Dict[str, Tuple[str, bytes]]] = {}
+        self._message_keys = MessageKeys()
+        # thread_id -> last use, least recently used first.
+        self._last_used: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = {'evicted_ttl': 0, 'evicted_lru': 0, 'pruned_checkpoints': 0, 'bytes_written': 0}
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            result = super().get_tuple(config)
+            self._touch(config['configurable']['thread_id'])
+            return result and self._join(result)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        # Materialized under the lock, so eviction can't change the storage mid-iteration.
+        with self._lock:
+            checkpoints = [self._join(result) for result in super().list(config, filter=filter, before=before, limit=limit)]
+        yield from checkpoints
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config['configurable']['thread_id']
+        with self._lock:
+            new = {}
+            if self.compact:
+                checkpoint, new = split_messages(self.serde, checkpoint, self.messages.get(thread_id, {}), self._message_keys)
+                self.messages.setdefault(thread_id, {}).update(new)
+            result = super().put(config, checkpoint, metadata, new_versions)
+            saved, saved_metadata, _ = self.storage[thread_id][config['configurable']['checkpoint_ns']][checkpoint['id']]
+            self._stats['bytes_written'] += len(saved[1]) + len(saved_metadata[1]) + sum(len(data) for _, data in new.values())
+            self._prune(thread_id, config['configurable']['checkpoint_ns'])
+            self._touch(thread_id)
+            self._evict()
+            return result
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        with self._lock:
+            super().put_writes(config, writes, task_id)
+            thread_id = config['configurable']['thread_id']
+            saved = self.writes[(thread_id, config['configurable']['checkpoint_ns'], config['configurable']['checkpoint_id'])]
+            for idx, (channel, _) in enumerate(writes):
+                self._stats['bytes_written'] += len(saved[(task_id, WRITES_IDX_MAP.get(channel, idx))][2][1])
+            self._touch(thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Drop every checkpoint, write and message of the thread."""
+        with self._lock:
+            self._drop(thread_id)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self.delete_thread(thread_id)
+
+    def stats(self, top: int = 5) -> dict:
+        """Totals, plus the `top` largest threads."""
+        with self._lock:
+            self._evict()
+            threads = [self.thread_stats(thread_id) for thread_id in self._last_used]
+        threads.sort(key=lambda thread: thread['bytes'], reverse=True)
+        return {
+            **self._stats,
+            'threads': len(threads),
+            'checkpoints': sum(thread['checkpoints'] for thread in threads),
+            'bytes': sum(thread['bytes'] for thread in threads),
+            'largest_threads': threads[:top],
+        }
+
+    def thread_stats(self, thread_id: str) -> dict:
+        with self._lock:
+            checkpoints = 0
+            size = 0
+            for checkpoint_ns, saved in self.storage.get(thread_id, {}).items():
+                for checkpoint_id, (checkpoint, metadata, _) in saved.items():
+                    checkpoints += 1
+                    size += len(checkpoint[1]) + len(metadata[1])
+                    for _, _, value in self.writes.get((thread_id, checkpoint_ns, checkpoint_id), {}).values():
+                        size += len(value[1])
+            size += sum(len(data) for _, data in self.messages.get(thread_id, {}).values())
+            last_used = self._last_used.get(thread_id)
+            return {
+                'thread_id': thread_id,
+                'checkpoints': checkpoints,
+                'bytes': size,
+                'idle_seconds': None if last_used is None else round(time.monotonic() - last_used, 1),
+            }
+
+    def _join(self, result: CheckpointTuple) -> CheckpointTuple:
+        thread_id = result.config['configurable']['thread_id']
+        return result._replace(checkpoint=join_messages(self.serde, result.checkpoint, self.messages.get(thread_id, {})))
+
+    def _touch(self, thread_id: str) -> None:
+        if not any(self.storage.get(thread_id, {}).values()):
+            # Reads of unknown threads leave empty entries in MemorySaver's defaultdicts.
+            self.storage.pop(thread_id, None)
+            return
+        self._last_used[thread_id] = time.monotonic()
+        self._last_used.move_to_end(thread_id)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        saved = self.storage[thread_id][checkpoint_ns]
+        if len(saved) <= self.keep_checkpoints:
+            return
+        # Checkpoint IDs sort in creation order.
+        for checkpoint_id in sorted(saved)[:-self.keep_checkpoints]:
+            _, _, parent_checkpoint_id = saved.pop(checkpoint_id)
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            # Reading a checkpoint also leaves an empty writes entry for its parent.
+            self.writes.pop((thread_id, checkpoint_ns, parent_checkpoint_id), None)
+            self._stats['pruned_checkpoints'] += 1
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._last_used:
+            thread_id, last_used = next(iter(self._last_used.items()))
+            if now - last_used > self.thread_ttl:
+                self._stats['evicted_ttl'] += 1
+            elif len(self._last_used) > self.max_threads:
+                self._stats['evicted_lru'] += 1
+            else:
+                break
+            self._drop(thread_id)
+
+    def _drop(self, thread_id: str) -> None:
+        self._last_used.pop(thread_id, None)
+        self.messages.pop(thread_id, None)
+        for checkpoint_ns, saved in self.storage.pop(thread_id, {}).items():
+            for checkpoint_id, (_, _, parent_checkpoint_id) in saved.items():
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+                if parent_checkpoint_id:
+                    self.writes.pop((thread_id, checkpoint_ns, parent_checkpoint_id), None)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL,
+    message_key TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, message_key)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_last_used ON threads (last_used);
+"""
+
+
+class SqliteSaver(BaseCheckpointSaver[str]):
+    """
+    Checkpointer on a SQLite database in WAL mode.
+
+    Several worker processes on one host can share the file: readers never
+    block, writers take the database lock up front (BEGIN IMMEDIATE) and wait
+    up to CTS_CHECKPOINT_BUSY_TIMEOUT seconds (default 5) for each other.
+    Every put() and put_writes() is a single transaction, the writes of a
+    task go in one batch, and commits don't fsync (synchronous=NORMAL): a
+    power loss can lose the last commits, never corrupt the file.
+
+    Retention matches BoundedMemorySaver, except that TTL and LRU eviction
+    run at most every CTS_CHECKPOINT_SWEEP seconds (default 60) per process.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        max_threads: Optional[int] = None,
+        thread_ttl: Optional[float] = None,
+        keep_checkpoints: Optional[int] = None,
+        busy_timeout: Optional[float] = None,
+        sweep_interval: Optional[float] = None,
+        compact: Optional[bool] = None,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> None:
+        super().__init__(serde=serde)
+        self.path = path
+        self.max_threads = max_threads if max_threads is not None else int(os.getenv('CTS_CHECKPOINT_MAX_THREADS', '1000'))
+        self.thread_ttl = thread_ttl if thread_ttl is not None else float(os.getenv('CTS_CHECKPOINT_TTL', '3600'))
+        self.keep_checkpoints = _keep_checkpoints(keep_checkpoints)
+        self.busy_timeout = busy_timeout if busy_timeout is not None else float(os.getenv('CTS_CHECKPOINT_BUSY_TIMEOUT', '5'))
+        self.sweep_interval = sweep_interval if sweep_interval is not None else float(os.getenv('CTS_CHECKPOINT_SWEEP', '60'))
+        self.compact = _compact(compact)
+        self._message_keys = MessageKeys()
+        # sqlite3 connections can't be shared between threads: one per thread.
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {'evicted_ttl': 0, 'evicted_lru': 0, 'pruned_checkpoints': 0, 'bytes_written': 0}
+        self._connection().executescript(_SCHEMA)
+
+    # Sync interface
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config['configurable']['thread_id']
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        checkpoint_id = get_checkpoint_id(config)
+        connection = self._connection()
+        query = (
+            'SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints '
+            'WHERE thread_id = ? AND checkpoint_ns = ?'
+        )
+        if checkpoint_id:
+            row = connection.execute(f'{query} AND checkpoint_id = ?', (thread_id, checkpoint_ns, checkpoint_id)).fetchone()
+        else:
+            row = connection.execute(f'{query} ORDER BY checkpoint_id DESC LIMIT 1', (thread_id, checkpoint_ns)).fetchone()
+        if row is None:
+            return None
+        return self._load(connection, thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        yield from self._list(config, filter=filter, before=before, limit=limit)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config['configurable']['thread_id']
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        saved = checkpoint.copy()
+        saved.pop('pending_sends', None)
+        new = {}
+        if self.compact:
+            stored = self._stored_keys(thread_id, known_keys(saved, self._message_keys))
+            saved, new = split_messages(self.serde, saved, stored, self._message_keys)
+        checkpoint_type, checkpoint_data = self.serde.dumps_typed(saved)
+        metadata_type, metadata_data = self.serde.dumps_typed(metadata)
+        with self._transaction() as connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?)',
+                [(thread_id, key, value_type, data) for key, (value_type, data) in new.items()],
+            )
+            connection.execute(
+                'INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint['id'],
+                    config['configurable'].get('checkpoint_id'),
+                    checkpoint_type,
+                    checkpoint_data,
+                    metadata_type,
+                    metadata_data,
+                ),
+            )
+            self._prune(connection, thread_id, checkpoint_ns)
+            self._touch(connection, thread_id)
+        self._written(len(checkpoint_data) + len(metadata_data) + sum(len(data) for _, data in new.values()))
+        self._maybe_sweep()
+        return {
+            'configurable': {
+                'thread_id': thread_id,
+                'checkpoint_ns': checkpoint_ns,
+                'checkpoint_id': checkpoint['id'],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        thread_id = config['configurable']['thread_id']
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        checkpoint_id = config['configurable']['checkpoint_id']
+        rows = [
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, *self.serde.dumps_typed(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        # Special writes (errors, scheduled) replace the previous ones, like in MemorySaver.
+        verb = 'INSERT OR REPLACE' if all(channel in WRITES_IDX_MAP for channel, _ in writes) else 'INSERT OR IGNORE'
+        with self._transaction() as connection:
+            connection.executemany(f'{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._touch(connection, thread_id)
+        self._written(sum(len(row[-1]) for row in rows))
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Drop every checkpoint, write and message of the thread."""
+        with self._transaction() as connection:
+            for table in ('checkpoints', 'writes', 'messages', 'threads'):
+                connection.execute(f'DELETE FROM {table} WHERE thread_id = ?', (thread_id,))
+
+    def get_next_version(self, current: Optional[str], channel: ChannelProtocol) -> str:
+        # Same versions as MemorySaver, so threads can move between the two.
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split('.')[0])
+        return f'{current_v + 1:032}.{random.random():016}'
+
+    # Async interface: the sync methods, on the default executor.
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoints = await asyncio.get_running_loop().run_in_executor(
+            None, partial(self._list, config, filter=filter, before=before, limit=limit)
+        )
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.get_running_loop().run_in_executor(None, self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.put_writes, config, writes, task_id)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.delete_thread, thread_id)
+
+    # Stats and maintenance
+
+    def stats(self, top: int = 5) -> dict:
+        """Totals, plus the `top` largest threads. Totals cover every process; counters only this one."""
+        connection = self._connection()
+        threads, checkpoints, size = connection.execute(
+            'SELECT COUNT(DISTINCT thread_id), COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints'
+        ).fetchone()
+        for table in ('writes', 'messages'):
+            size += connection.execute(f'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM {table}').fetchone()[0]
+        largest = connection.execute(
+            'SELECT thread_id FROM checkpoints GROUP BY thread_id '
+            'ORDER BY SUM(LENGTH(checkpoint) + LENGTH(metadata)) DESC LIMIT ?',
+            (top,),
+        ).fetchall()
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return {
+            **counters,
+            'threads': threads,
+            'checkpoints': checkpoints,
+            'bytes': size,
+            'file_bytes': sum(os.path.getsize(f'{self.path}{suffix}') for suffix in ('', '-wal') if os.path.exists(f'{self.path}{suffix}')),
+            'largest_threads': [self.thread_stats(thread_id) for thread_id, in largest],
+        }
+
+    def thread_stats(self, thread_id: str) -> dict:
+        connection = self._connection()
+        checkpoints, size = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints WHERE thread_id = ?',
+            (thread_id,),
+        ).fetchone()
+        for table in ('writes', 'messages'):
+            size += connection.execute(
+                f'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM {table} WHERE thread_id = ?', (thread_id,)
+            ).fetchone()[0]
+        row = connection.execute('SELECT last_used FROM threads WHERE thread_id = ?', (thread_id,)).fetchone()
+        return {
+            'thread_id': thread_id,
+            'checkpoints': checkpoints,
+            'bytes': size,
+            'idle_seconds': None if row is None else round(time.time() - row[0], 1),
+        }
+
+    def sweep(self) -> None:
+        """Evict the threads idle for more than thread_ttl, then the least recently used beyond max_threads."""
+        with self._transaction() as connection:
+            expired = connection.execute(
+                'SELECT thread_id FROM threads WHERE last_used < ?', (time.time() - self.thread_ttl,)
+            ).fetchall()
+            excess = connection.execute(
+                'SELECT thread_id FROM threads WHERE last_used >= ? ORDER BY last_used DESC LIMIT -1 OFFSET ?',
+                (time.time() - self.thread_ttl, self.max_threads),
+            ).fetchall()
+            for table in ('checkpoints', 'writes', 'messages', 'threads'):
+                connection.executemany(f'DELETE FROM {table} WHERE thread_id = ?', expired + excess)
+        with self._stats_lock:
+            self._stats['evicted_ttl'] += len(expired)
+            self._stats['evicted_lru'] += len(excess)
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    # Helpers
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # isolation_level=None: transactions are opened explicitly by _transaction().
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self._connection()
+        # Take the write lock up front: a deferred transaction that upgrades
+        # from read to write fails with SQLITE_BUSY instead of waiting.
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> List[CheckpointTuple]:
+        conditions, params = [], []
+        if config:
+            conditions.append('thread_id = ?')
+            params.append(config['configurable']['thread_id'])
+            if config['configurable'].get('checkpoint_ns') is not None:
+                conditions.append('checkpoint_ns = ?')
+                params.append(config['configurable']['checkpoint_ns'])
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append('checkpoint_id = ?')
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            conditions.append('checkpoint_id < ?')
+            params.append(before_checkpoint_id)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        connection = self._connection()
+        rows = connection.execute(
+            'SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata '
+            f'FROM checkpoints {where} ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC',
+            params,
+        ).fetchall()
+        checkpoints = []
+        messages: Dict[str, Dict[str, Tuple[str, bytes]]] = {}
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and len(checkpoints) >= limit:
+                break
+            metadata = self.serde.loads_typed((row[4], row[5]))
+            if filter and not all(metadata.get(key) == value for key, value in filter.items()):
+                continue
+            checkpoints.append(self._load(connection, thread_id, checkpoint_ns, row, messages))
+        return checkpoints
+
+    def _load(
+        self,
+        connection: sqlite3.Connection,
+        thread_id: str,
+        checkpoint_ns: str,
+        row: Sequence,
+        messages: Optional[Dict[str, Dict[str, Tuple[str, bytes]]]] = None,
+    ) -> CheckpointTuple:
+        """The checkpoint tuple of a checkpoints row. `messages` caches the threads' messages across calls."""
+        checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata = row
+        checkpoint = self.serde.loads_typed((checkpoint_type, checkpoint))
+        if MESSAGE_REFS in checkpoint:
+            messages = {} if messages is None else messages
+            if thread_id not in messages:
+                messages[thread_id] = {
+                    key: (value_type, value)
+                    for key, value_type, value in connection.execute(
+                        'SELECT message_key, type, value FROM messages WHERE thread_id = ?', (thread_id,)
+                    )
+                }
+            checkpoint = join_messages(self.serde, checkpoint, messages[thread_id])
+        writes = connection.execute(
+            'SELECT task_id, channel, type, value FROM writes '
+            'WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx',
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        sends = []
+        if parent_checkpoint_id:
+            sends = connection.execute(
+                'SELECT type, value FROM writes '
+                'WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? AND channel = ? ORDER BY task_id, idx',
+                (thread_id, checkpoint_ns, parent_checkpoint_id, TASKS),
+            ).fetchall()
+        return CheckpointTuple(
+            config={
+                'configurable': {
+                    'thread_id': thread_id,
+                    'checkpoint_ns': checkpoint_ns,
+                    'checkpoint_id': checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint,
+                'pending_sends': [self.serde.loads_typed(send) for send in sends],
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config={
+                'configurable': {
+                    'thread_id': thread_id,
+                    'checkpoint_ns': checkpoint_ns,
+                    'checkpoint_id': parent_checkpoint_id,
+                }
+            }
+            if parent_checkpoint_id
+            else None,
+            pending_writes=[(task_id, channel, self.serde.loads_typed((value_type, value))) for task_id, channel, value_type, value in writes],
+        )
+
+    def _stored_keys(self, thread_id: str, keys: List[str]) -> set:
+        """Which of these message keys the thread has stored, without reading the thread's other keys."""
+        stored = set()
+        connection = self._connection()
+        # Stay under SQLite's limit of bound parameters per statement.
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            stored.update(key for key, in connection.execute(
+                f'SELECT message_key FROM messages WHERE thread_id = ? AND message_key IN ({",".join("?" * len(chunk))})',
+                (thread_id, *chunk),
+            ))
+        return stored
+
+    def _touch(self, connection: sqlite3.Connection, thread_id: str) -> None:
+        connection.execute('INSERT OR REPLACE INTO threads VALUES (?, ?)', (thread_id, time.time()))
+
+    def _prune(self, connection: sqlite3.Connection, thread_id: str, checkpoint_ns: str) -> None:
+        row = connection.execute(
+            'SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? '
+            'ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?',
+            (thread_id, checkpoint_ns, self.keep_checkpoints - 1),
+        ).fetchone()
+        if row is None:
+            return
+        # Checkpoint IDs sort in creation order: drop everything older than the oldest one kept,
+        # including the writes of its parent.
+        pruned = connection.execute(
+            'DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?',
+            (thread_id, checkpoint_ns, row[0]),
+        ).rowcount
+        connection.execute(
+            'DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?',
+            (thread_id, checkpoint_ns, row[0]),
+        )
+        with self._stats_lock:
+            self._stats['pruned_checkpoints'] += pruned
+
+    def _written(self, size: int) -> None:
+        with self._stats_lock:
+            self._stats['bytes_written'] += size
+
+    def _maybe_sweep(self) -> None:
+        now = time.monotonic()
+        with self._stats_lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        self.sweep()
@@ -1,16 +1,19 @@
 from typing import Literal, Dict, List, Union
 from langchain_core.runnables import Runnable
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import tools_condition
 from state import State
 from assistants.primary import assistant_runnable, primary_assistant_tools
-from assistants.hotel_booking import book_hotel_runnable, book_hotel_safe_tools, book_hotel_sensitive_tools
-from assistants.excursion_booking import book_excursion_runnable, book_excursion_safe_tools, book_excursion_sensitive_tools
+from assistants.hotel_booking import book_hotel_runnable, book_hotel_safe_tools, book_hotel_tools
+from assistants.excursion_booking import book_excursion_runnable, book_excursion_safe_tools, book_excursion_tools
 from assistants.assistant import Assistant, CompleteOrEscalate
 from assistants.primary import ToHotelBookingAssistant, ToBookExcursion
+from assistants import routing
 from langchain_core.messages import ToolMessage, AIMessage, HumanMessage, SystemMessage
-from utilities import create_tool_node_with_fallback, create_entry_node, _print_event
+from tools.hotel_tools import prefetch_hotel_search
+from tools.excursion_tools import prefetch_excursion_search
+from checkpointer import create_checkpointer
+from utilities import create_tool_node_with_fallback, create_entry_node, create_assistant_node, skipped_tool_calls, _print_event
 import uuid
 
 builder = StateGraph(State)
@@ -21,11 +24,11 @@ builder = StateGraph(State)
 
 
 # Primary assistant
-builder.add_node("primary_assistant", Assistant(assistant_runnable))
+# General questions about CTS are answered from the semantic answer cache when possible.
+builder.add_node("primary_assistant", create_assistant_node(assistant_runnable, "primary_assistant", cache_answers=True))
 builder.add_node(
     "primary_assistant_tools", create_tool_node_with_fallback(primary_assistant_tools)
 )
-builder.add_edge(START, "primary_assistant")
 
 # This node will be shared for exiting all specialized assistants
 def pop_dialog_state(state: State) -> dict:
@@ -35,14 +38,18 @@ def pop_dialog_state(state: State) -> dict:
     to specific sub-graphs.
     """
     messages = []
-    if state["messages"][-1].tool_calls:
-        # Note: Doesn't currently handle the edge case where the llm performs parallel tool calls
+    # A user message escalated by route_to_workflow has no tool call to answer.
+    if isinstance(state["messages"][-1], AIMessage) and state["messages"][-1].tool_calls:
+        tool_calls = state["messages"][-1].tool_calls
+        # Answer the CompleteOrEscalate call, and every other call of the batch, which is not run.
+        tool_call = next((tc for tc in tool_calls if tc["name"] == CompleteOrEscalate.__name__), tool_calls[0])
         messages.append(
             ToolMessage(
                 content="Resuming dialog with the host assistant. Please reflect on the past conversation and assist the user as needed.",
-                tool_call_id=state["messages"][-1].tool_calls[0]["id"],
+                tool_call_id=tool_call["id"],
             )
         )
+        messages += skipped_tool_calls(tool_calls, tool_call["id"], "the dialog went back to the host assistant.")
     return {
         "dialog_state": "pop",
         "messages": messages,
@@ -54,24 +61,26 @@ builder.add_edge("leave_skill", "primary_assistant")
 
 # Hotel booking assistant
 builder.add_node(
-    "enter_book_hotel", create_entry_node("Hotel Booking Assistant", "book_hotel")
+    "enter_book_hotel",
+    create_entry_node("Hotel Booking Assistant", "book_hotel", ToHotelBookingAssistant.__name__, prefetch_hotel_search),
 )
-builder.add_node("book_hotel", Assistant(book_hotel_runnable))
+builder.add_node("book_hotel", create_assistant_node(book_hotel_runnable, "book_hotel"))
 builder.add_edge("enter_book_hotel", "book_hotel")
 builder.add_node(
     "book_hotel_safe_tools",
     create_tool_node_with_fallback(book_hotel_safe_tools),
 )
+# A batch with a sensitive call runs whole here, safe calls included, once approved.
 builder.add_node(
     "book_hotel_sensitive_tools",
-    create_tool_node_with_fallback(book_hotel_sensitive_tools),
+    create_tool_node_with_fallback(book_hotel_tools),
 )
 
 
 def route_book_hotel(
     state: State,
 ) -> Literal[
-    "leave_skill", "book_hotel_safe_tools", "book_hotel_sensitive_tools", "__end__"
+    "leave_skill", "enter_book_excursion", "book_hotel_safe_tools", "book_hotel_sensitive_tools", "__end__"
 ]:
     route = tools_condition(state)
     if route == END:
@@ -80,6 +89,9 @@ def route_book_hotel(
     did_cancel = any(tc["name"] == CompleteOrEscalate.__name__ for tc in tool_calls)
     if did_cancel:
         return "leave_skill"
+    # Cross-sell: hand off to the excursion assistant without going through the primary one.
+    if any(tc["name"] == ToBookExcursion.__name__ for tc in tool_calls):
+        return "enter_book_excursion"
     tool_names = [t.name for t in book_hotel_safe_tools]
     if all(tc["name"] in tool_names for tc in tool_calls):
         return "book_hotel_safe_tools"
@@ -93,9 +105,9 @@ builder.add_conditional_edges("book_hotel", route_book_hotel)
 # Excursion assistant
 builder.add_node(
     "enter_book_excursion",
-    create_entry_node("Trip Recommendation Assistant", "book_excursion"),
+    create_entry_node("Trip Recommendation Assistant", "book_excursion", ToBookExcursion.__name__, prefetch_excursion_search),
 )
-builder.add_node("book_excursion", Assistant(book_excursion_runnable))
+builder.add_node("book_excursion", create_assistant_node(book_excursion_runnable, "book_excursion"))
 builder.add_edge("enter_book_excursion", "book_excursion")
 builder.add_node(
     "book_excursion_safe_tools",
@@ -103,7 +115,7 @@ builder.add_node(
 )
 builder.add_node(
     "book_excursion_sensitive_tools",
-    create_tool_node_with_fallback(book_excursion_sensitive_tools),
+    create_tool_node_with_fallback(book_excursion_tools),
 )
 
 
@@ -113,6 +125,7 @@ def route_book_excursion(
     "book_excursion_safe_tools",
     "book_excursion_sensitive_tools",
     "leave_skill",
+    "enter_book_hotel",
     "__end__",
 ]:
     route = tools_condition(state)
@@ -122,6 +135,8 @@ def route_book_excursion(
     did_cancel = any(tc["name"] == CompleteOrEscalate.__name__ for tc in tool_calls)
     if did_cancel:
         return "leave_skill"
+    if any(tc["name"] == ToHotelBookingAssistant.__name__ for tc in tool_calls):
+        return "enter_book_hotel"
     tool_names = [t.name for t in book_excursion_safe_tools]
     if all(tc["name"] in tool_names for tc in tool_calls):
         return "book_excursion_safe_tools"
@@ -145,10 +160,12 @@ def route_primary_assistant(
         return END
     tool_calls = state["messages"][-1].tool_calls
     if tool_calls:
-        if tool_calls[0]["name"] == ToHotelBookingAssistant.__name__:
-            return "enter_book_hotel"
-        elif tool_calls[0]["name"] == ToBookExcursion.__name__:
-            return "enter_book_excursion"
+        # A delegation anywhere in a parallel batch wins; the entry node answers the other calls.
+        for tc in tool_calls:
+            if tc["name"] == ToHotelBookingAssistant.__name__:
+                return "enter_book_hotel"
+            elif tc["name"] == ToBookExcursion.__name__:
+                return "enter_book_excursion"
         return "primary_assistant_tools"
     raise ValueError("Invalid route")
 
@@ -176,18 +193,17 @@ def route_to_workflow(
     "primary_assistant",
     "book_hotel",
     "book_excursion",
+    "leave_skill",
 ]:
-    """If we are in a delegated state, route directly to the appropriate assistant."""
-    dialog_state = state.get("dialog_state")
-    if not dialog_state:
-        return "primary_assistant"
-    return dialog_state[-1]
+    """If we are in a delegated state, route directly to the appropriate assistant,
+    unless the message is clearly for another one: then escalate to the primary assistant."""
+    return routing.entry(state.get("dialog_state"), state["messages"][-1])
 
 
-#builder.add_conditional_edges("fetch_user_info", route_to_workflow)
+builder.add_conditional_edges(START, route_to_workflow)
 
 # Compile graph
-memory = MemorySaver()
+memory = create_checkpointer()
 part_4_graph = builder.compile(
     checkpointer=memory,
     # Let the user approve or deny the use of sensitive tools
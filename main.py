@@ -1,14 +1,23 @@
-from fastapi import FastAPI, HTTPException, WebSocket
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, WebSocket
 from pydantic import BaseModel
 from langgraph.graph import StateGraph
-from graph import part_4_graph
+from graph import part_4_graph, memory
+import hmac
+import os
 import uuid
 import json
-import os
+import time
 from state import State
-from langchain_core.messages import ToolMessage, AIMessage
+from langchain_core.messages import ToolMessage, AIMessage, AIMessageChunk
 from utilities import _print_event
 from fastapi.middleware.cors import CORSMiddleware
+from tools import cts_client, fanout, formatting, prefetch
+from tools.cache import cache_stats, token_scope
+from tools.hotel_tools import hotel_towns
+from tools.excursion_tools import transport_towns
+from tools.resilience import LatencyWindow
+from assistants import answer_cache, assistant, context, models, prompts, routing
 
 # Crear la aplicación FastAPI
 app = FastAPI()
@@ -29,39 +38,193 @@ sessions = {}
 class Message(BaseModel):
     content: str
 
+# Time from the user's message to the first streamed token of each turn.
+first_token_latency = LatencyWindow()
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "cts_pool": cts_client.pool_stats(),
+        "cts_resilience": cts_client.resilience_stats(),
+        "towns": {"hotels": hotel_towns.stats(), "transport": transport_towns.stats()},
+        "caches": cache_stats(),
+        "tool_output": formatting.stats(),
+        "fanout": fanout.stats(),
+        "prefetch": prefetch.stats(),
+        "first_token": first_token_latency.stats(),
+        "checkpoints": memory.stats(),
+        "context": context.stats(),
+        "routing": routing.stats(),
+        "prompt_cache": prompts.stats(),
+        "models": models.stats(),
+        "reprompts": assistant.stats(),
+        "answer_cache": answer_cache.stats(),
+    }
+
+@app.post("/admin/answer-cache/flush")
+async def flush_answer_cache(language: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Empty the semantic answer cache, or one language of it. Needs the CTS_ADMIN_TOKEN in X-Admin-Token."""
+    admin_token = os.getenv("CTS_ADMIN_TOKEN")
+    if not admin_token or not hmac.compare_digest(x_admin_token or "", admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {"flushed": answer_cache.flush(language)}
+
+@app.on_event("shutdown")
+async def close_cts_client():
+    cts_client.close()
+    await cts_client.aclose()
+
+async def stream_turn(websocket: WebSocket, inputs: dict, config: dict) -> set[str]:
+    """
+    Stream one user turn to the websocket, token by token, as JSON frames:
+
+    {"type": "start", "id", "node"}: an assistant message starts.
+    {"type": "delta", "id", "content"}: the next tokens of that message.
+    {"type": "tool", "id", "name", "status"}: a tool call was "started" or is "done".
+    {"type": "end", "id", "content"}: the message is complete, with its full text.
+    {"type": "done", "thread_id"}: the turn is over.
+
+    Returns the ids of the messages sent.
+    """
+    started = time.monotonic()
+    first_token = True
+    open_messages: dict[str, list[str]] = {}
+    finished: set[str] = set()
+    tools_started: dict[str, str] = {}
+
+    async def start(message_id, metadata):
+        nonlocal first_token
+        if first_token:
+            first_token_latency.add(time.monotonic() - started)
+            first_token = False
+        open_messages[message_id] = []
+        await websocket.send_json({"type": "start", "id": message_id, "node": metadata.get("langgraph_node")})
+
+    async def end(message_id):
+        content = "".join(open_messages.pop(message_id))
+        finished.add(message_id)
+        await websocket.send_json({"type": "end", "id": message_id, "content": content})
+
+    async for message, metadata in part_4_graph.astream(inputs, config, stream_mode="messages"):
+        if message.id in finished or metadata.get("nostream"):
+            # Internal calls, such as the context summary, are not for the user.
+            continue
+        for message_id in [message_id for message_id in open_messages if message_id != message.id]:
+            await end(message_id)
+        if isinstance(message, AIMessage):
+            calls = message.tool_call_chunks if isinstance(message, AIMessageChunk) else message.tool_calls
+            for call in calls:
+                if call.get("id") and call.get("name") and call["id"] not in tools_started:
+                    tools_started[call["id"]] = call["name"]
+                    await websocket.send_json({"type": "tool", "id": call["id"], "name": call["name"], "status": "started"})
+            if isinstance(message.content, str) and message.content:
+                if message.id not in open_messages:
+                    await start(message.id, metadata)
+                open_messages[message.id].append(message.content)
+                await websocket.send_json({"type": "delta", "id": message.id, "content": message.content})
+            if not isinstance(message, AIMessageChunk) and message.id in open_messages:
+                # A model that did not stream: its whole answer came at once.
+                await end(message.id)
+        elif isinstance(message, ToolMessage) and message.tool_call_id in tools_started:
+            name = tools_started.pop(message.tool_call_id)
+            await websocket.send_json({"type": "tool", "id": message.tool_call_id, "name": name, "status": "done"})
+    for message_id in list(open_messages):
+        await end(message_id)
+    await websocket.send_json({"type": "done", "thread_id": config["configurable"]["thread_id"]})
+    return finished
+
+async def open_thread(websocket: WebSocket, thread_id: Optional[str], token: Optional[str]) -> tuple[str, set[str], Optional[str]]:
+    """
+    The session's thread, the ids of the messages already in it and its owner.
+
+    Reconnecting with ?thread_id=<id> resumes that conversation if the token
+    of the first message has the scope the thread was started with, and then
+    sends {"type": "session", "thread_id", "resumed": true, "pending"}. Any
+    other resume starts a new thread, announced with "resumed": false, whose
+    owner is None until its first turn records it. With CTS_CHECKPOINT_DB set
+    the thread is found whichever worker took the connection.
+    """
+    if not thread_id:
+        # Crear un identificador único para cada sesión
+        return str(uuid.uuid4()), set(), None
+    snapshot = await part_4_graph.aget_state({"configurable": {"thread_id": thread_id}})
+    owner = (snapshot.values or {}).get("owner")
+    if token and owner and hmac.compare_digest(owner, token_scope(token)):
+        history = snapshot.values.get("messages", [])
+        await websocket.send_json({"type": "session", "thread_id": thread_id, "resumed": True, "pending": list(snapshot.next)})
+        return thread_id, {message.id for message in history}, owner
+    thread_id = str(uuid.uuid4())
+    await websocket.send_json({"type": "session", "thread_id": thread_id, "resumed": False, "pending": []})
+    return thread_id, set(), None
+
+async def turn_inputs(json_data: dict, config: dict) -> Optional[dict]:
+    """
+    The graph input for one client message, or None to continue the run.
+
+    A run stopped before a sensitive tool waits for the user: {"approve": true}
+    runs the tool, and any other message denies it, with the message as the
+    reason, so the assistant can answer it.
+    """
+    message = json_data.get("message")
+    snapshot = await part_4_graph.aget_state(config)
+    if not snapshot.next:
+        return {"messages": [{"role": "user", "type": "text", "content": message}]}
+    if json_data.get("approve") is not True:
+        calls = snapshot.values["messages"][-1].tool_calls
+        await part_4_graph.aupdate_state(config, {"messages": [
+            ToolMessage(
+                content=f"API call denied by user. Reasoning: '{message}'. Continue assisting, accounting for the user's input.",
+                tool_call_id=call["id"],
+            )
+            for call in calls
+        ]})
+    return None
+
 @app.websocket("/chat")
-async def chat(websocket: WebSocket):
+async def chat(websocket: WebSocket, thread_id: Optional[str] = None):
     await websocket.accept()
-    # Crear un identificador único para cada sesión
-    thread_id = str(uuid.uuid4())
-    # Inicializar la configuración del grafo para esta sesión
-    last_message = []
+    requested_thread, thread_id = thread_id, None
+    sent_messages = set()
+    owner = None
 
     try:
         while True:
             # Recibir el mensaje del usuario a través del WebSocket
             data = await websocket.receive_text()
             json_data = json.loads(data)
-            message = json_data.get("message")
             currency = json_data.get("currency")
-            os.environ["CURRENCY"] = currency
             language = json_data.get("language")
-            os.environ["LANGUAGE"] = language
             token = json_data.get("token")
-            os.environ["CTS_TOKEN"] = token
-            config = {"configurable": {"thread_id": thread_id, "language": language, "currency": currency}}
+            if thread_id is None:
+                thread_id, sent_messages, owner = await open_thread(websocket, requested_thread, token)
+            if owner is not None and not hmac.compare_digest(owner, token_scope(token)):
+                await websocket.send_json({"type": "error", "content": "This conversation belongs to another token."})
+                continue
+            # Session values travel in the run config, never through os.environ,
+            # so concurrent sessions don't overwrite each other.
+            config = {"configurable": {"thread_id": thread_id, "language": language, "currency": currency, "cts_token": token}}
+            inputs = await turn_inputs(json_data, config)
+            if owner is None:
+                # The thread is created by this turn: it belongs to its token.
+                owner = inputs["owner"] = token_scope(token)
+            if json_data.get("stream", True):
+                try:
+                    sent_messages |= await stream_turn(websocket, inputs, config)
+                except Exception as e:
+                    await websocket.send_json({"type": "error", "content": str(e)})
+                continue
+            # Clients that send "stream": false get each complete answer as a
+            # JSON string, as before.
             _printed = set()
             try:
-                events = part_4_graph.stream(
-                    {"messages": [{"role": "user", "type": "text", "content": message}]}, config, stream_mode="values"
-                )
-                for event in events:
+                events = part_4_graph.astream(inputs, config, stream_mode="values")
+                async for event in events:
                     _print_event(event, _printed)
                     for message in event.get('messages', []):
                         if isinstance(message, AIMessage) and message.content:
-                            if message.content not in last_message:
+                            if message.id not in sent_messages:
                                 await websocket.send_json(message.content)
-                                last_message.append(message.content)
+                                sent_messages.add(message.id)
                 #snapshot = part_4_graph.get_state(config)
             except Exception as e:
                 await websocket.send_text(f"Error: {str(e)}")
@@ -71,4 +234,5 @@ async def chat(websocket: WebSocket):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="localhost", port=8100)
\ No newline at end of file
+    # Several workers need a shared checkpointer: set CTS_CHECKPOINT_DB too.
+    uvicorn.run("main:app", host="localhost", port=8100, workers=int(os.getenv("WEB_CONCURRENCY", "1")))
\ No newline at end of file
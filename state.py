@@ -1,10 +1,14 @@
-from typing import Annotated, Literal, Optional
+from typing import Annotated, Literal, Optional, Union
 from typing_extensions import TypedDict
 from langgraph.graph.message import AnyMessage, add_messages
 
 
-def update_dialog_stack(left: list[str], right: Optional[str]) -> list[str]:
-    """Push or pop the state."""
+def update_dialog_stack(left: list[str], right: Optional[Union[str, list[str]]]) -> list[str]:
+    """Push or pop the state, or apply several updates in order: ["pop", "book_excursion"] hands off to a sibling."""
+    if isinstance(right, list):
+        for update in right:
+            left = update_dialog_stack(left, update)
+        return left
     if right is None:
         return left
     if right == "pop":
@@ -24,4 +28,11 @@ class State(TypedDict):
             ]
         ],
         update_dialog_stack,
-    ]
\ No newline at end of file
+    ]
+    # Running summary of the turns out of the assistants' context window, and
+    # the ID of the last message it covers (see assistants/context.py).
+    context_summary: Optional[str]
+    context_folded: Optional[str]
+    # Token scope (tools.cache.token_scope, never the token) of the session
+    # that started the thread: only a session with the same token resumes it.
+    owner: Optional[str]
\ No newline at end of file
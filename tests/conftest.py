@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The assistants build their OpenAI clients at import time; no test calls the API.
+os.environ.setdefault('OPENAI_API_KEY', 'test')
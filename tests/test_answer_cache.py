@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from assistants import answer_cache
+from assistants.answer_cache import AnswerCache, Lookup
+from tools import excursion_tools, hotel_tools
+from tools.gazetteer import Gazetteer
+
+CATALOG = [{'id': 1, 'name': 'SANTIAGO'}, {'id': 2, 'name': 'PUCÓN'}, {'id': 3, 'name': 'PUERTO VARAS'}]
+
+
+async def aload():
+    return CATALOG
+
+
+@pytest.fixture(autouse=True)
+def towns(monkeypatch):
+    for module, name in ((hotel_tools, 'hotel_towns'), (excursion_tools, 'transport_towns')):
+        gazetteer = Gazetteer(lambda: CATALOG, aload, id_key='id')
+        gazetteer.warm()
+        monkeypatch.setattr(module, name, gazetteer)
+
+
+def config(language='es', currency='CLP', token='token-a'):
+    return {'configurable': {'language': language, 'currency': currency, 'cts_token': token}}
+
+
+def vector(seed):
+    array = np.random.default_rng(seed).random(8).astype('float32')
+    return array / np.linalg.norm(array)
+
+
+@pytest.mark.parametrize('messages, cacheable', [
+    ([HumanMessage(content='Do you do airport transfers?')], True),
+    ([HumanMessage(content='Hola'), HumanMessage(content='Do you do airport transfers?')], True),
+    ([HumanMessage(content='Hola'), AIMessage(content='Hola, ¿en qué te ayudo?'), HumanMessage(content='Do you do airport transfers?')], False),
+    ([HumanMessage(content='Hola'), AIMessage(content='')], False),
+])
+def test_only_the_first_turn_is_cacheable(messages, cacheable):
+    assert (answer_cache._question({'messages': messages}, config()) is not None) is cacheable
+
+
+@pytest.mark.parametrize('question', [
+    'Do you have hotels with a pool in Pucón?',
+    'Is there a double room for 2 adults?',
+    '¿Tienen traslados el 12 de marzo?',
+    'Any excursions tomorrow?',
+])
+def test_questions_about_a_trip_are_not_cacheable(question):
+    assert answer_cache._question({'messages': [HumanMessage(content=question)]}, config()) is None
+
+
+def test_questions_differing_only_by_town_miss_the_cache(monkeypatch):
+    cache = AnswerCache()
+    monkeypatch.setattr(answer_cache, 'answers', cache)
+    # Every question embeds the same: only the town check tells them apart.
+    monkeypatch.setattr(answer_cache, 'embeddings', SimpleNamespace(embed_query=lambda text: list(vector(3))))
+    general = answer_cache.lookup({'messages': [HumanMessage(content='Do you have hotels with a pool?')]}, config())
+    answer_cache.remember(general, AIMessage(content='Yes, many of our hotels have one.'))
+    for town in ('Pucón', 'Puerto Varas'):
+        question = f'Do you have hotels with a pool in {town}?'
+        assert answer_cache.lookup({'messages': [HumanMessage(content=question)]}, config()) is None
+    assert cache.stats()['stores'] == 1
+    assert cache.stats()['hits'] == 0
+
+
+def test_nothing_is_cacheable_before_the_town_catalogs_load(monkeypatch):
+    monkeypatch.setattr(hotel_tools, 'hotel_towns', Gazetteer(lambda: CATALOG, aload, id_key='id'))
+    loads = []
+    monkeypatch.setattr(answer_cache.prefetch, 'submit', lambda name, fn: loads.append(fn))
+    message = {'messages': [HumanMessage(content='Do you do airport transfers?')]}
+    assert answer_cache._question(message, config()) is None
+    [load] = loads
+    load()
+    assert answer_cache._question(message, config()) == 'Do you do airport transfers?'
+
+
+def test_answers_are_scoped_by_language_currency_and_token():
+    cache = AnswerCache()
+    turn = answer_cache._lookup(config(), 'What areas do you cover?', vector(1))
+    cache.put(turn.scope, turn.vector, turn.question, 'All of Chile.')
+    assert cache.get(answer_cache._lookup(config(), turn.question, turn.vector).scope, turn.vector) == 'All of Chile.'
+    for other in (config(language='en'), config(currency='USD'), config(token='token-b')):
+        assert cache.get(answer_cache._lookup(other, turn.question, turn.vector).scope, turn.vector) is None
+    assert cache.flush('es') == 1
+
+
+@pytest.mark.parametrize('answer, stored', [
+    ('We cover every region of Chile.', True),
+    ('Sí, hacemos traslados al aeropuerto.', True),
+    ('Sí, hacemos traslados al aeropuerto en Santiago.', False),
+    ('The tour leaves on Monday.', False),
+    ('I sent the voucher to ana.perez@example.com.', False),
+    ('We will call you at +56 9 8765 4321.', False),
+    ('Your booking number is CTS-48213.', False),
+    ('Tu reserva N° 48213 está confirmada.', False),
+])
+def test_answers_with_guest_data_are_not_stored(monkeypatch, answer, stored):
+    cache = AnswerCache()
+    monkeypatch.setattr(answer_cache, 'answers', cache)
+    turn = Lookup(('es', '1', 'scope'), 'question', vector(2))
+    answer_cache.remember(turn, AIMessage(content=answer))
+    assert cache.stats()['stores'] == int(stored)
+    assert cache.stats()['skipped'] == int(not stored)
@@ -0,0 +1,57 @@
+import pytest
+
+from tools import cts_client, hotel_tools, steps
+
+
+class Response:
+    def __init__(self, payload):
+        self.payload = payload
+        self.is_success = True
+
+    def json(self):
+        return self.payload
+
+
+BOOKINGS = [
+    {'file_number': 51234, 'slug': 'b-51234', 'items': [{'id': 1}]},
+    {'file_number': ' 12 ', 'slug': 'b-12', 'items': [{'id': 2}]},
+]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    def get(url, headers=None, **kwargs):
+        calls.append(url)
+        if url.endswith('/booking/b-51234/'):
+            return Response({'file_number': 51234, 'slug': 'b-51234'})
+        return Response({'results': BOOKINGS, 'next': None})
+
+    def put(url, json=None, headers=None, **kwargs):
+        calls.append(('PUT', url))
+        return Response({'file_number': json.get('file_number', 'x')})
+
+    monkeypatch.setenv('CTS_API_V1', 'http://cts.test/v1')
+    monkeypatch.setattr(cts_client, 'get', get)
+    monkeypatch.setattr(cts_client, 'put', put)
+    hotel_tools.booking_index.clear()
+    return calls
+
+
+@pytest.mark.parametrize('booking_id, slug', [('51234', 'b-51234'), (' 51234', 'b-51234'), ('12', 'b-12')])
+def test_file_numbers_match_exactly(upstream, booking_id, slug):
+    assert steps.run(hotel_tools.get_booking_details(booking_id))['slug'] == slug
+
+
+def test_partial_file_number_is_not_a_match(upstream):
+    assert steps.run(hotel_tools.get_booking_details('123')) is None
+    assert hotel_tools.update_hotel_booking.invoke({'bookingId': '1234'}) == 'No se ha encontrado la reserva.'
+    assert not [call for call in upstream if isinstance(call, tuple)]
+
+
+def test_indexed_booking_is_found_without_paging(upstream):
+    steps.run(hotel_tools.get_booking_details('51234'))
+    upstream.clear()
+    assert steps.run(hotel_tools.get_booking_details('51234'))['slug'] == 'b-51234'
+    assert upstream == ['http://cts.test/v1/booking/b-51234/']
@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage, HumanMessage
+
+import main
+from tools.cache import token_scope
+
+
+class FakeGraph:
+    def __init__(self, threads):
+        self.threads = threads
+        self.runs = []
+        self.updates = []
+
+    async def aget_state(self, config):
+        values = self.threads.get(config['configurable']['thread_id'], {})
+        return SimpleNamespace(values=values, next=('book_hotel_sensitive_tools',) if values else ())
+
+    async def aupdate_state(self, config, values):
+        self.updates.append(values)
+
+    async def astream(self, inputs, config, stream_mode):
+        self.runs.append((inputs, config))
+        return
+        yield
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    booking = AIMessage(content='', id='a1', tool_calls=[{'name': 'book_hotel', 'args': {}, 'id': 'call-1'}])
+    graph = FakeGraph({'t1': {'messages': [HumanMessage(content='hi', id='h1'), booking], 'owner': token_scope('token-a')}})
+    monkeypatch.setattr(main, 'part_4_graph', graph)
+    return graph
+
+
+def receive_turn(websocket):
+    frames = [websocket.receive_json()]
+    while frames[-1]['type'] not in ('done', 'error'):
+        frames.append(websocket.receive_json())
+    return frames
+
+
+def turn(url, token, **message):
+    with TestClient(main.app).websocket_connect(url) as websocket:
+        websocket.send_json({'message': 'hello', 'token': token, **message})
+        return receive_turn(websocket)
+
+
+def test_owner_resumes_the_thread(graph):
+    frames = turn('/chat?thread_id=t1', 'token-a')
+    assert frames[0] == {'type': 'session', 'thread_id': 't1', 'resumed': True, 'pending': ['book_hotel_sensitive_tools']}
+    assert frames[-1] == {'type': 'done', 'thread_id': 't1'}
+    assert graph.runs[0][0] is None
+
+
+def test_approval_continues_the_pending_run(graph):
+    turn('/chat?thread_id=t1', 'token-a', approve=True)
+    assert graph.updates == []
+    assert graph.runs[0][0] is None
+
+
+def test_other_message_denies_the_pending_tool(graph):
+    turn('/chat?thread_id=t1', 'token-a', message='not that hotel')
+    [denial] = graph.updates[0]['messages']
+    assert denial.tool_call_id == 'call-1'
+    assert "not that hotel" in denial.content
+    assert graph.runs[0][0] is None
+
+
+def test_other_token_is_refused_on_an_open_thread(graph):
+    with TestClient(main.app).websocket_connect('/chat?thread_id=t1') as websocket:
+        websocket.send_json({'approve': True, 'token': 'token-a'})
+        receive_turn(websocket)
+        websocket.send_json({'approve': True, 'token': 'token-b'})
+        assert receive_turn(websocket) == [{'type': 'error', 'content': 'This conversation belongs to another token.'}]
+    assert len(graph.runs) == 1
+
+
+@pytest.mark.parametrize('token', ['token-b', None])
+def test_other_token_gets_a_new_thread(graph, token):
+    frames = turn('/chat?thread_id=t1', token)
+    assert frames[0]['type'] == 'session'
+    assert frames[0]['resumed'] is False
+    assert frames[0]['thread_id'] != 't1'
+    assert frames[-1]['thread_id'] == frames[0]['thread_id']
+    assert graph.runs[0][1]['configurable']['thread_id'] == frames[0]['thread_id']
+
+
+def test_new_session_records_its_owner_once(graph):
+    with TestClient(main.app).websocket_connect('/chat') as websocket:
+        websocket.send_json({'message': 'hello', 'token': 'token-a'})
+        frames = receive_turn(websocket)
+        websocket.send_json({'message': 'and tomorrow?', 'token': 'token-a'})
+        receive_turn(websocket)
+    assert [frame['type'] for frame in frames] == ['done']
+    (first, config), (second, _) = graph.runs
+    assert first['owner'] == token_scope('token-a')
+    assert 'owner' not in second
+    assert config['configurable']['thread_id'] == frames[0]['thread_id'] != 't1'
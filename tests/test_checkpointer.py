@@ -0,0 +1,171 @@
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+
+from checkpointer import BoundedMemorySaver, SqliteSaver
+
+METADATA = {'source': 'loop', 'step': 1, 'writes': None, 'parents': {}}
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_saver(request, tmp_path):
+    savers = []
+
+    def make(**kwargs):
+        if request.param == 'memory':
+            saver = BoundedMemorySaver(**kwargs)
+        else:
+            saver = SqliteSaver(str(tmp_path / 'checkpoints.db'), sweep_interval=3600, **kwargs)
+        savers.append(saver)
+        return saver
+
+    yield make
+    for saver in savers:
+        if isinstance(saver, SqliteSaver):
+            saver.close()
+
+
+def config(thread_id, checkpoint_id=None):
+    configurable = {'thread_id': thread_id, 'checkpoint_ns': ''}
+    if checkpoint_id:
+        configurable['checkpoint_id'] = checkpoint_id
+    return {'configurable': configurable}
+
+
+def put(saver, thread_id, messages, parent=None):
+    checkpoint = {**empty_checkpoint(), 'channel_values': {'messages': messages}}
+    return saver.put(config(thread_id, parent), checkpoint, METADATA, {})
+
+
+def stored_messages(saver, thread_id):
+    if isinstance(saver, BoundedMemorySaver):
+        return len(saver.messages.get(thread_id, {}))
+    return saver._connection().execute('SELECT COUNT(*) FROM messages WHERE thread_id = ?', (thread_id,)).fetchone()[0]
+
+
+def thread_ids(saver):
+    return {checkpoint.config['configurable']['thread_id'] for checkpoint in saver.list(None)}
+
+
+def test_put_get_list_and_writes_round_trip(make_saver):
+    saver = make_saver()
+    question = HumanMessage(content='Hotels in Santiago?', id='h1')
+    answer = AIMessage(content='Here they are.', id='a1')
+    first = put(saver, 't1', [question])
+    second = put(saver, 't1', [question, answer], parent=first['configurable']['checkpoint_id'])
+    saver.put_writes(second, [('messages', [HumanMessage(content='Thanks', id='h2')])], 'task-1')
+
+    latest = saver.get_tuple(config('t1'))
+    assert latest.config['configurable']['checkpoint_id'] == second['configurable']['checkpoint_id']
+    assert latest.parent_config['configurable']['checkpoint_id'] == first['configurable']['checkpoint_id']
+    assert latest.checkpoint['channel_values']['messages'] == [question, answer]
+    assert latest.metadata == METADATA
+    assert latest.pending_writes == [('task-1', 'messages', [HumanMessage(content='Thanks', id='h2')])]
+
+    older = saver.get_tuple(config('t1', first['configurable']['checkpoint_id']))
+    assert older.checkpoint['channel_values']['messages'] == [question]
+
+    listed = list(saver.list(config('t1')))
+    assert [checkpoint.config['configurable']['checkpoint_id'] for checkpoint in listed] == [
+        second['configurable']['checkpoint_id'], first['configurable']['checkpoint_id']]
+    assert saver.get_tuple(config('unknown')) is None
+
+
+def test_messages_are_stored_once_per_thread(make_saver):
+    saver = make_saver(compact=True)
+    messages = [HumanMessage(content='x' * 2000, id='h1')]
+    parent = None
+    for i in range(3):
+        messages = messages + [AIMessage(content=f'answer {i}', id=f'a{i}')]
+        parent = put(saver, 't1', messages, parent)['configurable']['checkpoint_id']
+    assert stored_messages(saver, 't1') == 4
+
+    checkpoints = list(saver.list(config('t1')))
+    assert checkpoints[0].checkpoint['channel_values']['messages'] == messages
+    assert checkpoints[1].checkpoint['channel_values']['messages'] == messages[:-1]
+    assert checkpoints[0].checkpoint['channel_values']['messages'][0] == checkpoints[2].checkpoint['channel_values']['messages'][0]
+
+
+def test_replaced_message_is_stored_again(make_saver):
+    saver = make_saver(compact=True)
+    parent = put(saver, 't1', [HumanMessage(content='first', id='h1')])['configurable']['checkpoint_id']
+    put(saver, 't1', [HumanMessage(content='edited', id='h1')], parent)
+    assert saver.get_tuple(config('t1')).checkpoint['channel_values']['messages'] == [HumanMessage(content='edited', id='h1')]
+
+
+def test_old_checkpoints_are_pruned(make_saver):
+    saver = make_saver(keep_checkpoints=2)
+    parent = None
+    for i in range(4):
+        parent = put(saver, 't1', [HumanMessage(content=str(i), id=f'h{i}')], parent)['configurable']['checkpoint_id']
+    assert len(list(saver.list(config('t1')))) == 2
+    assert saver.stats()['pruned_checkpoints'] == 2
+
+
+def test_idle_threads_expire(make_saver):
+    saver = make_saver(thread_ttl=0.05)
+    put(saver, 'old', [HumanMessage(content='hi', id='h1')])
+    time.sleep(0.1)
+    put(saver, 'new', [HumanMessage(content='hi', id='h1')])
+    if isinstance(saver, SqliteSaver):
+        saver.sweep()
+    assert thread_ids(saver) == {'new'}
+    assert saver.stats()['evicted_ttl'] == 1
+
+
+def test_least_recently_used_threads_are_evicted(make_saver):
+    saver = make_saver(max_threads=2)
+    for thread_id in ('a', 'b', 'c'):
+        put(saver, thread_id, [HumanMessage(content='hi', id='h1')])
+        time.sleep(0.01)
+    if isinstance(saver, SqliteSaver):
+        saver.sweep()
+    assert thread_ids(saver) == {'b', 'c'}
+    assert saver.stats()['evicted_lru'] == 1
+
+
+def test_delete_thread(make_saver):
+    saver = make_saver()
+    put(saver, 'a', [HumanMessage(content='hi', id='h1')])
+    put(saver, 'b', [HumanMessage(content='hi', id='h1')])
+    saver.delete_thread('a')
+    assert saver.get_tuple(config('a')) is None
+    assert stored_messages(saver, 'a') == 0
+    assert thread_ids(saver) == {'b'}
+
+
+def test_sqlite_checkpoints_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'checkpoints.db')
+    messages = [HumanMessage(content='x' * 2000, id='h1'), AIMessage(content='ok', id='a1')]
+    saver = SqliteSaver(path)
+    saved = put(saver, 't1', messages)
+    saver.put_writes(saved, [('messages', [HumanMessage(content='next', id='h2')])], 'task-1')
+    saver.close()
+
+    restarted = SqliteSaver(path)
+    try:
+        latest = restarted.get_tuple(config('t1'))
+        assert latest.config['configurable']['checkpoint_id'] == saved['configurable']['checkpoint_id']
+        assert latest.checkpoint['channel_values']['messages'] == messages
+        assert latest.pending_writes == [('task-1', 'messages', [HumanMessage(content='next', id='h2')])]
+    finally:
+        restarted.close()
+
+
+def test_sqlite_put_reads_only_the_keys_of_its_messages(tmp_path):
+    saver = SqliteSaver(str(tmp_path / 'checkpoints.db'), sweep_interval=3600)
+    try:
+        messages = [HumanMessage(content=f'message {i}', id=f'm{i}') for i in range(20)]
+        parent = put(saver, 't1', messages)['configurable']['checkpoint_id']
+        statements = []
+        saver._connection().set_trace_callback(statements.append)
+        latest = messages[-2:] + [AIMessage(content='new', id='a1')]
+        put(saver, 't1', latest, parent)
+        reads = [statement for statement in statements if statement.startswith('SELECT message_key')]
+        assert reads and all("IN ('m18:" in statement for statement in reads)
+        assert stored_messages(saver, 't1') == 21
+        assert saver.get_tuple(config('t1')).checkpoint['channel_values']['messages'] == latest
+    finally:
+        saver.close()
@@ -0,0 +1,62 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+
+from assistants import context
+
+HOTELS = (
+    'Hotels available. Show name, stars, address, price (from) and link. '
+    'Columns: id|name|stars|address|price_from|link|category|amenities\n'
+    '7|Hotel Siete|3|Calle 7|70000 CLP|https://x/7|Hotel|wifi\n'
+    '15|Hotel Quince|4|Calle 15|90000 CLP|https://x/15|Hotel|wifi\n'
+    '22|Hotel Veintidos|5|Calle 22|120000 CLP|https://x/22|Hotel|pool\n'
+)
+
+
+def test_digest_keeps_the_rows_a_later_call_picked():
+    result = ToolMessage(content=HOTELS, tool_call_id='c1', name='search_hotels')
+    # townId 7 matches the id of an unrelated row: only hotelId picks one.
+    later = {'name': 'get_hotel_rooms', 'args': {'hotelId': '15', 'townId': 7, 'currencyId': 1}, 'id': 'c2'}
+    text = context.digest(result, context._ids(later['args']))
+    assert '15|Hotel Quince' in text
+    assert 'Hotel Siete' not in text
+    assert '(2 other rows omitted.)' in text
+
+
+def test_ids_are_the_row_arguments_only():
+    assert context._ids({'hotelId': 15, 'roomId': None, 'serviceCode': 'AB1', 'townId': 7, 'currencyId': 1}) == {'15', 'AB1'}
+
+
+def conversation():
+    messages = []
+    for i in range(4):
+        messages += [HumanMessage(content=f'question {i}', id=f'h{i}'), AIMessage(content=f'answer {i}', id=f'a{i}')]
+    return {'messages': messages + [HumanMessage(content='last', id='h4')]}
+
+
+def test_failed_fold_sends_the_turns_it_could_not_fold(monkeypatch):
+    monkeypatch.setenv('CTS_CONTEXT_TURNS', '1')
+    monkeypatch.setenv('CTS_CONTEXT_FOLD_TURNS', '1')
+
+    def fail(inputs):
+        raise RuntimeError('summarizer down')
+
+    monkeypatch.setattr(context, 'summarizer', RunnableLambda(fail))
+    state = conversation()
+    window = context.window(state, 'book_hotel')
+    assert [message.id for message in window.messages] == ['h4']
+    update = context.fold(state, window, 'book_hotel')
+    assert update == {}
+    sent = context.apply(state, window, update, 'book_hotel')['messages']
+    assert [message.id for message in sent] == [message.id for message in state['messages']]
+
+
+def test_folded_turns_are_replaced_by_the_summary(monkeypatch):
+    monkeypatch.setenv('CTS_CONTEXT_TURNS', '1')
+    monkeypatch.setenv('CTS_CONTEXT_FOLD_TURNS', '1')
+    monkeypatch.setattr(context, 'summarizer', RunnableLambda(lambda inputs: AIMessage(content='They asked four questions.')))
+    state = conversation()
+    window = context.window(state, 'book_hotel')
+    update = context.fold(state, window, 'book_hotel')
+    sent = context.apply(state, window, update, 'book_hotel')['messages']
+    assert sent[0].content == 'Summary of the earlier conversation:\nThey asked four questions.'
+    assert [message.id for message in sent[1:]] == ['h4']
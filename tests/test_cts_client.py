@@ -0,0 +1,65 @@
+import asyncio
+
+import httpx
+import pytest
+
+from tools import cts_client
+from tools.cts_client import CircuitOpenError, CTSError
+
+
+@pytest.fixture
+def cts(monkeypatch):
+    """A fake CTS that answers with the given statuses in turn, and the requests it got."""
+    monkeypatch.setenv('CTS_RETRY_BACKOFF', '0')
+    monkeypatch.setattr(cts_client, '_breakers', {})
+    served = []
+    statuses = []
+
+    def handler(request):
+        served.append(request.method)
+        return httpx.Response(statuses.pop(0) if statuses else 200)
+
+    monkeypatch.setattr(cts_client, '_client_for', lambda origin: httpx.Client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(cts_client, '_async_client_for', lambda origin: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return statuses, served
+
+
+def send(mode, method, url):
+    if mode == 'sync':
+        return cts_client.request(method, url)
+    return asyncio.run(cts_client.arequest(method, url))
+
+
+URL = 'https://cts.test/v1/hotel/info/'
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_reads_are_retried_on_busy_upstream(cts, mode):
+    statuses, served = cts
+    statuses.extend([503, 429])
+    assert send(mode, 'GET', URL).status_code == 200
+    assert served == ['GET'] * 3
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_writes_and_server_errors_are_not_retried(cts, mode):
+    statuses, served = cts
+    statuses.extend([503, 500])
+    with pytest.raises(CTSError, match='after 1 attempt'):
+        send(mode, 'POST', 'https://cts.test/v1/booking/')
+    with pytest.raises(CTSError, match=r'after 1 attempt\(s\) \(HTTP 500'):
+        send(mode, 'GET', URL)
+    assert served == ['POST', 'GET']
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_the_circuit_opens_after_repeated_failures(cts, monkeypatch, mode):
+    monkeypatch.setenv('CTS_BREAKER_FAILURES', '2')
+    statuses, served = cts
+    statuses.extend([500, 500, 200])
+    for _ in range(2):
+        with pytest.raises(CTSError):
+            send(mode, 'GET', URL)
+    with pytest.raises(CircuitOpenError):
+        send(mode, 'GET', URL)
+    assert len(served) == 2
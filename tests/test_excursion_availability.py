@@ -0,0 +1,49 @@
+import pytest
+
+from tools import cts_client, excursion_tools, steps
+
+
+class Response:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def listing(price, services=(('A1', 1), ('B2', 2))):
+    return [{'name': name, 'services': [{'service_code': code, 'sale_price': price}]} for name, code in services]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+    prices = iter([100, 120, 130])
+
+    def get(url, headers=None, **kwargs):
+        calls.append(url)
+        return Response(listing(next(prices)))
+
+    monkeypatch.setenv('CTS_API_V2', 'http://cts.test/v2')
+    monkeypatch.setattr(cts_client, 'get', get)
+    excursion_tools.availability_cache.clear()
+    return calls
+
+
+def test_booking_refreshes_the_cached_availability(upstream):
+    args = dict(townId='1', tipos=2, travelDate='2030-01-10', adults=2, children=0)
+    assert steps.run(excursion_tools.get_data_for_excursion_or_transfer_booking(1, 1, **args))['sale_price'] == 100
+    assert steps.run(excursion_tools.get_data_for_excursion_or_transfer_booking(1, 1, **args))['sale_price'] == 100
+    assert len(upstream) == 1
+    assert steps.run(excursion_tools.get_data_for_excursion_or_transfer_booking(1, 1, **args, refresh=True))['sale_price'] == 120
+    assert len(upstream) == 2
+
+
+def test_find_service_follows_a_moved_service():
+    response = listing(100, services=(('B2', 2), ('A1', 1)))
+    assert excursion_tools.find_service(response, 1, 1)['service_code'] == 1
+    with pytest.raises(LookupError):
+        excursion_tools.find_service(response, 1, 3)
@@ -0,0 +1,52 @@
+from tools import excursion_tools, hotel_tools
+from tools.formatting import money
+
+
+def hotel(id, name, prices):
+    return {
+        'id': id, 'name': name, 'town_id': 7, 'address': 'Calle 1', 'ammenities': [],
+        'category': {'name': 'Hotel', 'rating': 3},
+        'availability': [{'price_value_with_tax': price} for price in prices],
+    }
+
+
+PAYLOAD = {'currency': 1, 'checkin': '2030-01-10', 'checkout': '2030-01-12',
+           'rooms': [{'adults': 2, 'children': 0, 'infants': 0, 'ages': []}]}
+
+
+def test_money():
+    assert money(85000, 'CLP') == '85000 CLP'
+    assert money(120, 'USD', '$') == '$120 USD'
+    assert money(None, 'CLP') == 'n/a'
+
+
+def test_hotel_without_a_price_renders_na(monkeypatch):
+    monkeypatch.setenv('CTS_TOOL_OUTPUT', 'compact')
+    monkeypatch.setenv('FRONT_HOST', 'https://front.test')
+    response = {'data': [hotel(1, 'Priced', [90000, None]), hotel(2, 'Unpriced', [None])]}
+    result = hotel_tools.generate_hotels_availability_response(response, PAYLOAD)
+    rows = result.splitlines()[1:]
+    assert '|90000 CLP|' in rows[0]
+    assert '|n/a|' in rows[1]
+    assert 'None' not in result
+
+
+def test_hotel_without_a_price_renders_na_verbose(monkeypatch):
+    monkeypatch.setenv('CTS_TOOL_OUTPUT', 'verbose')
+    monkeypatch.setenv('FRONT_HOST', 'https://front.test')
+    result = hotel_tools.generate_hotels_availability_response({'data': [hotel(2, 'Unpriced', [])]}, PAYLOAD)
+    assert 'Price: From n/a' in result
+    assert 'None' not in result
+
+
+def test_service_without_a_price_renders_na(monkeypatch):
+    monkeypatch.setenv('CTS_TOOL_OUTPUT', 'compact')
+    excursion = {
+        'glosas': {'g_text_es': 'Tour', 'g_text_en': 'Tour'}, 'concepts': [],
+        'services': [{'sale_price': None, 'currency': 'CLP', 'service_duration': '4 hours', 'meeting_point': 'Hotel',
+                      'city': 'santiago', 'allow_childs': True, 'is_regular': True}],
+    }
+    result = excursion_tools.generate_excursion_availability_response([(1, excursion)])
+    assert '|n/a|' in result
+    assert 'None' not in result
+    assert excursion_tools.service_price(excursion) is None
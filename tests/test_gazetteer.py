@@ -0,0 +1,119 @@
+import pytest
+
+from tools.gazetteer import Gazetteer
+
+CATALOG = [
+    {'id': 1, 'name': 'SANTIAGO'},
+    {'id': 2, 'name': 'PUERTO MONTT'},
+    {'id': 3, 'name': 'CONSTITUCION'},
+    {'id': 4, 'name': 'SAN FELIPE'},
+    {'id': 5, 'name': 'VIÑA DEL MAR'},
+    {'id': 6, 'name': 'PUERTO NATALES'},
+]
+
+
+async def aload():
+    return CATALOG
+
+
+@pytest.fixture
+def towns():
+    return Gazetteer(lambda: CATALOG, aload, id_key='id')
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('Santiago', (1, 'SANTIAGO')),
+    ('viña del mar', (5, 'VIÑA DEL MAR')),
+    ('stgo', (1, 'SANTIAGO')),
+    ('Santigo', (1, 'SANTIAGO')),
+    ('puerto natals', (6, 'PUERTO NATALES')),
+])
+def test_resolves_names_aliases_and_typos(towns, name, expected):
+    assert towns.resolve(name) == expected
+
+
+@pytest.mark.parametrize('name', ['Puerto Varas', 'Concepcion', 'San Fernando'])
+def test_near_misses_are_not_matched(towns, name):
+    assert towns.resolve(name) is None
+    assert towns.lookup(name) is None
+
+
+def test_match_needs_a_margin_over_the_runner_up():
+    catalog = [{'id': 1, 'name': 'SAN CARLOS'}, {'id': 2, 'name': 'SAN CARLOTA'}]
+    towns = Gazetteer(lambda: catalog, aload, id_key='id')
+    assert towns.resolve('san carlo') is None
+
+
+def test_async_resolve(towns):
+    import asyncio
+    assert asyncio.run(towns.aresolve('vina')) == (5, 'VIÑA DEL MAR')
+
+
+def test_added_towns_keep_their_name(towns):
+    towns.lookup('Santiago')
+    towns.add('Pucon', 9)
+    assert towns.resolve('pucon') == (9, 'Pucon')
+
+
+def test_background_refresh_keeps_the_context():
+    import contextvars
+    import threading
+    token = contextvars.ContextVar('token', default=None)
+    seen = []
+    refreshed = threading.Event()
+
+    def load():
+        seen.append(token.get())
+        if len(seen) > 1:
+            refreshed.set()
+        return CATALOG
+
+    towns = Gazetteer(load, aload, id_key='id', ttl=0)
+    token.set('abc')
+    towns.lookup('Santiago')
+    towns.lookup('Santiago')
+    assert refreshed.wait(2)
+    assert seen == ['abc', 'abc']
+
+
+def test_learned_towns_keep_the_catalog_name_and_survive_refreshes():
+    towns = Gazetteer(lambda: CATALOG, aload, id_key='id', ttl=0)
+    towns.lookup('Santiago')
+    towns.add('PUCON', 9, aliases=['Pucón, Araucanía'])
+    assert towns.resolve('pucon araucania') == (9, 'PUCON')
+    towns._load(CATALOG)
+    assert towns.resolve('Pucon') == (9, 'PUCON')
+    assert towns.resolve('pucon araucania') == (9, 'PUCON')
+
+
+def test_empty_catalog_is_a_failed_load(monkeypatch):
+    loads = []
+
+    def load():
+        loads.append(1)
+        return []
+
+    towns = Gazetteer(load, aload, id_key='id')
+    assert towns.resolve('Santiago') is None
+    assert towns.resolve('Santiago') is None
+    # The next load waits for CTS_TOWNS_RETRY; learned towns still resolve meanwhile.
+    assert len(loads) == 1
+    assert towns.stats()['load_errors'] == 1
+    towns.add('SANTIAGO', 1)
+    assert towns.resolve('Santiago') == (1, 'SANTIAGO')
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Do you have hotels in Puerto Natales with parking?', 'PUERTO NATALES'),
+    ('algo en viña del mar', 'VIÑA DEL MAR'),
+    ('y en stgo?', 'SANTIAGO'),
+    ('Do you do airport transfers?', None),
+])
+def test_mentions_finds_towns_in_text(towns, text, expected):
+    towns.warm()
+    assert towns.mentions(text) == expected
+
+
+def test_mentions_never_loads_the_catalog(towns):
+    assert towns.mentions('hotels in Santiago') is None
+    assert not towns.loaded
@@ -0,0 +1,38 @@
+import pytest
+
+from tools import cts_client, hotel_tools, steps
+from tools.gazetteer import Gazetteer
+
+
+class Response:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    results = {'PUCON': [{'dtt_id': 9, 'name': 'PUCON'}]}
+
+    def get(url, headers=None, **kwargs):
+        query = url.split('?q=', 1)[1]
+        return Response([{'dtt_id': 1, 'name': 'SANTIAGO'}] if query == '' else results.get(query, []))
+
+    monkeypatch.setattr(cts_client, 'get', get)
+    monkeypatch.setattr(hotel_tools, 'hotel_towns', Gazetteer(hotel_tools.hotel_towns.loader, hotel_tools.hotel_towns.aloader, id_key='dtt_id'))
+
+
+def test_unknown_town_is_not_found(remote):
+    assert steps.run(hotel_tools.hotel_town('Atlantis')) is None
+    assert steps.run(hotel_tools.hotel_town_id('Atlantis')) is None
+    assert hotel_tools.get_town_id_for_hotels.invoke({'townName': 'Atlantis'}).startswith('Town not found: Atlantis')
+
+
+def test_remote_town_is_learned_under_its_catalog_name(remote):
+    assert hotel_tools.get_town_id_for_hotels.invoke({'townName': 'Pucon'}) == {'townId': 9, 'town': 'PUCON'}
+    assert hotel_tools.hotel_towns.resolve('pucon') == (9, 'PUCON')
@@ -0,0 +1,36 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from assistants import routing
+
+
+@pytest.mark.parametrize('specialist, text, leaves', [
+    # Details of the current booking stay with the specialist.
+    ('book_excursion', 'Let me check with my wife first', False),
+    ('book_excursion', 'Mi hotel es el Plaza San Francisco', False),
+    ('book_excursion', 'Pick me up at the Sheraton hotel please', False),
+    ('book_excursion', 'Nos pueden recoger en el hotel?', False),
+    ('book_excursion', 'What time do we return at night?', False),
+    ('book_excursion', 'I want the tour with pickup at my hotel', False),
+    ('book_hotel', 'Is it close to the airport?', False),
+    ('book_hotel', '¿Está cerca del aeropuerto?', False),
+    ('book_hotel', 'We arrive at the terminal at 9', False),
+    ('book_hotel', 'I need a room near the airport transfer stop', False),
+    ('book_hotel', 'Yes, book it', False),
+    # An explicit request for the other specialist's service leaves.
+    ('book_hotel', 'I also want to book a tour to the Maipo valley', True),
+    ('book_hotel', 'Quiero reservar un traslado al aeropuerto', True),
+    ('book_hotel', 'Necesito cotizar una excursión a Isla Negra', True),
+    ('book_excursion', 'Now I need to book a hotel in Puerto Varas', True),
+    ('book_excursion', 'Reserva también una habitación en Valparaíso', True),
+    # Only the specialists are guarded.
+    ('assistant', 'Book a hotel in Santiago', False),
+])
+def test_off_topic(specialist, text, leaves):
+    assert routing.off_topic(HumanMessage(content=text), specialist) is leaves
+
+
+def test_entry():
+    assert routing.entry(None, HumanMessage(content='Hi')) == 'primary_assistant'
+    assert routing.entry(['book_hotel'], HumanMessage(content='Is it close to the airport?')) == 'book_hotel'
+    assert routing.entry(['book_hotel'], HumanMessage(content='Book a transfer to the airport too')) == 'leave_skill'
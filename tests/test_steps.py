@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from tools import cts_client, excursion_tools, steps
+from tools.cache import ResultCache
+
+
+class Response:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+def fetch(path):
+    response = yield steps.get(f'http://cts.test/{path}')
+    return response.json()
+
+
+def fetch_or_default(path):
+    try:
+        return (yield from fetch(path))
+    except LookupError as e:
+        return f'default: {e}'
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append(('sync', url))
+        if url.endswith('missing'):
+            raise LookupError('missing')
+        return Response(url.rsplit('/', 1)[1])
+
+    async def aget(url, **kwargs):
+        calls.append(('async', url))
+        if url.endswith('missing'):
+            raise LookupError('missing')
+        return Response(url.rsplit('/', 1)[1])
+
+    monkeypatch.setattr(cts_client, 'get', get)
+    monkeypatch.setattr(cts_client, 'aget', aget)
+    return calls
+
+
+def test_the_same_steps_run_blocking_or_async(upstream):
+    assert steps.run(fetch('a')) == 'a'
+    assert asyncio.run(steps.arun(fetch('b'))) == 'b'
+    assert upstream == [('sync', 'http://cts.test/a'), ('async', 'http://cts.test/b')]
+
+
+def test_errors_are_raised_at_the_step(upstream):
+    assert steps.run(fetch_or_default('missing')) == 'default: missing'
+    assert asyncio.run(steps.arun(fetch_or_default('missing'))) == 'default: missing'
+    with pytest.raises(LookupError):
+        steps.run(fetch('missing'))
+
+
+def test_cached_and_fanout_steps(upstream):
+    cache = ResultCache('test_steps', ttl=60)
+
+    def cached(path):
+        return (yield steps.Cached(cache, path, lambda: fetch(path)))
+
+    def both():
+        return (yield steps.Fanout(cached, [('a',), ('missing',), ('a',)]))
+
+    first = steps.run(both())
+    assert first[0] == first[2] == 'a'
+    assert isinstance(first[1], LookupError)
+    assert asyncio.run(steps.arun(both()))[0] == 'a'
+    assert upstream.count(('sync', 'http://cts.test/a')) == 1
+    assert ('async', 'http://cts.test/a') not in upstream
+
+
+def test_a_cts_tool_has_a_sync_and_an_async_implementation(monkeypatch):
+    def delete(url, **kwargs):
+        return Response({'is_active': False})
+
+    async def adelete(url, **kwargs):
+        return Response({'is_active': True})
+
+    monkeypatch.setattr(cts_client, 'delete', delete)
+    monkeypatch.setattr(cts_client, 'adelete', adelete)
+    tool = excursion_tools.cancel_transport_or_excursion_booking
+    assert set(tool.args) == {'bookingId'}
+    assert tool.invoke({'bookingId': '7'}) == 'La reserva con el número 7 ha sido cancelada con éxito.'
+    assert asyncio.run(tool.ainvoke({'bookingId': '7'})) == 'No se ha podido cancelar la reserva.'
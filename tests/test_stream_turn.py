@@ -0,0 +1,47 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import END, START, StateGraph
+
+import main
+from assistants import context
+from state import State
+from utilities import create_assistant_node
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_json(self, frame):
+        self.frames.append(frame)
+
+
+def test_folded_summary_is_not_streamed(monkeypatch):
+    monkeypatch.setenv('CTS_CONTEXT_TURNS', '1')
+    monkeypatch.setenv('CTS_CONTEXT_FOLD_TURNS', '1')
+    summary_model = FakeListChatModel(responses=['INTERNAL SUMMARY'])
+    monkeypatch.setattr(context, 'summarizer', (context.summary_prompt | summary_model).with_config(context.summarizer.config))
+    answer = RunnableLambda(lambda state: state['messages']) | FakeListChatModel(responses=['Here are the hotels.'])
+    builder = StateGraph(State)
+    builder.add_node('book_hotel', create_assistant_node(answer, 'book_hotel'))
+    builder.add_edge(START, 'book_hotel')
+    builder.add_edge('book_hotel', END)
+    monkeypatch.setattr(main, 'part_4_graph', builder.compile())
+
+    history = [
+        HumanMessage(content='Hotels in Santiago', id='h1'), AIMessage(content='Which dates?', id='a1'),
+        HumanMessage(content='From 10 to 12 January', id='h2'), AIMessage(content='For how many?', id='a2'),
+    ]
+    inputs = {'messages': history + [HumanMessage(content='Two adults', id='h3')]}
+    config = {'configurable': {'thread_id': 't1'}}
+    websocket = FakeWebSocket()
+    folds = context.stats().get('book_hotel', {}).get('folds', 0)
+    asyncio.run(main.stream_turn(websocket, inputs, config))
+
+    assert context.stats()['book_hotel']['folds'] == folds + 1
+    text = ''.join(frame.get('content', '') for frame in websocket.frames if frame['type'] in ('delta', 'end'))
+    assert 'INTERNAL SUMMARY' not in text
+    assert [frame['content'] for frame in websocket.frames if frame['type'] == 'end'][-1] == 'Here are the hotels.'
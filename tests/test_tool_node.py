@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import tool
+
+from tools import session
+from tools.history_tools import expand_tool_result
+from utilities import create_tool_node_with_fallback
+
+running = {'now': 0, 'most': 0}
+lock = threading.Lock()
+
+
+def enter():
+    with lock:
+        running['now'] += 1
+        running['most'] = max(running['most'], running['now'])
+
+
+def leave():
+    with lock:
+        running['now'] -= 1
+
+
+@tool
+def currency_of(name: str) -> str:
+    """The currency of the session."""
+    enter()
+    time.sleep(0.05)
+    leave()
+    return f'{name}: {session.currency()}'
+
+
+async def acurrency_of(name: str) -> str:
+    enter()
+    await asyncio.sleep(0.05)
+    leave()
+    return f'{name}: {session.currency()}'
+
+
+currency_of.coroutine = acurrency_of
+
+
+def state(names):
+    calls = [{'name': 'currency_of', 'args': {'name': name}, 'id': f'call-{name}'} for name in names]
+    return {'messages': [AIMessage(content='', tool_calls=calls)]}
+
+
+def config(thread_id, currency):
+    return {'configurable': {'thread_id': thread_id, 'currency': currency}}
+
+
+def test_tools_run_with_the_session_of_their_run(monkeypatch):
+    monkeypatch.setenv('CTS_TOOL_CONCURRENCY', '2')
+    running['most'] = 0
+    node = create_tool_node_with_fallback([currency_of])
+    result = node.invoke(state('abcd'), config('t1', 'USD'))
+    assert [message.content for message in result['messages']] == ['a: USD', 'b: USD', 'c: USD', 'd: USD']
+    assert running['most'] == 2
+
+
+def test_async_sessions_are_limited_apart(monkeypatch):
+    monkeypatch.setenv('CTS_TOOL_CONCURRENCY', '2')
+    running['most'] = 0
+    node = create_tool_node_with_fallback([currency_of])
+
+    async def both():
+        return await asyncio.gather(node.ainvoke(state('abc'), config('t1', 'USD')), node.ainvoke(state('xyz'), config('t2', 'CLP')))
+
+    first, second = asyncio.run(both())
+    assert [message.content for message in first['messages']] == ['a: USD', 'b: USD', 'c: USD']
+    assert [message.content for message in second['messages']] == ['x: CLP', 'y: CLP', 'z: CLP']
+    assert running['most'] == 4
+
+
+def test_injected_state_still_reaches_the_tool():
+    node = create_tool_node_with_fallback([expand_tool_result])
+    earlier = ToolMessage(content='the whole result', tool_call_id='call-1')
+    call = AIMessage(content='', tool_calls=[{'name': 'expand_tool_result', 'args': {'tool_call_id': 'call-1'}, 'id': 'call-2'}])
+    result = node.invoke({'messages': [earlier, call]}, config('t1', 'USD'))
+    assert result['messages'][0].content == 'the whole result'
@@ -0,0 +1,158 @@
+"""
+Shared result caches for CTS responses.
+
+ResultCache is a TTL + LRU cache with a memory budget. Concurrent loads of the
+same key are collapsed into one call (single-flight): the first caller runs
+the loader and everybody else waits for its result, from threads or from
+coroutines. Failed loads are never cached.
+
+Every cache registers itself, so cache_stats() can report hit, miss and
+eviction counters for all of them.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+_caches: dict[str, 'ResultCache'] = {}
+
+
+def approximate_size(value: Any) -> int:
+    return len(json.dumps(value, default=str))
+
+
+def token_scope(token: Optional[str]) -> str:
+    """Stable, non-reversible cache scope for a CTS token."""
+    return hashlib.sha256((token or '').encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_entries: int = 256,
+        max_bytes: int = 32 * 1024 * 1024,
+        sizeof: Callable[[Any], int] = approximate_size,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries: OrderedDict[Hashable, tuple[Any, float, int]] = OrderedDict()
+        self._inflight: dict[Hashable, Future] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'expirations': 0, 'errors': 0}
+        _caches[name] = self
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            return self._get(key)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Cached value for key, calling loader once on a miss."""
+        future, leader = self._claim(key)
+        if not leader:
+            return future.result()
+        try:
+            value = loader()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._resolve(key, future, value)
+        return value
+
+    async def aget_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        future, leader = self._claim(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            value = await loader()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._resolve(key, future, value)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._put(key, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+    def _claim(self, key: Hashable) -> tuple[Future, bool]:
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                future = Future()
+                future.set_result(value)
+                return future, False
+            if key in self._inflight:
+                self._stats['coalesced'] += 1
+                return self._inflight[key], False
+            self._stats['misses'] += 1
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _resolve(self, key: Hashable, future: Future, value: Any) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._put(key, value)
+        future.set_result(value)
+
+    def _fail(self, key: Hashable, future: Future, error: BaseException) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._stats['errors'] += 1
+        future.set_exception(error)
+
+    def _get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at, _ = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self._stats['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats['hits'] += 1
+        return value
+
+    def _put(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (value, time.monotonic() + self.ttl, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._stats['evictions'] += 1
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+
+def cache_stats() -> dict[str, dict]:
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -0,0 +1,500 @@
+"""
+Shared HTTP client for the CTS APIs.
+
+Every tool goes through this module instead of calling ``requests`` directly,
+so connections to CTS_API_V1, CTS_API_V2 and apibooking.ctsturismo.com are
+pooled and kept alive between tool calls. There is one pool per API origin,
+plus one per origin and event loop for the async tool implementations.
+
+Pool sizes and timeouts can be tuned with environment variables:
+
+CTS_POOL_MAX_CONNECTIONS: Max open connections per origin. Default is 20.
+CTS_POOL_MAX_KEEPALIVE: Max idle keep-alive connections per origin. Default is 10.
+CTS_POOL_KEEPALIVE_EXPIRY: Seconds an idle connection is kept. Default is 30.
+CTS_CONNECT_TIMEOUT: Connect timeout in seconds. Default is 5.
+CTS_READ_TIMEOUT: Read timeout in seconds. Default is 30.
+CTS_HTTP2: Set to 'false' to disable HTTP/2. It needs the 'h2' package, a
+dependency through httpx[http2], and httpx falls back to HTTP/1.1 when the
+upstream does not negotiate it.
+
+Requests are classified by endpoint (availability, catalog, booking or
+other) and go through a resilience layer:
+
+CTS_TIMEOUT_<ENDPOINT>: Read timeout of an endpoint, e.g. CTS_TIMEOUT_AVAILABILITY.
+Defaults are 15 for availability, 10 for catalog and CTS_READ_TIMEOUT otherwise.
+CTS_RETRIES: Retries of idempotent reads (GETs and availability searches) on
+connection errors, timeouts, 429, 502, 503 and 504. Default is 2.
+CTS_RETRY_BACKOFF / CTS_RETRY_MAX_BACKOFF: Base and cap of the jittered
+exponential backoff, in seconds. Defaults are 0.2 and 2.
+CTS_BREAKER_FAILURES: Consecutive failures that open the circuit of an API
+base (e.g. CTS_API_V1). Default is 5.
+CTS_BREAKER_RESET: Seconds an open circuit refuses calls before letting a
+trial call through. Default is 30.
+CTS_HEDGE: Set to 'true' to send a duplicate availability read when the first
+one takes longer than the endpoint's CTS_HEDGE_PERCENTILE (default 95)
+latency, once CTS_HEDGE_MIN_SAMPLES (default 20) latencies are known. The
+first response wins.
+
+Server errors and exhausted retries raise CTSError instead of returning an
+error response for the tools to trip over.
+"""
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from tools.resilience import CircuitBreaker, LatencyWindow, backoff
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_clients: dict[str, httpx.Client] = {}
+_clients_lock = threading.Lock()
+# httpx.AsyncClient connections are bound to the loop that opened them.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+ENDPOINT_TIMEOUTS = {'availability': 15.0, 'catalog': 10.0}
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+_breakers: dict[str, CircuitBreaker] = {}
+_latencies: dict[str, LatencyWindow] = {}
+_endpoint_stats: dict[str, dict[str, int]] = {}
+_resilience_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+
+
+class CTSError(Exception):
+    """A CTS call failed after its retries, or was refused by an open circuit."""
+
+
+class CircuitOpenError(CTSError):
+    pass
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv('CTS_POOL_MAX_CONNECTIONS', '20')),
+        max_keepalive_connections=int(os.getenv('CTS_POOL_MAX_KEEPALIVE', '10')),
+        keepalive_expiry=float(os.getenv('CTS_POOL_KEEPALIVE_EXPIRY', '30')),
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        float(os.getenv('CTS_READ_TIMEOUT', '30')),
+        connect=float(os.getenv('CTS_CONNECT_TIMEOUT', '5')),
+    )
+
+
+def _http2_enabled() -> bool:
+    return HTTP2_AVAILABLE and os.getenv('CTS_HTTP2', 'true').lower() != 'false'
+
+
+def _client_for(origin: str) -> httpx.Client:
+    client = _clients.get(origin)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(origin)
+            if client is None:
+                client = httpx.Client(
+                    http2=_http2_enabled(),
+                    limits=_limits(),
+                    timeout=_timeout(),
+                    follow_redirects=True,
+                )
+                _clients[origin] = client
+    return client
+
+
+def _async_client_for(origin: str) -> httpx.AsyncClient:
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(origin)
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=_http2_enabled(),
+            limits=_limits(),
+            timeout=_timeout(),
+            follow_redirects=True,
+        )
+        clients[origin] = client
+    return client
+
+
+def _record(origin: str, new_connection: bool) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(origin, {'hits': 0, 'misses': 0})
+        stats['misses' if new_connection else 'hits'] += 1
+
+
+def _base(url: str) -> str:
+    """API base of a URL: its origin and first path segment, e.g. https://host/v1."""
+    parts = urlsplit(url)
+    segment = parts.path.strip('/').split('/', 1)[0]
+    return f'{parts.scheme}://{parts.netloc}/{segment}'
+
+
+def _endpoint(url: str) -> str:
+    path = urlsplit(url).path
+    if '/availability/' in path or re.search(r'/hotel/(\d+/)?$', path):
+        return 'availability'
+    if '/city/' in path:
+        return 'catalog'
+    if '/booking/' in path:
+        return 'booking'
+    return 'other'
+
+
+def _endpoint_timeout(endpoint: str) -> httpx.Timeout:
+    default = ENDPOINT_TIMEOUTS.get(endpoint, float(os.getenv('CTS_READ_TIMEOUT', '30')))
+    return httpx.Timeout(
+        float(os.getenv(f'CTS_TIMEOUT_{endpoint.upper()}', str(default))),
+        connect=float(os.getenv('CTS_CONNECT_TIMEOUT', '5')),
+    )
+
+
+def _breaker_for(base: str) -> CircuitBreaker:
+    breaker = _breakers.get(base)
+    if breaker is None:
+        with _resilience_lock:
+            breaker = _breakers.setdefault(base, CircuitBreaker(
+                failure_threshold=int(os.getenv('CTS_BREAKER_FAILURES', '5')),
+                reset_timeout=float(os.getenv('CTS_BREAKER_RESET', '30')),
+            ))
+    return breaker
+
+
+def _latency_for(endpoint: str) -> LatencyWindow:
+    latency = _latencies.get(endpoint)
+    if latency is None:
+        with _resilience_lock:
+            latency = _latencies.setdefault(endpoint, LatencyWindow())
+    return latency
+
+
+def _count(endpoint: str, field: str) -> None:
+    with _resilience_lock:
+        stats = _endpoint_stats.setdefault(endpoint, {
+            'requests': 0, 'errors': 0, 'retries': 0, 'rejected': 0, 'hedges': 0, 'hedge_wins': 0,
+        })
+        stats[field] += 1
+
+
+def _hedge_delay(endpoint: str) -> Optional[float]:
+    """Seconds to wait before hedging a read, or None when it should not be hedged."""
+    if endpoint != 'availability' or os.getenv('CTS_HEDGE', 'false').lower() != 'true':
+        return None
+    return _latency_for(endpoint).percentile(
+        float(os.getenv('CTS_HEDGE_PERCENTILE', '95')),
+        min_samples=int(os.getenv('CTS_HEDGE_MIN_SAMPLES', '20')),
+    )
+
+
+def _hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _resilience_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='cts-hedge')
+    return _hedge_executor
+
+
+def _is_idempotent(method: str, endpoint: str) -> bool:
+    # Availability searches are POSTs on the hotel API, but they only read.
+    return method.upper() in IDEMPOTENT_METHODS or endpoint == 'availability'
+
+
+def _failure(method: str, url: str, endpoint: str, attempts: int, error) -> CTSError:
+    _count(endpoint, 'errors')
+    if isinstance(error, httpx.Response):
+        reason = f'HTTP {error.status_code} {error.reason_phrase}'
+    else:
+        reason = f'{type(error).__name__}: {error}'.rstrip(': ')
+    return CTSError(
+        f'CTS {endpoint} request {method} {urlsplit(url).path} failed after {attempts} attempt(s) ({reason}). '
+        'This is a temporary problem of the CTS service, not a mistake in the call.'
+    )
+
+
+def _circuit_open(base: str, endpoint: str, breaker: CircuitBreaker) -> CircuitOpenError:
+    _count(endpoint, 'rejected')
+    return CircuitOpenError(
+        f'CTS API {base} is unavailable after repeated failures; '
+        f'calls are paused for {math.ceil(breaker.retry_after())} more seconds. Tell the user and try again later.'
+    )
+
+
+def _send(method: str, url: str, endpoint: str, **kwargs) -> httpx.Response:
+    origin = _origin(url)
+    connected = []
+
+    # A request that has to open a TCP connection is a pool miss.
+    def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            connected.append(True)
+
+    extensions = {**kwargs.pop('extensions', {}), 'trace': trace}
+    started = time.monotonic()
+    response = _client_for(origin).request(method, url, extensions=extensions, **kwargs)
+    _latency_for(endpoint).add(time.monotonic() - started)
+    _record(origin, bool(connected))
+    return response
+
+
+def _send_hedged(delay: float, method: str, url: str, endpoint: str, **kwargs) -> httpx.Response:
+    pool = _hedge_pool()
+    primary = pool.submit(_send, method, url, endpoint, **kwargs)
+    if wait([primary], timeout=delay).done:
+        return primary.result()
+    _count(endpoint, 'hedges')
+    hedge = pool.submit(_send, method, url, endpoint, **kwargs)
+    pending, error = {primary, hedge}, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    _count(endpoint, 'hedge_wins')
+                # The slower request finishes in the background.
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+class _Call:
+    """
+    The resilience decisions of one CTS call: circuit breaker, retries and
+    hedging. request() and arequest() only send, and ask it what to do next.
+    """
+
+    def __init__(self, method: str, url: str, kwargs: dict):
+        self.method = method
+        self.url = url
+        self.endpoint = _endpoint(url)
+        self.base = _base(url)
+        self.breaker = _breaker_for(self.base)
+        kwargs.setdefault('timeout', _endpoint_timeout(self.endpoint))
+        self.attempts = 1 + (int(os.getenv('CTS_RETRIES', '2')) if _is_idempotent(method, self.endpoint) else 0)
+        self.attempt = 0
+        self.error = None
+        _count(self.endpoint, 'requests')
+
+    def begin(self) -> Optional[float]:
+        """Start an attempt, unless the circuit is open. Returns its hedge delay, None for no hedge."""
+        if not self.breaker.allow():
+            raise _circuit_open(self.base, self.endpoint, self.breaker)
+        return _hedge_delay(self.endpoint)
+
+    def cancelled(self) -> None:
+        """The attempt ended without an answer from CTS, e.g. cancelled: it says nothing of its health."""
+        self.breaker.release()
+
+    def unreachable(self, error: httpx.TransportError) -> None:
+        self.breaker.failure()
+        self.error = error
+
+    def answered(self, response: httpx.Response) -> bool:
+        """Whether the response is the call's result."""
+        if response.status_code < 500:
+            self.breaker.success()
+            if response.status_code not in RETRY_STATUSES:
+                return True
+        else:
+            self.breaker.failure()
+        self.error = response
+        return False
+
+    def retry_delay(self) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None when the call has failed."""
+        if isinstance(self.error, httpx.Response) and self.error.status_code not in RETRY_STATUSES:
+            return None
+        if self.attempt + 1 >= self.attempts:
+            return None
+        _count(self.endpoint, 'retries')
+        self.attempt += 1
+        return _retry_delay(self.attempt - 1)
+
+    def failure(self) -> CTSError:
+        return _failure(self.method, self.url, self.endpoint, self.attempt + 1, self.error)
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request to a CTS API through the pooled client of its origin.
+
+    Accepts the same keyword arguments as httpx.Client.request (headers,
+    json, params, timeout...). Idempotent reads are retried, and server
+    errors raise CTSError; other responses are returned as they are.
+    """
+    call = _Call(method, url, kwargs)
+    while True:
+        delay = call.begin()
+        try:
+            if delay is None:
+                response = _send(method, url, call.endpoint, **kwargs)
+            else:
+                response = _send_hedged(delay, method, url, call.endpoint, **kwargs)
+        except httpx.TransportError as e:
+            call.unreachable(e)
+        except BaseException:
+            call.cancelled()
+            raise
+        else:
+            if call.answered(response):
+                return response
+        pause = call.retry_delay()
+        if pause is None:
+            raise call.failure()
+        time.sleep(pause)
+
+
+def _retry_delay(attempt: int) -> float:
+    return backoff(attempt, float(os.getenv('CTS_RETRY_BACKOFF', '0.2')), float(os.getenv('CTS_RETRY_MAX_BACKOFF', '2')))
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> httpx.Response:
+    return request('POST', url, **kwargs)
+
+
+def put(url: str, **kwargs) -> httpx.Response:
+    return request('PUT', url, **kwargs)
+
+
+def delete(url: str, **kwargs) -> httpx.Response:
+    return request('DELETE', url, **kwargs)
+
+
+async def _asend(method: str, url: str, endpoint: str, **kwargs) -> httpx.Response:
+    origin = _origin(url)
+    connected = []
+
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            connected.append(True)
+
+    extensions = {**kwargs.pop('extensions', {}), 'trace': trace}
+    started = time.monotonic()
+    response = await _async_client_for(origin).request(method, url, extensions=extensions, **kwargs)
+    _latency_for(endpoint).add(time.monotonic() - started)
+    _record(origin, bool(connected))
+    return response
+
+
+async def _asend_hedged(delay: float, method: str, url: str, endpoint: str, **kwargs) -> httpx.Response:
+    primary = asyncio.ensure_future(_asend(method, url, endpoint, **kwargs))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    _count(endpoint, 'hedges')
+    hedge = asyncio.ensure_future(_asend(method, url, endpoint, **kwargs))
+    pending, error = {primary, hedge}, None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _count(endpoint, 'hedge_wins')
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def arequest(method: str, url: str, **kwargs) -> httpx.Response:
+    """Async version of request, for the tools' coroutine implementations."""
+    call = _Call(method, url, kwargs)
+    while True:
+        delay = call.begin()
+        try:
+            if delay is None:
+                response = await _asend(method, url, call.endpoint, **kwargs)
+            else:
+                response = await _asend_hedged(delay, method, url, call.endpoint, **kwargs)
+        except httpx.TransportError as e:
+            call.unreachable(e)
+        except BaseException:
+            call.cancelled()
+            raise
+        else:
+            if call.answered(response):
+                return response
+        pause = call.retry_delay()
+        if pause is None:
+            raise call.failure()
+        await asyncio.sleep(pause)
+
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest('GET', url, **kwargs)
+
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await arequest('POST', url, **kwargs)
+
+
+async def aput(url: str, **kwargs) -> httpx.Response:
+    return await arequest('PUT', url, **kwargs)
+
+
+async def adelete(url: str, **kwargs) -> httpx.Response:
+    return await arequest('DELETE', url, **kwargs)
+
+
+def pool_stats() -> dict[str, dict[str, int]]:
+    """Pool hit and miss counters per CTS origin."""
+    with _stats_lock:
+        return {origin: dict(stats) for origin, stats in _stats.items()}
+
+
+def resilience_stats() -> dict:
+    """Circuit state per API base, and request counters and latencies per endpoint."""
+    with _resilience_lock:
+        endpoints = {endpoint: dict(stats) for endpoint, stats in _endpoint_stats.items()}
+        breakers = dict(_breakers)
+        latencies = dict(_latencies)
+    for endpoint, latency in latencies.items():
+        endpoints.setdefault(endpoint, {}).update(latency.stats())
+    return {
+        'breakers': {base: breaker.stats() for base, breaker in breakers.items()},
+        'endpoints': endpoints,
+    }
+
+
+def close() -> None:
+    """Close every pooled connection."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+async def aclose() -> None:
+    """Close the async pools opened on the running event loop."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
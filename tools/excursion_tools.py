@@ -1,16 +1,26 @@
 from typing import Optional
-import requests
+import heapq
+import re
+from tools import fanout, session, steps
+from tools.cache import ResultCache, token_scope
+from tools.formatting import money, render, table, session_language
+from tools.gazetteer import Gazetteer
 import os
-from langchain_core.tools import tool
 
 
-@tool
+@steps.cts_tool
 def get_availability_for_transfer_and_excursions(
     townId: int,
     tipos: int,
     fecha: str,
     adults: Optional[int] = 1,
     children: Optional[int] = 0,
+    service_type: Optional[str] = None,
+    children_allowed: Optional[bool] = None,
+    max_duration_hours: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort_by: Optional[str] = 'price',
+    limit: Optional[int] = 3,
     ) -> list[dict]:
     """
     Get availability of transport or excursions in a given town.
@@ -21,28 +31,29 @@ def get_availability_for_transfer_and_excursions(
     fecha (string): The date (format YYYY-MM-DD).
     adults: The number of adults. Default is 1.
     children: The number of children. Default is 0.
+    service_type: 'shared' or 'private' to only get that type of service. Optional.
+    children_allowed: True to only get services that accept children. Optional.
+    max_duration_hours: Only services that last at most these hours. Optional.
+    max_price: Only services whose lowest price is at or below this value. Optional.
+    sort_by: 'price' for the cheapest first or 'duration' for the shortest first. Default is 'price'.
+    limit: The number of services to return. Default is 3.
+
+    Use the filter arguments for the user's preferences instead of asking for
+    every service and filtering them yourself. The service numbers in the
+    result are the ones the other excursion and transfer tools expect.
 
     Returns:
-    A list of dictionaries containing the availability of
-    transport or excursions in the given town.
+    The best matching transport or excursions in the given town, and how
+    many other services also match.
 
     Example:
-    get_availability_for_transport_and_excursions(townId='1234', tipos='1', fecha='2024-12-01', adults=2, children=1, currency=1)
+    get_availability_for_transport_and_excursions(townId='1234', tipos='1', fecha='2024-12-01', adults=2, children=1, service_type='private')
     """
+    response = yield from fetch_availability(townId, tipos, fecha, adults, children)
+    services, remaining = rank_services(response, service_type, children_allowed, max_duration_hours, max_price, sort_by, limit)
+    return generate_availability_response(services, tipos, remaining)
 
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={fecha}&adults={adults}&children={children}&currency={currency}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.get(url, headers=headers)
-
-    if tipos == 1:
-        result = generate_transfer_availability_response(response.json())
-    if tipos == 2:
-        result = generate_excursion_availability_response(response.json())
-    return result
-
-@tool
+@steps.cts_tool
 def get_town_id_for_transport_and_excursions(townName: str) -> list[dict]:
     """
     Get the town ID.
@@ -51,23 +62,68 @@ def get_town_id_for_transport_and_excursions(townName: str) -> list[dict]:
     townName: The town or city name.
 
     Returns:
-    The Town ID.
+    The Town ID and the name of the town it belongs to, or None if the town
+    is unknown. If that name is not the one asked for, confirm it with the
+    user before searching.
 
     Example:
     get_town_id_for_transport_and_excursions('santiago')
     """
-    url = f'{os.getenv("CTS_API_V2")}/city/'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.get(url, headers=headers)
+    return town_result((yield steps.Call(transport_towns.resolve, transport_towns.aresolve, townName)))
 
-    for town in response.json():
-        if town['name'].lower() == townName.lower():
-            return town['id']
+@steps.cts_tool
+def search_transfer_and_excursions(
+    tipos: int,
+    towns: list[str],
+    dates: list[str],
+    occupancies: Optional[list[dict]] = None,
+    service_type: Optional[str] = None,
+    children_allowed: Optional[bool] = None,
+    max_duration_hours: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort_by: Optional[str] = 'price',
+    limit: Optional[int] = 5,
+    ) -> list[dict]:
+    """
+    Search transport or excursions in several towns, dates and occupancies at once.
 
-    return None
+    Args:
+    tipos: The type of service. 1 is for transfer, and 2 is for excursions.
+    towns: The town or city names, e.g. ['Santiago', 'Valparaiso'].
+    dates (list of strings): The dates to search (format YYYY-MM-DD).
+    occupancies: The passengers to search for, e.g. [{'adults': 2}, {'adults': 2, 'children': 1}]. Default is 1 adult.
+    service_type: 'shared' or 'private' to only get that type of service. Optional.
+    children_allowed: True to only get services that accept children. Optional.
+    max_duration_hours: Only services that last at most these hours. Optional.
+    max_price: Only services whose lowest price is at or below this value. Optional.
+    sort_by: 'price' for the cheapest first or 'duration' for the shortest first. Default is 'price'.
+    limit: The number of services to return across all the searches. Default is 5.
+
+    Use this tool instead of several 'get_availability_for_transfer_and_excursions'
+    calls when the user is flexible about the town, the date or the passengers.
+    The town IDs are resolved by the tool. To use the other excursion and
+    transfer tools on a result, pass its townId, date, adults, children and
+    service number.
+
+    Returns:
+    The best matching transport or excursions across all the searches.
 
-@tool
+    Example:
+    search_transfer_and_excursions(tipos=2, towns=['Santiago', 'Valparaiso'], dates=['2025-03-08', '2025-03-15'], occupancies=[{'adults': 2}], service_type='private')
+    """
+    townIds = []
+    for townName in towns:
+        townIds.append((yield steps.Call(transport_towns.lookup, transport_towns.alookup, townName)))
+    searches = fanout.combinations(list(zip(towns, townIds)), dates, occupancies or [{}])
+
+    def search(town, fecha, occupancy):
+        return (yield from fetch_availability(*service_search_args(town, tipos, fecha, occupancy)))
+
+    results = yield steps.Fanout(search, searches)
+    matches, remaining, failures = merge_service_searches(searches, results, service_type, children_allowed, max_duration_hours, max_price, sort_by, limit)
+    return generate_services_search_response(matches, tipos, remaining, failures)
+
+@steps.cts_tool
 def get_excursion_or_transfer_description(
     serviceNumber: int,
     townId: int,
@@ -87,18 +143,14 @@ def get_excursion_or_transfer_description(
     adults: The number of adults. Default is 1.
     children: The number of children. Default is 0.
     """
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={date}&adults={adults}&children={children}&currency={currency}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = { 'Authorization': f'token {ctsToken}' }
-    response = requests.get(url, headers = headers).json()
+    response = yield from fetch_availability(townId, tipos, date, adults, children)
 
     service = 'excursion' if tipos == 2 else 'transfer'
     result = generate_excursion_or_transfer_description_response(response[serviceNumber-1], service)
 
     return result
 
-@tool
+@steps.cts_tool
 def get_excursion_or_transfer_options_avilable(
     serviceNumber: int,
     townId: int,
@@ -125,18 +177,14 @@ def get_excursion_or_transfer_options_avilable(
     Example:
     get_excursion_or_transfer_options(townId=1234, tipos=1, fecha='2024-12-01', adults=2, children=1, currency=1)
     """
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={date}&adults={adults}&children={children}&currency={currency}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = { 'Authorization': f'token {ctsToken}' }
-    response = requests.get(url, headers = headers).json()
+    response = yield from fetch_availability(townId, tipos, date, adults, children)
 
     service = 'excursion' if tipos == 2 else 'transfer'
     result = generate_excursion_or_transfer_options_response(response[serviceNumber-1], service)
 
     return result
 
-@tool
+@steps.cts_tool
 def create_transport_or_excursion_booking(
     serviceNumber: int,
     serviceCode: int,
@@ -184,54 +232,15 @@ def create_transport_or_excursion_booking(
     Example:
     create_transport_or_excursion_booking()
     """
-
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    serviceAvailability = get_data_for_excursion_or_transfer_booking(serviceNumber=serviceNumber, serviceCode=serviceCode, townId=townId, tipos=tipos, travelDate=travelDate, adults=adults, children=children)
-    serviceCode = serviceAvailability['service_code']
-    adults = serviceAvailability['adults']
-    children = serviceAvailability['children']
-    salePrice = serviceAvailability['sale_price']
-    # Get the language from serviceAvailability['language'] (array) where equals to language
-    for serviceLanguage in serviceAvailability['language']:
-        if serviceLanguage == language:
-            language = serviceLanguage
-            break
-    travelDate = serviceAvailability['travel_date']
-
-    payload = {
-        "passenger": {
-            "name": firstName,
-            "last_name": lastName,
-            "country": country,
-            "email": email,
-            "passport_or_dni": passportOrDni,
-            "phone": phone
-        },
-        "notes": notes,
-        "reference_number": referenceNumber,
-        "currency": currency,
-        "services": [
-            {
-                "service_code": serviceCode,
-                "adults": adults,
-                "children": children,
-                "sale_price": salePrice,
-                "language": language,
-                "travel_date": travelDate,
-                "flight_number": flightNumber,
-                "notes": notes
-            }
-        ],
-    }
-    url = f'{os.getenv("CTS_API_V2")}/booking/'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.post(url, json=payload, headers=headers).json()
+    serviceAvailability = yield from get_data_for_excursion_or_transfer_booking(serviceNumber=serviceNumber, serviceCode=serviceCode, townId=townId, tipos=tipos, travelDate=travelDate, adults=adults, children=children, refresh=True)
+    payload = build_excursion_booking_payload(serviceAvailability, language, firstName, lastName, email, phone, passportOrDni, country, referenceNumber, notes, flightNumber)
+    url, headers = excursion_booking_request('')
+    response = (yield steps.post(url, json=payload, headers=headers)).json()
     bookingId = response['booking_id']
     return f"Se ha realizado la reserva con éxito. El número de reserva es {bookingId}"
 
 #TODO
-@tool
+@steps.cts_tool
 def update_transport_or_excursion_booking() -> list[dict]:
     """
     Update a transport or excursion booking.
@@ -242,50 +251,258 @@ def update_transport_or_excursion_booking() -> list[dict]:
     Example:
     update_transport_or_excursion_booking()
     """
-    url = f'{os.getenv("CTS_API_V2")}/booking/'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.put(url, headers=headers)
+    url, headers = excursion_booking_request('')
+    response = yield steps.put(url, headers=headers)
     return response.json()
 
-@tool
+@steps.cts_tool
 def cancel_transport_or_excursion_booking(bookingId: str) -> list[dict]:
     """
     Cancel a transport or excursion booking.
 
     Args:
     bookingId: The booking ID.
-    
+
     Returns:
     The booking ID.
-    
+
     Example:
     cancel_transport_or_excursion_booking('1234')
     """
-    url = f'{os.getenv("CTS_API_V2")}/booking/{bookingId}/'
-    ctsToken = os.getenv("CTS_TOKEN")
+    url, headers = excursion_booking_request(f'{bookingId}/')
+    response = (yield steps.delete(url, headers=headers)).json()
+    return generate_excursion_cancel_response(response, bookingId)
+
+
+
+
+# Helpers
+
+def availability_request(townId, tipos, fecha, adults, children):
+    currency = session.currency_id()
+    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={fecha}&adults={adults}&children={children}&currency={currency}'
+    ctsToken = session.token()
+    headers = {'Authorization': f'token {ctsToken}'}
+    return url, headers
+
+# The same availability document backs the search, description, options and
+# booking tools, so one conversation reuses a single upstream call.
+availability_cache = ResultCache(
+    'availability',
+    ttl=float(os.getenv('CTS_AVAILABILITY_TTL', '300')),
+    max_entries=int(os.getenv('CTS_AVAILABILITY_MAX_ENTRIES', '256')),
+    max_bytes=int(os.getenv('CTS_AVAILABILITY_MAX_BYTES', str(64 * 1024 * 1024))),
+)
+
+def fetch_availability(townId, tipos, fecha, adults, children, refresh=False):
+    url, headers = availability_request(townId, tipos, fecha, adults, children)
+    key = (url, token_scope(headers['Authorization']))
+    if refresh:
+        availability_cache.invalidate(key)
+
+    def load():
+        response = yield steps.get(url, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    return (yield steps.Cached(availability_cache, key, load))
+
+def city_request():
+    url = f'{os.getenv("CTS_API_V2")}/city/'
+    ctsToken = session.token()
     headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.delete(url, headers=headers).json()
+    return url, headers
+
+def excursion_booking_request(path):
+    url = f'{os.getenv("CTS_API_V2")}/booking/{path}'
+    ctsToken = session.token()
+    headers = {'Authorization': f'token {ctsToken}'}
+    return url, headers
+
+def transport_town_catalog():
+    url, headers = city_request()
+    response = yield steps.get(url, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+transport_towns = Gazetteer(steps.blocking(transport_town_catalog), steps.awaitable(transport_town_catalog), id_key='id')
+
+def town_result(town):
+    return None if town is None else {'townId': town[0], 'town': town[1]}
+
+def prefetch_excursion_search(delegation):
+    """Warm the town catalog from a ToBookExcursion call. It doesn't say whether an excursion or a transfer is wanted, so availability can't be prefetched."""
+    transport_towns.lookup(delegation['location'])
+
+def service_price(service):
+    return min((option['sale_price'] for option in service['services'] if option.get('sale_price') is not None), default=None)
+
+def service_hours(service):
+    """Duration in hours parsed from e.g. '4 hours', '90 min' or '1,5 horas'. None if unknown."""
+    durations = []
+    for option in service['services']:
+        match = re.search(r'(\d+(?:[.,]\d+)?)\s*(m|h)?', str(option.get('service_duration') or '').lower())
+        if match:
+            value = float(match.group(1).replace(',', '.'))
+            durations.append(value / 60 if match.group(2) == 'm' else value)
+    return min(durations, default=None)
+
+def rank_services(services, service_type=None, children_allowed=None, max_duration_hours=None, max_price=None, sort_by='price', limit=3):
+    """
+    Filter services and keep the top `limit` of them.
+
+    Returns ([(serviceNumber, service), ...], remaining matches). serviceNumber
+    is the 1-based position in the availability response.
+    """
+    matches = filter_services(services, service_type, children_allowed, max_duration_hours, max_price)
+    limit = max(limit or 3, 1)
+    return heapq.nsmallest(limit, matches, key=service_sort_key(sort_by)), max(len(matches) - limit, 0)
+
+def filter_services(services, service_type=None, children_allowed=None, max_duration_hours=None, max_price=None):
+    matches = []
+    for number, service in enumerate(services, start=1):
+        options = service['services']
+        if service_type is not None:
+            shared = service_type.lower() == 'shared'
+            if not any(bool(option['is_regular']) == shared for option in options):
+                continue
+        if children_allowed and not any(option.get('allow_childs') for option in options):
+            continue
+        hours = service_hours(service)
+        if max_duration_hours is not None and hours is not None and hours > max_duration_hours:
+            continue
+        price = service_price(service)
+        if max_price is not None and (price is None or price > max_price):
+            continue
+        matches.append((number, service))
+    return matches
+
+def service_sort_key(sort_by='price'):
+    """Sort key for (serviceNumber, service) pairs."""
+    if sort_by == 'duration':
+        return lambda match: (service_hours(match[1]) is None, service_hours(match[1]) or 0, match[0])
+    return lambda match: (service_price(match[1]) is None, service_price(match[1]) or 0, match[0])
+
+def service_search_args(town, tipos, fecha, occupancy):
+    townName, townId = town
+    if townId is None:
+        raise LookupError(f'Town not found: {townName}')
+    return townId, tipos, fecha, occupancy.get('adults', 1), occupancy.get('children', 0)
+
+def merge_service_searches(searches, results, service_type=None, children_allowed=None, max_duration_hours=None, max_price=None, sort_by='price', limit=5):
+    """
+    Rank the services of every search together.
+
+    Returns ([(search, serviceNumber, service), ...], remaining matches,
+    failures). search is the (town, date, occupancy) the service was found
+    for, and serviceNumber its position in that search.
+    """
+    matches = []
+    failures = []
+    for search, result in zip(searches, results):
+        (townName, _), fecha, occupancy = search
+        if isinstance(result, Exception):
+            failures.append(f'{townName} {fecha}, {occupancy.get("adults", 1)} adults {occupancy.get("children", 0)} children: {result}')
+            continue
+        matches += [(search, number, service) for number, service in filter_services(result, service_type, children_allowed, max_duration_hours, max_price)]
+    key = service_sort_key(sort_by)
+    limit = max(limit or 5, 1)
+    return heapq.nsmallest(limit, matches, key=lambda match: key(match[1:])), max(len(matches) - limit, 0), failures
+
+def generate_availability_response(services, tipos, remaining=0):
+    if not services:
+        return 'No services match the search. Try relaxing the filters or changing the date.'
+    if tipos == 1:
+        result = generate_transfer_availability_response(services)
+    if tipos == 2:
+        result = generate_excursion_availability_response(services)
+    if remaining:
+        result += f'There are {remaining} more services matching the search. Call the tool again with a higher limit or other filters to see them.\n'
+    return result
+
+def generate_services_search_response(matches, tipos, remaining=0, failures=()):
+    return render('services_search', verbose_services_search_response, compact_services_search_response, matches, tipos, remaining, failures)
+
+def compact_services_search_response(matches, tipos, remaining=0, failures=()):
+    lines = [f'Search failed for {failure}' for failure in failures]
+    if not matches:
+        return '\n'.join(['No services match any of the searches. Try relaxing the filters or other dates.'] + lines) + '\n'
+    if remaining:
+        lines.insert(0, f'+{remaining} more matching services; call again with a higher limit or other filters to see them.')
+    rows = [
+        (townName, townId, fecha, occupancy.get('adults', 1), occupancy.get('children', 0), number, service_name(service),
+         money(service['services'][0].get('sale_price'), service['services'][0]['currency']), service['services'][0]['service_duration'],
+         service_type_label(service))
+        for ((townName, townId), fecha, occupancy), number, service in matches
+    ]
+    return table(
+        f'Best {"transfers" if tipos == 1 else "excursions"} across the searches. For the other tools pass town_id, date, adults, children and n as serviceNumber. Reply in the user\'s language.',
+        ['town', 'town_id', 'date', 'adults', 'children', 'n', 'name', 'price_from', 'duration', 'type'],
+        rows,
+        '\n'.join(lines),
+    )
+
+def verbose_services_search_response(matches, tipos, remaining=0, failures=()):
+    if not matches:
+        result = 'No services match any of the searches. Try relaxing the filters or other dates.\n'
+    else:
+        result = 'The best services across the searches are the following. To use the other tools with one of them, pass its town ID, date, adults, children and service number:\n\n'
+    for ((townName, townId), fecha, occupancy), number, service in matches:
+        result += f"Town: {townName} (town ID {townId})\n"
+        result += f"Date: {fecha}\n"
+        result += f"Adults: {occupancy.get('adults', 1)}, children: {occupancy.get('children', 0)}\n"
+        result += f"{'TRANSFER' if tipos == 1 else 'EXCURSION'} SERVICE {number}:\n"
+        result += f"Name (Spanish): {service['glosas']['g_text_es']}\n"
+        result += f"Name (English): {service['glosas']['g_text_en']}\n"
+        result += f"Price: From {money(service['services'][0].get('sale_price'), service['services'][0]['currency'], '$')}\n"
+        result += f"Service duration: {service['services'][0]['service_duration']}\n"
+        result += f"Type of service: {service_type_label(service)}\n\n"
+    if remaining:
+        result += f'There are {remaining} more services matching the searches. Call the tool again with a higher limit or other filters to see them.\n'
+    for failure in failures:
+        result += f'The search for {failure} failed.\n'
+    return result
+
+def generate_excursion_cancel_response(response, bookingId):
     if response['is_active'] == False:
         return f'La reserva con el número {bookingId} ha sido cancelada con éxito.'
     return 'No se ha podido cancelar la reserva.'
 
+def service_type_label(service):
+    isRegular = set(option['is_regular'] for option in service['services'])
+    if len(isRegular) == 1:
+        return 'Shared' if isRegular.pop() else 'Private'
+    return 'Shared and Private'
 
-
-
-# Helpers
+def service_name(service):
+    return service['glosas']['g_text_es'] if session_language() == 'es' else service['glosas']['g_text_en']
 
 def generate_excursion_availability_response(excursions):
+    return render('excursion_availability', verbose_excursion_availability_response, compact_excursion_availability_response, excursions)
+
+def compact_excursion_availability_response(excursions):
+    rows = [
+        (i, service_name(excursion), money(excursion['services'][0].get('sale_price'), excursion['services'][0]['currency']),
+         excursion['services'][0]['service_duration'], f"{excursion['services'][0]['meeting_point']}, {excursion['services'][0]['city'].title()}",
+         'yes' if excursion['services'][0]['allow_childs'] else 'no', ', '.join(excursion['concepts']), service_type_label(excursion))
+        for i, excursion in excursions
+    ]
+    return table(
+        'Excursions available. n is the serviceNumber for the other tools. Reply in the user\'s language.',
+        ['n', 'name', 'price_from', 'duration', 'pickup', 'children', 'includes', 'type'],
+        rows,
+    )
+
+def verbose_excursion_availability_response(excursions):
     result = 'The excursions available are the following:\n\n'
-    i = 1
-    for excursion in excursions:
+    for i, excursion in excursions:
         isRegular = []
         result += f"EXCURSION SERVICE {i}:\n"
         result += f"Name (Spanish): {excursion['glosas']['g_text_es']}\n"
         result += f"Name (English): {excursion['glosas']['g_text_en']}\n"
         result += f'(Use the exursion name acording to the language used by the user. If you are not sure, just translate to the related language)\n'
         result += f'(Also, if necesary, translate the labels to the language used by the user)\n'
-        result += f"Price: From ${excursion['services'][0]['sale_price']} {excursion['services'][0]['currency']}\n"
+        result += f"Price: From {money(excursion['services'][0].get('sale_price'), excursion['services'][0]['currency'], '$')}\n"
         result += f"Service duration: {excursion['services'][0]['service_duration']}\n"
         result += f"Pickup from: {excursion['services'][0]['meeting_point']}, {excursion['services'][0]['city'].title()}\n"
         result += f"Children allowed: {'Yes' if excursion['services'][0]['allow_childs'] else 'No'}\n"
@@ -297,21 +514,35 @@ def generate_excursion_availability_response(excursions):
             result += f"Type of service: {'Shared' if isRegular[0] else 'Private'}\n\n"
         else:
             result += f"Type of service: Shared and Private\n\n"
-        i += 1
     return result
 
 
 def generate_transfer_availability_response(transfers):
+    return render('transfer_availability', verbose_transfer_availability_response, compact_transfer_availability_response, transfers)
+
+def compact_transfer_availability_response(transfers):
+    rows = [
+        (i, service_name(transfer), money(transfer['services'][0].get('sale_price'), transfer['services'][0]['currency']),
+         f"{transfer['services'][0]['meeting_point']}, {transfer['services'][0]['city'].title()}",
+         'yes' if transfer['services'][0]['cancellation_date'] else 'no', service_type_label(transfer))
+        for i, transfer in transfers
+    ]
+    return table(
+        'Transfers available. n is the serviceNumber for the other tools. Reply in the user\'s language.',
+        ['n', 'name', 'price_from', 'pickup', 'free_cancellation', 'type'],
+        rows,
+    )
+
+def verbose_transfer_availability_response(transfers):
     result = 'The excursions available are the following:\n\n'
-    i = 1
-    for transfer in transfers:
+    for i, transfer in transfers:
         isRegular = []
         result += f"TRANSFER SERVICE {i}:\n"
         result += f"Name (Spanish): {transfer['glosas']['g_text_es']}\n"
         result += f"Name (English): {transfer['glosas']['g_text_en']}\n"
         result += f'(Use the transfer name acording to the language used by the user. If you are not sure, just translate to the related language)\n'
         result += f'(Also, if necesary, translate the labels to the language used by the user)\n'
-        result += f"Price: From ${transfer['services'][0]['sale_price']} {transfer['services'][0]['currency']}\n"
+        result += f"Price: From {money(transfer['services'][0].get('sale_price'), transfer['services'][0]['currency'], '$')}\n"
         result += f"Pickup from: {transfer['services'][0]['meeting_point']}, {transfer['services'][0]['city'].title()}\n"
         result += f"Free cancelation: {'Yes' if transfer['services'][0]['cancellation_date'] else 'No'}\n"
         for service in transfer['services']:
@@ -321,10 +552,25 @@ def generate_transfer_availability_response(transfers):
             result += f"Type of service: {'Shared' if isRegular[0] else 'Private'}\n\n"
         else:
             result += f"Type of service: Shared and Private\n\n"
-        i += 1
     return result
 
 def generate_excursion_or_transfer_options_response(options, service):
+    return render('service_options', verbose_excursion_or_transfer_options_response, compact_excursion_or_transfer_options_response, options, service)
+
+def compact_excursion_or_transfer_options_response(options, service):
+    rows = [
+        (i, option['service_code'], option['travel_date'], option['cancellation_date'], ', '.join(option['language']),
+         money(option.get('sale_price'), option['currency']), option['service_duration'], f"{option['meeting_point']}, {option['city'].title()}",
+         'Shared' if option['is_regular'] else 'Private', option['guide'])
+        for i, option in enumerate(options['services'], start=1)
+    ]
+    return table(
+        f'Options available for this {service}. Show them as OPTION n; service_code is only for you. Reply in the user\'s language.',
+        ['n', 'service_code', 'travel_date', 'cancel_until', 'languages', 'price', 'duration', 'pickup', 'type', 'guide'],
+        rows,
+    )
+
+def verbose_excursion_or_transfer_options_response(options, service):
     result = f"The options available for this {service} are the following:\n\n"
     i = 1
     for option in options['services']:
@@ -333,7 +579,7 @@ def generate_excursion_or_transfer_options_response(options, service):
         result += f"Travel date: {option['travel_date']}\n"
         result += f"Cancelation date: Until {option['cancellation_date']}\n"
         result += f"Language: {', '.join(option['language'])}\n"
-        result += f"Price: ${option['sale_price']} {option['currency']}\n"
+        result += f"Price: {money(option.get('sale_price'), option['currency'], '$')}\n"
         result += f"Service duration: {option['service_duration']}\n"
         result += f"Pickup from: {option['meeting_point']}, {option['city'].title()}\n"
         result += f"Type of service: {'Shared' if option['is_regular'] else 'Private'}\n"
@@ -342,6 +588,17 @@ def generate_excursion_or_transfer_options_response(options, service):
     return result
 
 def generate_excursion_or_transfer_description_response(description, service):
+    return render('service_description', verbose_excursion_or_transfer_description_response, compact_excursion_or_transfer_description_response, description, service)
+
+def compact_excursion_or_transfer_description_response(description, service):
+    text = description['descriptions']['d_text_es'] if session_language() == 'es' else description['descriptions']['d_text_en']
+    result = f"{service.title()}: {service_name(description)}. Reply in the user's language.\n"
+    result += f"Description: {text}\n"
+    result += f"Includes: {', '.join(description['concepts'])}\n"
+    result += f"City: {description['city']}\n"
+    return result
+
+def verbose_excursion_or_transfer_description_response(description, service):
     result = f"The {service} information is the following:\n\n"
     result += f"Name (Spanish): {description['glosas']['g_text_es']}\n"
     result += f"Name (English): {description['glosas']['g_text_en']}\n"
@@ -353,6 +610,46 @@ def generate_excursion_or_transfer_description_response(description, service):
     result += f'(Also, if necesary, translate the labels to the language used by the user)\n'
     return result
 
+def build_excursion_booking_payload(serviceAvailability, language, firstName, lastName, email, phone, passportOrDni, country, referenceNumber, notes, flightNumber):
+    currency = session.currency_id()
+    serviceCode = serviceAvailability['service_code']
+    adults = serviceAvailability['adults']
+    children = serviceAvailability['children']
+    salePrice = serviceAvailability['sale_price']
+    # Get the language from serviceAvailability['language'] (array) where equals to language
+    for serviceLanguage in serviceAvailability['language']:
+        if serviceLanguage == language:
+            language = serviceLanguage
+            break
+    travelDate = serviceAvailability['travel_date']
+
+    payload = {
+        "passenger": {
+            "name": firstName,
+            "last_name": lastName,
+            "country": country,
+            "email": email,
+            "passport_or_dni": passportOrDni,
+            "phone": phone
+        },
+        "notes": notes,
+        "reference_number": referenceNumber,
+        "currency": currency,
+        "services": [
+            {
+                "service_code": serviceCode,
+                "adults": adults,
+                "children": children,
+                "sale_price": salePrice,
+                "language": language,
+                "travel_date": travelDate,
+                "flight_number": flightNumber,
+                "notes": notes
+            }
+        ],
+    }
+    return payload
+
 def get_data_for_excursion_or_transfer_booking(
     serviceNumber: int,
     serviceCode: int,
@@ -360,7 +657,8 @@ def get_data_for_excursion_or_transfer_booking(
     tipos: int,
     travelDate: str,
     adults: int,
-    children: int
+    children: int,
+    refresh: bool = False,
     ) -> dict:
     """
     Get the data for a transport or excursion booking.
@@ -373,16 +671,20 @@ def get_data_for_excursion_or_transfer_booking(
     travelDate (string): The travel date.
     adults: The number of adults. Default is 1.
     children: The number of children. Default is 0.
+    refresh: Skip the cached availability and fetch it again, so the price
+    and the availability are current. Used at booking time.
 
     Returns:
     The booking response as a string with the booking ID and
     a link to the booking detail.
     """
-    currency = 1 if os.getenv("CURRENCY") == 'CLP' else 2
-    url = f'{os.getenv("CTS_API_V2")}/availability/?townId={townId}&tipos={tipos}&fecha={travelDate}&adults={adults}&children={children}&currency={currency}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.get(url, headers=headers).json()
-    services = response[serviceNumber-1]
-    result = next((service for service in services['services'] if service['service_code'] == serviceCode), None)
-    return result
\ No newline at end of file
+    response = yield from fetch_availability(townId, tipos, travelDate, adults, children, refresh)
+    return find_service(response, serviceNumber, serviceCode)
+
+def find_service(response, serviceNumber, serviceCode):
+    # A fresh listing may be in another order: fall back to the service code alone.
+    listings = response[serviceNumber-1:serviceNumber] + response
+    result = next((service for listing in listings for service in listing['services'] if service['service_code'] == serviceCode), None)
+    if result is None:
+        raise LookupError(f'Service {serviceCode} is no longer available for that date and passengers')
+    return result
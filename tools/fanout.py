@@ -0,0 +1,86 @@
+"""
+Concurrent fan-out for the multi-search tools.
+
+A search over several towns, dates and occupancies is expanded into one CTS
+request per combination. The requests run concurrently, at most
+CTS_FANOUT_CONCURRENCY (default 4) at a time: from a thread pool for the sync
+tools and under a semaphore for the async ones. A failed combination does not
+fail the whole search, its exception is returned in place of its result.
+
+CTS_FANOUT_MAX_SEARCHES (default 12) caps the number of combinations a single
+tool call may expand to.
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Iterable, Sequence
+
+_stats = {'fanouts': 0, 'searches': 0, 'failures': 0}
+_stats_lock = threading.Lock()
+
+
+def concurrency() -> int:
+    return max(int(os.getenv('CTS_FANOUT_CONCURRENCY', '4')), 1)
+
+
+def combinations(*dimensions: Sequence) -> list[tuple]:
+    """Every combination of the given dimensions, in order."""
+    searches = list(itertools.product(*dimensions))
+    max_searches = int(os.getenv('CTS_FANOUT_MAX_SEARCHES', '12'))
+    if len(searches) > max_searches:
+        raise ValueError(
+            f'The search expands to {len(searches)} combinations, the maximum is {max_searches}. '
+            'Use fewer towns, dates or occupancies.'
+        )
+    return searches
+
+
+def run(fn: Callable[..., Any], calls: Iterable[tuple]) -> list:
+    """fn(*args) for every args in calls, concurrently. Results keep the order of calls."""
+    calls = list(calls)
+    if not calls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(concurrency(), len(calls))) as executor:
+        # One context copy per call, so session context vars reach the workers.
+        futures = [executor.submit(contextvars.copy_context().run, _capture, fn, *args) for args in calls]
+        results = [future.result() for future in futures]
+    _record(results)
+    return results
+
+
+async def arun(fn: Callable[..., Awaitable[Any]], calls: Iterable[tuple]) -> list:
+    calls = list(calls)
+    semaphore = asyncio.Semaphore(concurrency())
+
+    async def call(args):
+        async with semaphore:
+            try:
+                return await fn(*args)
+            except Exception as e:
+                return e
+
+    results = await asyncio.gather(*(call(args) for args in calls))
+    _record(results)
+    return results
+
+
+def stats() -> dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _capture(fn: Callable[..., Any], *args) -> Any:
+    try:
+        return fn(*args)
+    except Exception as e:
+        return e
+
+
+def _record(results: list) -> None:
+    with _stats_lock:
+        _stats['fanouts'] += 1
+        _stats['searches'] += len(results)
+        _stats['failures'] += sum(isinstance(result, Exception) for result in results)
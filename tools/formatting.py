@@ -0,0 +1,88 @@
+"""
+Output formatting shared by the tool response helpers.
+
+Tool results are read by the model, not by the user, so by default they are
+rendered in a compact form: one header line with the column names and the
+instructions for the whole result set, then one pipe-separated row per item,
+and only the texts in the session language. Set CTS_TOOL_OUTPUT=verbose to
+get the original, labelled format back.
+
+Every rendered result is counted in tokens. With CTS_TOOL_OUTPUT_MEASURE=true
+the other format is rendered too (and discarded) so stats() can report how
+many tokens the compact format saves.
+"""
+import os
+import threading
+from typing import Callable, Iterable, Optional
+
+from tools import session
+
+_encoding = None
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def compact_output() -> bool:
+    return os.getenv('CTS_TOOL_OUTPUT', 'compact').lower() != 'verbose'
+
+
+def session_language() -> str:
+    """'es' or 'en', from the language selected for the session."""
+    language = (session.language() or '').strip().lower()
+    return 'es' if language.startswith(('es', 'spa')) else 'en'
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('o200k_base')
+        except Exception:
+            _encoding = False
+    if not _encoding:
+        # Rough estimate when tiktoken or its vocabulary is not available.
+        return len(text) // 4
+    return len(_encoding.encode(text))
+
+
+def cell(value) -> str:
+    return ' '.join(str('' if value is None else value).replace('|', '/').split())
+
+
+def money(amount, currency: str, symbol: str = '') -> str:
+    """'85000 CLP', or 'n/a' when the rate has no amount, so it never reads as a price."""
+    return 'n/a' if amount is None else f'{symbol}{amount} {currency}'
+
+
+def table(header: str, columns: Iterable[str], rows: Iterable[Iterable], footer: Optional[str] = None) -> str:
+    lines = [f'{header} Columns: {"|".join(columns)}']
+    lines += ['|'.join(cell(value) for value in row) for row in rows]
+    if footer:
+        lines.append(footer)
+    return '\n'.join(lines) + '\n'
+
+
+def render(name: str, verbose: Callable[..., str], compact: Callable[..., str], *args) -> str:
+    """Render a tool result with the configured format and record its size."""
+    use_compact = compact_output()
+    result = (compact if use_compact else verbose)(*args)
+    tokens = count_tokens(result)
+    measured = None
+    if os.getenv('CTS_TOOL_OUTPUT_MEASURE', 'false').lower() == 'true':
+        other = count_tokens((verbose if use_compact else compact)(*args))
+        measured = (tokens, other) if use_compact else (other, tokens)
+    with _stats_lock:
+        stats = _stats.setdefault(name, {'calls': 0, 'tokens': 0, 'measured': 0, 'compact_tokens': 0, 'verbose_tokens': 0})
+        stats['calls'] += 1
+        stats['tokens'] += tokens
+        if measured:
+            stats['measured'] += 1
+            stats['compact_tokens'] += measured[0]
+            stats['verbose_tokens'] += measured[1]
+    return result
+
+
+def stats() -> dict[str, dict[str, int]]:
+    with _stats_lock:
+        return {name: dict(values) for name, values in _stats.items()}
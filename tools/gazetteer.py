@@ -0,0 +1,281 @@
+"""
+In-process town gazetteer.
+
+Loads a CTS city catalog once, keeps it in memory and answers town name
+lookups without a network round trip. Names are folded (accents, case and
+punctuation removed) so 'Viña del Mar', 'VIÑA DEL MAR' and 'vina del mar'
+hit the same entry. Known abbreviations go through ALIASES, and anything else
+falls back to trigram similarity to absorb typos, but only for a clear match:
+similar enough and well ahead of the runner-up, since 'Puerto Varas' and
+'Puerto Montt' are close too. resolve() also returns the catalog name, so a
+corrected name can be confirmed with the user. mentions() finds the towns
+named in free text, by exact name or alias only.
+
+The catalog is refreshed in a background thread once it is older than the
+TTL (CTS_TOWNS_TTL, seconds, default 6 hours); stale entries are served
+meanwhile. An empty catalog counts as a failed load. After a failed first
+load, lookups only see the towns learned with add() until the next try,
+CTS_TOWNS_RETRY seconds later (default 60). Learned towns survive refreshes.
+"""
+import asyncio
+import contextvars
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+ALIASES = {
+    'stgo': 'santiago',
+    'scl': 'santiago',
+    'santiago de chile': 'santiago',
+    'vina': 'vina del mar',
+    'valpo': 'valparaiso',
+    'pto varas': 'puerto varas',
+    'pto montt': 'puerto montt',
+    'pto natales': 'puerto natales',
+    'san pedro': 'san pedro de atacama',
+    'torres del paine': 'puerto natales',
+}
+
+# Dice similarity a fuzzy match needs, and its lead over the second best.
+MIN_SIMILARITY = 0.6
+MIN_MARGIN = 0.1
+
+# Longest town name mentions() looks for, in words ('san pedro de atacama').
+MAX_NAME_WORDS = 5
+
+
+def fold(name: str) -> str:
+    """Lowercase, strip accents and collapse punctuation/whitespace."""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).casefold()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', name).split())
+
+
+def trigrams(name: str) -> set[str]:
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    def __init__(
+        self,
+        loader: Callable[[], list[dict]],
+        aloader: Callable[[], Awaitable[list[dict]]],
+        id_key: str,
+        name_key: str = 'name',
+        ttl: Optional[float] = None,
+    ):
+        self.loader = loader
+        self.aloader = aloader
+        self.id_key = id_key
+        self.name_key = name_key
+        self.ttl = ttl if ttl is not None else float(os.getenv('CTS_TOWNS_TTL', str(6 * 3600)))
+        self._ids: dict[str, Any] = {}
+        self._names: dict[str, str] = {}
+        self._trigrams: dict[str, set[str]] = defaultdict(set)
+        self._sizes: dict[str, int] = {}
+        # Towns added with add(), by folded name or alias: (town ID, name).
+        self._learned: dict[str, tuple[Any, str]] = {}
+        self._loaded_at: Optional[float] = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._loading: Optional[Future] = None
+        self._stats = {'exact': 0, 'alias': 0, 'fuzzy': 0, 'misses': 0, 'loads': 0, 'load_errors': 0}
+
+    def lookup(self, townName: str) -> Optional[Any]:
+        """Town ID for townName, or None when the catalog has no close match."""
+        town = self.resolve(townName)
+        return None if town is None else town[0]
+
+    async def alookup(self, townName: str) -> Optional[Any]:
+        town = await self.aresolve(townName)
+        return None if town is None else town[0]
+
+    def resolve(self, townName: str) -> Optional[tuple[Any, str]]:
+        """Town ID and catalog name for townName, or None when the catalog has no close match."""
+        self.warm()
+        return self._match(townName)
+
+    async def aresolve(self, townName: str) -> Optional[tuple[Any, str]]:
+        await self.awarm()
+        return self._match(townName)
+
+    def warm(self) -> None:
+        """Load the catalog if it is not loaded yet, or refresh it in the background once stale."""
+        if self._loaded_at is None and time.monotonic() < self._retry_at:
+            return
+        if self._loaded_at is None:
+            # Concurrent first lookups (e.g. a prefetch and the tool call it
+            # anticipated) share a single catalog load.
+            future, leader = self._claim_load()
+            if leader:
+                try:
+                    self._load(self.loader())
+                except Exception as e:
+                    self._load_failed(e)
+                finally:
+                    self._finish_load(future)
+            else:
+                future.result()
+        else:
+            self._refresh_if_stale()
+
+    async def awarm(self) -> None:
+        if self._loaded_at is None and time.monotonic() < self._retry_at:
+            return
+        if self._loaded_at is None:
+            future, leader = self._claim_load()
+            if leader:
+                try:
+                    self._load(await self.aloader())
+                except Exception as e:
+                    self._load_failed(e)
+                finally:
+                    self._finish_load(future)
+            else:
+                await asyncio.wrap_future(future)
+        else:
+            self._refresh_if_stale()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def mentions(self, text: str) -> Optional[str]:
+        """Catalog name of the first town named in text, exactly or by alias. Never loads the catalog."""
+        words = fold(text).split()
+        with self._lock:
+            for start in range(len(words)):
+                for end in range(min(len(words), start + MAX_NAME_WORDS), start, -1):
+                    key = ' '.join(words[start:end])
+                    key = key if key in self._ids else ALIASES.get(key)
+                    if key in self._ids:
+                        return self._names.get(key) or key
+        return None
+
+    def add(self, name: str, town_id: Any, aliases: Iterable[str] = ()) -> None:
+        """Index a town learned outside the catalog (e.g. from a remote search), by its name and aliases."""
+        with self._lock:
+            for key in {fold(name), *(fold(alias) for alias in aliases)}:
+                if key:
+                    self._learned[key] = (town_id, name)
+                    self._index(key, town_id, name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                'size': len(self._ids),
+                'learned': len(self._learned),
+                'age': None if self._loaded_at is None else round(time.monotonic() - self._loaded_at, 1),
+            }
+
+    def _index(self, key: str, town_id: Any, name: str) -> None:
+        if not key:
+            return
+        self._ids.setdefault(key, town_id)
+        self._names.setdefault(key, name)
+        self._sizes[key] = len(trigrams(key))
+        for gram in trigrams(key):
+            self._trigrams[gram].add(key)
+
+    def _load(self, towns: list[dict]) -> None:
+        if not towns:
+            raise ValueError('the town catalog is empty')
+        ids: dict[str, Any] = {}
+        names: dict[str, str] = {}
+        grams: dict[str, set[str]] = defaultdict(set)
+        sizes: dict[str, int] = {}
+        for town in towns:
+            name = str(town.get(self.name_key) or '')
+            key = fold(name)
+            if key and key not in ids:
+                ids[key] = town[self.id_key]
+                names[key] = name
+                sizes[key] = len(trigrams(key))
+                for gram in trigrams(key):
+                    grams[gram].add(key)
+        with self._lock:
+            self._ids, self._names, self._trigrams, self._sizes = ids, names, grams, sizes
+            for key, (town_id, name) in self._learned.items():
+                self._index(key, town_id, name)
+            self._loaded_at = time.monotonic()
+            self._stats['loads'] += 1
+
+    def _claim_load(self) -> tuple[Future, bool]:
+        with self._lock:
+            if self._loading is not None:
+                return self._loading, False
+            self._loading = Future()
+            return self._loading, True
+
+    def _finish_load(self, future: Future) -> None:
+        with self._lock:
+            self._loading = None
+        future.set_result(None)
+
+    def _refresh_if_stale(self) -> None:
+        if time.monotonic() - self._loaded_at < self.ttl:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        # Copy the context, so the loader sees the session of the lookup that triggered it.
+        threading.Thread(target=contextvars.copy_context().run, args=(self._refresh,), daemon=True).start()
+
+    def _refresh(self) -> None:
+        try:
+            self._load(self.loader())
+        except Exception as e:
+            # Keep serving the stale catalog, retry on the next lookup.
+            self._load_failed(e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _load_failed(self, error: Exception) -> None:
+        print(f'Town catalog load failed: {error}')
+        with self._lock:
+            self._stats['load_errors'] += 1
+            self._retry_at = time.monotonic() + float(os.getenv('CTS_TOWNS_RETRY', '60'))
+
+    def _match(self, townName: str) -> Optional[tuple[Any, str]]:
+        key = fold(townName)
+        with self._lock:
+            if key in self._ids:
+                self._stats['exact'] += 1
+            elif ALIASES.get(key) in self._ids:
+                self._stats['alias'] += 1
+                key = ALIASES[key]
+            else:
+                key = self._closest(key)
+                if key is None:
+                    self._stats['misses'] += 1
+                    return None
+                self._stats['fuzzy'] += 1
+            return self._ids[key], self._names.get(key) or key
+
+    def _closest(self, key: str) -> Optional[str]:
+        grams = trigrams(key)
+        shared: dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                shared[candidate] += 1
+        best, best_score, runner_up = None, 0.0, 0.0
+        for candidate, count in shared.items():
+            # Dice coefficient over the two trigram sets.
+            score = 2 * count / (len(grams) + self._sizes[candidate])
+            if score > best_score:
+                best, best_score, runner_up = candidate, score, best_score
+            elif score > runner_up:
+                runner_up = score
+        if best_score < MIN_SIMILARITY or best_score - runner_up < MIN_MARGIN:
+            return None
+        return best
@@ -0,0 +1,25 @@
+from typing import Annotated
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import tool
+from langgraph.prebuilt import InjectedState
+
+
+@tool
+def expand_tool_result(tool_call_id: str, state: Annotated[dict, InjectedState]) -> str:
+    """
+    Get the full result of an earlier tool call that appears compacted in the conversation.
+
+    Args:
+    tool_call_id: The tool_call_id given in the compacted result.
+
+    Returns:
+    The tool result as it was first returned.
+
+    Example:
+    expand_tool_result(tool_call_id='call_abc123')
+    """
+    # Results are only compacted in the prompt: the state keeps them whole.
+    for message in reversed(state["messages"]):
+        if isinstance(message, ToolMessage) and message.tool_call_id == tool_call_id:
+            return message.content
+    return f"There is no tool result with tool_call_id {tool_call_id}."
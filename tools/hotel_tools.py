@@ -1,11 +1,15 @@
-from langchain_core.tools import tool
 import os
-import requests
+from tools import fanout, session, steps
+from tools.cache import ResultCache, token_scope
+from tools.formatting import money, render, table, session_language
+from tools.gazetteer import Gazetteer, fold
+import heapq
 import json
+import re
 from datetime import date, datetime, timedelta
 from typing import Optional, List, Dict
 
-@tool
+@steps.cts_tool
 def get_availability_for_hotels(
     townId: Optional[str] = None,
     checkin_date: Optional[str] = None,
@@ -14,6 +18,12 @@ def get_availability_for_hotels(
     children: Optional[int] = 0,
     infants: Optional[int] = 0,
     ages: Optional[List[int]] = [],
+    min_stars: Optional[int] = None,
+    max_stars: Optional[int] = None,
+    max_price: Optional[float] = None,
+    amenities: Optional[List[str]] = None,
+    sort_by: Optional[str] = 'price',
+    limit: Optional[int] = 3,
 ) -> List[Dict]:
     """
     Get availability of hotels in a given town.
@@ -26,25 +36,29 @@ def get_availability_for_hotels(
     children: The number of children. Default is 0.
     infants: The number of infants. Default is 0.
     ages: The ages of the children. Default is [].
+    min_stars: Only hotels with at least these stars (1 to 5). Optional.
+    max_stars: Only hotels with at most these stars (1 to 5). Optional.
+    max_price: Only hotels whose lowest price is at or below this value, in the session currency. Optional.
+    amenities: Amenities every hotel must have, e.g. ['pool', 'parking']. Optional.
+    sort_by: 'price' for the cheapest first or 'stars' for the best rated first. Default is 'price'.
+    limit: The number of hotels to return. Default is 3.
+
+    Use the filter arguments for the user's preferences instead of asking for
+    every hotel and filtering them yourself.
 
     Returns:
-    A list of dictionaries containing the availability of
-    hotels in the given town.
+    The best matching hotels in the given town, and how many other
+    hotels also match.
 
     Example:
-    get_availability(townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1)
+    get_availability(townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1, min_stars=4, amenities=['pool'])
     """
-    url = f'{os.getenv("CTS_API_V1")}/hotel/'
-
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-    json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
-    response = requests.post(url, json=json, headers=headers)
-    result = generate_hotels_availability_response(response.json(), json)
+    json, hotels = yield from fetch_hotels(townId, checkin_date, checkout_date, adults, children, infants, ages)
+    hotels, remaining = rank_hotels(hotels, min_stars, max_stars, max_price, amenities, sort_by, limit)
+    result = generate_hotels_availability_response({'data': hotels}, json, remaining)
     return result
 
-@tool
+@steps.cts_tool
 def get_hotel_info(
     hotelId: str,
     townId: Optional[str] = None,
@@ -78,40 +92,12 @@ def get_hotel_info(
     get_availability(hotelId = '196', townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1)
     """
     try:
-        url = f'{os.getenv("CTS_API_V1")}/hotel/{hotelId}/'
-
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}'}
-        currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-        json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
-        response = requests.post(url, json=json, headers=headers).json()
-        hotelData = response['data']
-        hotelId = hotelData['id']
-        hotelName = hotelData['name']
-        hotelAdress = hotelData['address']
-        hotelCategory = hotelData['category']['name']
-        hotelStars = hotelData['category']['rating']
-        hotelDescriptionSpanish = hotelData['policies_description']
-        hotelDescriptionEnglish = hotelData['policies_description_en']
-        hotelAmmenities = ', '.join([amenity['name'] for amenity in hotelData['ammenities']])
-
-        result = f'The hotel {hotelName} has the following information: \n\n'
-        result += f'Hotel ID: {hotelId} (Never show this item to the user, keep only for you)\n'
-        result += f'Hotel Name: {hotelName}\n'
-        result += f'Hotel Address: {hotelAdress}\n'
-        result += f'Hotel Category: {hotelCategory}\n'
-        result += f'Hotel Stars: {hotelStars}\n'
-        result += f'Hotel Description (Spanish): {hotelDescriptionSpanish}\n'
-        result += f'Hotel Description (English): {hotelDescriptionEnglish}\n'
-        result += f'(Use the hotel description acording to the language used by the user. If you are not sure, just translate to the related language)\n\n'
-        result += f'(Also, if necesary, translate the labels to the language used by the user)\n'
-        result += f'Hotel Ammenities: {hotelAmmenities}\n\n'
-
-        return result
+        response = yield from get_data_for_booking(hotelId, townId, checkin_date, checkout_date, adults, children, infants, ages)
+        return generate_hotel_info_response(response)
     except Exception as e:
         return f'Error: {e}, in line {e.__traceback__.tb_lineno}'
 
-@tool
+@steps.cts_tool
 def get_hotel_rooms_available(
     hotelId: str,
     townId: Optional[str] = None,
@@ -157,54 +143,12 @@ def get_hotel_rooms_available(
     get_availability(hotelId = '196', townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1)
     """
     try:
-        url = f'{os.getenv("CTS_API_V1")}/hotel/{hotelId}/'
-
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}'}
-        currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-        json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
-        response = requests.post(url, json=json, headers=headers).json()
-        hotelName = response['data']['name']
-        availability = response['data']['availability']
-        result = f'The rooms available in {hotelName} from {checkin_date} to {checkout_date} are: \n\n'
-        roomsList = []
-        i = 1
-        for available in availability:
-            currency = 'CLP' if available['currency_id'] == 1 else 'USD'
-            for room in available['rooms']:
-                if room['roomtype_id'] in roomsList:
-                    continue
-                result += f'ROOM {i}: \n'
-                roomId = room['roomtype_id']
-                result += f'Room Id: {roomId}\n'
-                roomType = room['roomtype']
-                result += f'Room type or name: {roomType}\n'
-                price = available['price_value_with_tax']
-                if currency == 'CLP':
-                    result += f'Price: ${price} {currency}, tax included.\n'
-                else:
-                    result += f'Price: ${price} {currency}.\n'
-                ratePlan = room['rateplan_name']
-                result += f'Rate plan: {ratePlan}\n'
-                cancellation = room['cancellation_type']
-                result += f'Cancellation policy: {cancellation}\n'
-                cancellationTime = datetime.strptime(checkin_date, '%Y-%m-%d') - timedelta(hours=response['data']['cancellation'])
-                result += f'Cancellation time: {cancellationTime.strftime("%d de %B de %Y")}\n'
-                mealPlan = room['mealplan']
-                result += f'Meal plan: {mealPlan}\n'
-                adults = room['adults']
-                result += f'Adults: {adults}\n'
-                bedOptions = room['bed_options']
-                size = room['size']
-                result += f'Bed options: {bedOptions} ({size})\n\n'
-                roomsList.append(roomId)
-                i += 1
-
-        return result
+        response = yield from get_data_for_booking(hotelId, townId, checkin_date, checkout_date, adults, children, infants, ages)
+        return generate_hotel_rooms_response(response, checkin_date, checkout_date)
     except Exception as e:
         return f'Error: {e}, in line {e.__traceback__.tb_lineno}'
 
-@tool
+@steps.cts_tool
 def get_town_id_for_hotels(townName: str) -> List[Dict]:
     """
     Get the town ID.
@@ -213,22 +157,59 @@ def get_town_id_for_hotels(townName: str) -> List[Dict]:
     townName: The town or city name.
 
     Returns:
-    The Town ID.
+    The Town ID and the name of the town it belongs to. If that name is not
+    the one asked for, confirm it with the user before searching.
 
     Example:
     get_city_id('santiago')
     """
+    return town_response(townName, (yield from hotel_town(townName)))
+
+@steps.cts_tool
+def search_hotels_availability(
+    towns: List[str],
+    date_ranges: List[Dict],
+    occupancies: Optional[List[Dict]] = None,
+    min_stars: Optional[int] = None,
+    max_stars: Optional[int] = None,
+    max_price: Optional[float] = None,
+    amenities: Optional[List[str]] = None,
+    sort_by: Optional[str] = 'price',
+    limit: Optional[int] = 5,
+) -> List[Dict]:
+    """
+    Search hotels in several towns, date ranges and occupancies at once.
 
-    # Set townName to uppercase and replace written accents
-    townName = townName.upper().replace('Á', 'A').replace('É', 'E').replace('Í', 'I').replace('Ó', 'O').replace('Ú', 'U')
+    Args:
+    towns: The town or city names, e.g. ['Santiago', 'Valparaiso'].
+    date_ranges: The stays to search, e.g. [{'checkin_date': '2025-03-07', 'checkout_date': '2025-03-09'}].
+    occupancies: The guests to search for, e.g. [{'adults': 2}, {'adults': 2, 'children': 1, 'ages': [5]}]. Default is 1 adult.
+    min_stars: Only hotels with at least these stars (1 to 5). Optional.
+    max_stars: Only hotels with at most these stars (1 to 5). Optional.
+    max_price: Only hotels whose lowest price is at or below this value, in the session currency. Optional.
+    amenities: Amenities every hotel must have, e.g. ['pool', 'parking']. Optional.
+    sort_by: 'price' for the cheapest first or 'stars' for the best rated first. Default is 'price'.
+    limit: The number of hotels to return across all the searches. Default is 5.
+
+    Use this tool instead of several 'get_availability_for_hotels' calls when
+    the user is flexible about the town, the dates or the guests (e.g. 'any
+    weekend in March', 'Santiago or Valparaiso'). The town IDs are resolved
+    by the tool.
 
-    url = f'https://apibooking.ctsturismo.com/api/city/dtt/?q={townName}'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    response = requests.get(url, headers=headers)
-    return response.json()[0]['dtt_id']
+    Returns:
+    The best matching hotels across all the searches, with the town, dates
+    and guests each one was found for.
 
-@tool
+    Example:
+    search_hotels_availability(towns=['Santiago', 'Valparaiso'], date_ranges=[{'checkin_date': '2025-03-07', 'checkout_date': '2025-03-09'}, {'checkin_date': '2025-03-14', 'checkout_date': '2025-03-16'}], occupancies=[{'adults': 2}], min_stars=4)
+    """
+    townIds = yield steps.Fanout(hotel_town_id, [(townName,) for townName in towns])
+    searches = fanout.combinations(list(zip(towns, townIds)), date_ranges, occupancies or [{}])
+    results = yield steps.Fanout(search_hotels, searches)
+    matches, remaining, failures = merge_hotel_searches(searches, results, min_stars, max_stars, max_price, amenities, sort_by, limit)
+    return generate_hotels_search_response(matches, remaining, failures)
+
+@steps.cts_tool
 def create_hotel_booking(
     hotelId: int,
     townId: Optional[str] = None,
@@ -275,177 +256,18 @@ def create_hotel_booking(
     a link to the booking detail.
     """
     try:
-        currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-        hotelAvailability = get_data_for_booking(hotelId=hotelId, townId=townId, checkin_date=checkin_date, checkout_date=checkout_date, adults=adults, children=children, infants=infants, ages=ages)
-        if not hotelAvailability:
-            raise ValueError("No availabilty found for this hotel.")
-        hotelData = hotelAvailability['data']
-        townName = hotelData['town']['name']
-        hotelName = hotelData['name']
-        ammenities = hotelData['ammenities']
-        concepts = ', '.join([amenity['name'] for amenity in ammenities])
-        user = 1
-        currency = 'CLP' if currency == 1 else 'USD'
-        avail = hotelData['availability']
-        availability = None
-        for dispo in avail:
-            for room in dispo['rooms']:
-                if room['roomtype_id'] == roomId:
-                    availability = dispo
-        if not availability:
-            raise ValueError("Room with the specified roomId not found in availability data.")
-        markup = availability['markup'][0]
-        bookingAvailabilityList = []
-        availabilityDetails = availability['details']
-        primary_image_url = next((image["url"] for image in hotelData["images"] if image["is_primary"]), None)
-        rooms = availability['rooms']
-        #convert checkin_date and checkout_date from 'YYY-mm-dd' to 'dd-mm-YYY'
-        checkin_date_inv = datetime.strptime(checkin_date, '%Y-%m-%d').strftime('%d-%m-%Y')
-        checkout_date_inv = datetime.strptime(checkout_date, '%Y-%m-%d').strftime('%d-%m-%Y')
-
-        # Collecting booking information
-        for room in rooms:
-            inventory_ids = []
-            for detail in room['details']:
-                inventory_id = detail['inventory_id']
-                rate_id = detail['rate_id']
-                room_name = room['roomtype']
-                inventory_ids.append({
-                    'inventoryId': inventory_id,
-                    'roomName': room_name,
-                    'rateIds': [rate_id],
-                    'adults': [room['adults']],
-                    'amount': 1  # Assuming one room per inventory
-                })
-
-            bookingAvailabilityList.append({
-                'hotelId': hotelData['id'],
-                'hotelName': hotelData['name'],
-                'inventoryIds': inventory_ids
-            })
-
-        # Extracting pricing and guest details
-        priceBase = availability['price_base']
-        priceValue = availability['price_value']
-        priceValueWithTax = availability['price_value_with_tax']
-        additionalBase = availability['additional_base']
-        additionalTotalBase = availability['additional_total_base']
-        additionalValueWithTax = availability['additional_value_with_tax']
-        
-        # Defining payload details
-        payload_detail = [
-            {
-                "date": detail['date'],
-                "total": detail['total'],
-                "total_base": detail['total_base'],
-                "total_with_tax": detail['total_with_tax'],
-                "additional_base": detail['additional_base'],
-                "additional_total_base": detail['additional_total_base'],
-                "additional_total_with_tax": detail['additional_total_with_tax'],
-                "rooms": detail['rooms']
-            } for detail in availabilityDetails
-        ]
-
-        payload = {
-            "name": name,
-            "last_name": lastName,
-            "passport_or_dni": passportOrDni,
-            "email": email,
-            "phone": phone,
-            "country": country,
-            "notes": notes,
-            "currency": currency,
-            "adults": adults,
-            "children": children,
-            "infants": infants,
-            "total_amount": priceValueWithTax,
-            "total_net_amount": priceValue,
-            "total_collect_amount": priceValueWithTax,
-            "reference_number": referenceNumber,
-            "user": user,
-            "booking_availability": bookingAvailabilityList,
-            "cart_items": {
-                "count": 1,
-                "hotels": [
-                    {
-                        "dtt_hotel_code": hotelId,
-                        "dtt_hotel_markup": markup,
-                        "glosa_visualizer": hotelName,
-                        "glosa_soptur": hotelName,
-                        "provider": "DTT",
-                        "city": townName,
-                        "concepts": concepts,
-                        "country": townName,
-                        "service_type": "hotel",
-                        "adults": adults,
-                        "children": children,
-                        "infants": infants,
-                        "adult_total_amount": priceValueWithTax,
-                        "children_total_amount": additionalValueWithTax,
-                        "amount": priceValueWithTax,
-                        "net_amount": priceValue,
-                        "pull_inventory": "false",
-                        "hotel_additional_total": additionalTotalBase,
-                        "hotel_additional_base": additionalBase,
-                        "hotel_total": priceBase,
-                        "travel_date": checkin_date_inv,
-                        "checkout": checkout_date_inv,
-                        "cover_image": primary_image_url,
-                        "payload_detail": payload_detail,
-                        "dtt_fee_percent": 0,
-                        "dtt_fee_value": 0,
-                        "total_dtt": 0,
-                        "rooms": rooms,
-                        "id": 3,
-                        "nights": 2,
-                        "hotelName": hotelName,
-                        "roomType": room_name,
-                        "subTotalPrice": priceValue,
-                        "taxPrice": priceValueWithTax - priceValue,
-                        "totalPrice": priceValueWithTax,
-                        "serviceUrl": f"/results/hotels/{hotelId}?townId=51&checkin={checkin_date}&checkout={checkout_date}&rooms=[{{%22adults%22:{adults},%22children%22:{children},%22infants%22:{infants},%22ages%22:[]}}]#rooms",
-                        "item_extras": {
-                            "address": hotelData['address'],
-                            "description": hotelData['policies_description'],
-                            "checkinHour": hotelData['checkin'],
-                            "checkoutHour": hotelData['checkout'],
-                            "hotelPhone": hotelData['phone']
-                        },
-                        "cancellationTime": hotelData['cancellation'],
-                        "additional_information": notes
-                    }
-                ],
-                "services": [],
-                "packages": [],
-                "createdAt": datetime.now().isoformat(),
-                "discount": {}
-            },
-            "language": "es",
-            "company": None
-        }
-
-        url = f'{os.getenv("CTS_API_V1")}/booking/'
-        cts_token = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {cts_token}', 'origin': 'localhost'}
-
-        response = requests.post(url, headers=headers, json=payload).json()
-
-        if response:
-            booking_id = response['file_number']
-            slug = response['slug']
-            booking_link = os.getenv("FRONT_HOST") + f'/bookings/{slug}'
-            return f'Se ha realizado la reserva con éxito. El número de reserva es {booking_id}. Puede ver los detalles de la reserva en el siguiente enlace: {booking_link}'
-        else:
-            print("Empty response received")
-            return "Error: Empty response received from the server"
-
+        hotelAvailability = yield from get_data_for_booking(hotelId=hotelId, townId=townId, checkin_date=checkin_date, checkout_date=checkout_date, adults=adults, children=children, infants=infants, ages=ages, refresh=True)
+        payload = build_hotel_booking_payload(hotelAvailability, hotelId, checkin_date, checkout_date, adults, children, infants, roomId, name, lastName, email, phone, passportOrDni, country, referenceNumber, notes)
+        url, headers = booking_request('/booking/')
+        response = (yield steps.post(url, headers=headers, json=payload)).json()
+        return generate_hotel_booking_response(response)
     except Exception as e:
         print(f"Error: {e}")
         return f"Error: {e}"
 
-@tool
+@steps.cts_tool
 def update_hotel_booking(
-        bookingId: str, 
+        bookingId: str,
         additionalInformation: Optional[str] = '',
         notes: Optional[str] = '',
         referenceNumber: Optional[str] = ''
@@ -466,31 +288,16 @@ def update_hotel_booking(
     update_hotel_booking('1234', additionalInformation='Room with a view', flightNumber='1234', notes='Late check-in', referenceNumber='1234')
     """
     try:
-        bookingDetails = get_booking_details(bookingId)
-        if bookingId not in bookingDetails['file_number']:
+        bookingDetails = yield from get_booking_details(bookingId)
+        if not bookingDetails or normalize_file_number(bookingDetails['file_number']) != normalize_file_number(bookingId):
             return "No se ha encontrado la reserva."
-        bookingSlug = bookingDetails['slug']
-        bookingUpdate = {}
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}', 'origin': 'localhost'}
-        if additionalInformation != "":
-            url = f'{os.getenv("CTS_API_V1")}/booking/item/{bookingDetails["items"][0]["id"]}/'
-            bookingUpdate['additional_information'] = additionalInformation
-            bookingUpdate['flight_number'] = ''
-        if notes != "" or referenceNumber != '':
-            url = f'{os.getenv("CTS_API_V1")}/booking/{bookingSlug}/'
-            bookingUpdate['notes'] = notes
-            bookingUpdate['reference_number'] = referenceNumber
-
-        response = requests.put(url, json=bookingUpdate, headers=headers).json()
-        if response['file_number']:
-            return f'La reserva con el número {bookingId} ha sido actualizada con éxito. Puede ver los detalles de la reserva en el siguiente enlace: {os.getenv("FRONT_HOST")}/bookings/{bookingSlug}'
-        else:
-            return 'No se ha podido actualizar la reserva.'
+        url, bookingUpdate, headers = booking_update_request(bookingDetails, additionalInformation, notes, referenceNumber)
+        response = (yield steps.put(url, json=bookingUpdate, headers=headers)).json()
+        return generate_hotel_booking_update_response(response, bookingId, bookingDetails['slug'])
     except Exception as e:
         return f'Error: {e}'
 
-@tool
+@steps.cts_tool
 def cancel_hotel_booking(bookingId: str) -> List[Dict]:
     """
     Cancel a hotel booking.
@@ -505,47 +312,617 @@ def cancel_hotel_booking(bookingId: str) -> List[Dict]:
     cancel_hotel_booking('1234')
     """
     try:
-        url = f'{os.getenv("CTS_API_V1")}/booking/cancel/'
-        ctsToken = os.getenv("CTS_TOKEN")
-        headers = {'Authorization': f'token {ctsToken}'}
-        json = {'file_number': bookingId}
-        response = requests.post(url, json=json, headers=headers)
-        if response:
-            return f'La reserva con el número {bookingId} ha sido cancelada con éxito.'
-        else:
-            return 'No se ha podido cancelar la reserva.'
+        url, json, headers = cancel_request(bookingId)
+        response = yield steps.post(url, json=json, headers=headers)
+        return generate_hotel_cancel_response(response, bookingId)
     except Exception as e:
         return f'Error: {e}'
 
 # Helpers
 
-def generate_hotels_availability_response(json_response, payload):
+def hotel_request(path, townId, checkin_date, checkout_date, adults, children, infants, ages):
+    url = f'{os.getenv("CTS_API_V1")}/hotel/{path}'
+    ctsToken = session.token()
+    headers = {'Authorization': f'token {ctsToken}'}
+    currency = session.currency_id()
+    json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
+    return url, json, headers
+
+def town_request(townName):
+    # Set townName to uppercase and remove written accents
+    townName = fold(townName).upper()
+
+    url = f'{os.getenv("CTS_BOOKING_API", "https://apibooking.ctsturismo.com/api")}/city/dtt/?q={townName}'
+    ctsToken = session.token()
+    headers = {'Authorization': f'token {ctsToken}'}
+    return url, headers
+
+def hotel_town_catalog():
+    # An empty query returns the whole DTT city catalog. If it stops doing so,
+    # the empty catalog fails the load and every lookup goes to remote_town().
+    url, headers = town_request('')
+    response = yield steps.get(url, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+hotel_towns = Gazetteer(steps.blocking(hotel_town_catalog), steps.awaitable(hotel_town_catalog), id_key='dtt_id')
+
+def hotel_town(townName):
+    """Town ID and catalog name for townName."""
+    town = yield steps.Call(hotel_towns.resolve, hotel_towns.aresolve, townName)
+    if town is None:
+        # No clear match in the local catalog, ask the remote search as before.
+        url, headers = town_request(townName)
+        response = yield steps.get(url, headers=headers)
+        response.raise_for_status()
+        town = remote_town(townName, response.json())
+    return town
+
+def remote_town(townName, towns):
+    """The first town of a remote search, learned by the gazetteer under townName too. None if there is none."""
+    if not towns:
+        return None
+    townId, name = towns[0]['dtt_id'], towns[0].get('name') or townName
+    hotel_towns.add(name, townId, aliases=[townName])
+    return townId, name
+
+def town_response(townName, town):
+    if town is None:
+        return f'Town not found: {townName}. Ask the user to check the name.'
+    return {'townId': town[0], 'town': town[1]}
+
+def hotel_town_id(townName):
+    town = yield from hotel_town(townName)
+    return None if town is None else town[0]
+
+def booking_request(path):
+    url = f'{os.getenv("CTS_API_V1")}{path}'
+    cts_token = session.token()
+    headers = {'Authorization': f'token {cts_token}', 'origin': 'localhost'}
+    return url, headers
+
+def booking_update_request(bookingDetails, additionalInformation, notes, referenceNumber):
+    bookingSlug = bookingDetails['slug']
+    bookingUpdate = {}
+    ctsToken = session.token()
+    headers = {'Authorization': f'token {ctsToken}', 'origin': 'localhost'}
+    if additionalInformation != "":
+        url = f'{os.getenv("CTS_API_V1")}/booking/item/{bookingDetails["items"][0]["id"]}/'
+        bookingUpdate['additional_information'] = additionalInformation
+        bookingUpdate['flight_number'] = ''
+    if notes != "" or referenceNumber != '':
+        url = f'{os.getenv("CTS_API_V1")}/booking/{bookingSlug}/'
+        bookingUpdate['notes'] = notes
+        bookingUpdate['reference_number'] = referenceNumber
+    return url, bookingUpdate, headers
+
+def cancel_request(bookingId):
+    url = f'{os.getenv("CTS_API_V1")}/booking/cancel/'
+    ctsToken = session.token()
+    headers = {'Authorization': f'token {ctsToken}'}
+    json = {'file_number': bookingId}
+    return url, json, headers
+
+def hotel_price(hotel):
+    return min((available['price_value_with_tax'] for available in hotel['availability'] if available.get('price_value_with_tax') is not None), default=None)
+
+def rank_hotels(hotels, min_stars=None, max_stars=None, max_price=None, amenities=None, sort_by='price', limit=3):
+    """Filter hotels and keep the top `limit` of them. Returns (top, remaining matches)."""
+    matches = filter_hotels(hotels, min_stars, max_stars, max_price, amenities)
+    limit = max(limit or 3, 1)
+    return heapq.nsmallest(limit, matches, key=hotel_sort_key(sort_by)), max(len(matches) - limit, 0)
+
+def filter_hotels(hotels, min_stars=None, max_stars=None, max_price=None, amenities=None):
+    wanted = [fold(amenity) for amenity in amenities or []]
+    matches = []
+    for hotel in hotels:
+        rating = hotel['category']['rating']
+        price = hotel_price(hotel)
+        if min_stars is not None and rating < min_stars:
+            continue
+        if max_stars is not None and rating > max_stars:
+            continue
+        if max_price is not None and (price is None or price > max_price):
+            continue
+        if wanted:
+            available = [fold(amenity['name']) for amenity in hotel['ammenities']]
+            if not all(any(w in a for a in available) for w in wanted):
+                continue
+        matches.append(hotel)
+    return matches
+
+def hotel_sort_key(sort_by='price'):
+    def cheapest(hotel):
+        price = hotel_price(hotel)
+        return (price is None, price or 0)
+
+    if sort_by == 'stars':
+        return lambda hotel: (-hotel['category']['rating'], cheapest(hotel))
+    return cheapest
+
+# Hotel search results, shared by the availability tools and the prefetch
+# started when the primary assistant delegates a hotel search.
+hotel_availability_cache = ResultCache(
+    'hotel_availability',
+    ttl=float(os.getenv('CTS_HOTEL_AVAILABILITY_TTL', '120')),
+    max_entries=int(os.getenv('CTS_HOTEL_AVAILABILITY_MAX_ENTRIES', '256')),
+    max_bytes=int(os.getenv('CTS_HOTEL_AVAILABILITY_MAX_BYTES', str(64 * 1024 * 1024))),
+)
+
+def fetch_hotels(townId, checkin_date, checkout_date, adults=1, children=0, infants=0, ages=[]):
+    """Returns (request payload, hotels) for a hotel search."""
+    url, payload, headers = hotel_request('', townId, checkin_date, checkout_date, adults, children, infants, ages)
+
+    def load():
+        response = yield steps.post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        return response.json()['data']
+
+    return payload, (yield steps.Cached(hotel_availability_cache, hotel_cache_key(url, payload, headers), load))
+
+def hotel_search_args(town, dates, occupancy):
+    townName, townId = town
+    if townId is None or isinstance(townId, Exception):
+        raise LookupError(f'Town not found: {townName}')
+    # The tools take the town ID as a string, keep the same cache key.
+    return (
+        str(townId), dates['checkin_date'], dates['checkout_date'], occupancy.get('adults', 1),
+        occupancy.get('children', 0), occupancy.get('infants', 0), occupancy.get('ages', []),
+    )
+
+def search_hotels(town, dates, occupancy):
+    return (yield from fetch_hotels(*hotel_search_args(town, dates, occupancy)))
+
+def prefetch_hotel_search(delegation):
+    """
+    Warm the town and availability caches from a ToHotelBookingAssistant call.
+
+    The availability is only fetched for valid future dates, with the number
+    of adults given (or mentioned in the request, 1 otherwise), which is what
+    the specialist's first search will most likely ask for.
+    """
+    townId = steps.run(hotel_town_id(delegation['location']))
+    if townId is None:
+        return
+    checkin_date, checkout_date = delegation.get('checkin_date'), delegation.get('checkout_date')
+    try:
+        valid = date.today() <= date.fromisoformat(checkin_date) < date.fromisoformat(checkout_date)
+    except (TypeError, ValueError):
+        valid = False
+    if valid:
+        steps.run(fetch_hotels(str(townId), checkin_date, checkout_date, delegation.get('adults') or requested_adults(delegation.get('request'))))
+
+def requested_adults(request):
+    match = re.search(r'(\d+)\s*(?:adult|adulto|person|persona|people|guest|huesped|huésped|pax)', (request or '').lower())
+    return int(match.group(1)) if match else 1
+
+def merge_hotel_searches(searches, results, min_stars=None, max_stars=None, max_price=None, amenities=None, sort_by='price', limit=5):
+    """
+    Rank the hotels of every search together.
+
+    Returns ([(townName, payload, hotel), ...], remaining matches, failures),
+    where failures describes the searches that could not be run.
+    """
+    matches = []
+    failures = []
+    for ((townName, _), dates, occupancy), result in zip(searches, results):
+        if isinstance(result, Exception):
+            failures.append(f'{townName} {dates.get("checkin_date")} to {dates.get("checkout_date")}, {occupancy_label(occupancy)}: {result}')
+            continue
+        payload, hotels = result
+        matches += [(townName, payload, hotel) for hotel in filter_hotels(hotels, min_stars, max_stars, max_price, amenities)]
+    key = hotel_sort_key(sort_by)
+    limit = max(limit or 5, 1)
+    return heapq.nsmallest(limit, matches, key=lambda match: key(match[2])), max(len(matches) - limit, 0), failures
+
+def occupancy_label(room):
+    label = f'{room.get("adults", 1)} adults'
+    if room.get('children'):
+        label += f', {room["children"]} children'
+    if room.get('infants'):
+        label += f', {room["infants"]} infants'
+    return label
+
+def hotel_link(data, payload):
+    return f'{os.getenv("FRONT_HOST")}/travel-assistant/hotels/{data["id"]}?townId={data["town_id"]}&checkin={payload["checkin"]}&checkout={payload["checkout"]}&rooms=[{{"adults":{payload["rooms"][0]["adults"]},"children":{payload["rooms"][0]["children"]},"infants":{payload["rooms"][0]["infants"]},"ages":{payload["rooms"][0]["ages"]}}}]'
+
+def generate_hotels_availability_response(json_response, payload, remaining=0):
+    return render('hotels_availability', verbose_hotels_availability_response, compact_hotels_availability_response, json_response, payload, remaining)
+
+def compact_hotels_availability_response(json_response, payload, remaining=0):
+    if not json_response['data']:
+        return 'No hotels match the search. Try relaxing the filters or changing the dates.'
+    currency = 'CLP' if payload['currency'] == 1 else 'USD'
+    rows = [
+        (data['id'], data['name'], data['category']['rating'], data['address'], money(hotel_price(data), currency),
+         hotel_link(data, payload), data['category']['name'], ', '.join(amenity['name'] for amenity in data['ammenities']))
+        for data in json_response['data']
+    ]
+    footer = f'+{remaining} more matching hotels; call again with a higher limit or other filters to see them.' if remaining else None
+    return table(
+        'Hotels available. Show name, stars, address, price (from) and link; id, category and amenities are only for you.',
+        ['id', 'name', 'stars', 'address', 'price_from', 'link', 'category', 'amenities'],
+        rows,
+        footer,
+    )
+
+def verbose_hotels_availability_response(json_response, payload, remaining=0):
+    if not json_response['data']:
+        return 'No hotels match the search. Try relaxing the filters or changing the dates.'
     result = f'The hotels available are the following: \n\n'
     for data in json_response['data']:
-        hotelId = data['id']
-        hotelName = data['name']
-        townId = data['town_id']
-        rating = data['category']['rating']
-        stars = ''
-        for i in range(rating):
-            stars += '★'
-        hotelAddress = data['address']
-        priceList = map(lambda x: x['price_value_with_tax'], data['availability'])
-        priceFrom = min(priceList)
-        currency = 'CLP' if payload['currency'] == 1 else 'USD'
-        ammenities = ', '.join([amenity['name'] for amenity in data['ammenities']])
-        link = f'{os.getenv("FRONT_HOST")}/travel-assistant/hotels/{hotelId}?townId={townId}&checkin={payload["checkin"]}&checkout={payload["checkout"]}&rooms=[{{"adults":{payload["rooms"][0]["adults"]},"children":{payload["rooms"][0]["children"]},"infants":{payload["rooms"][0]["infants"]},"ages":{payload["rooms"][0]["ages"]}}}]'
-        result += f'Hotel ID: {hotelId}\n'
-        result += f'Hotel Name: {hotelName}\n'
-        result += f'Hotel Stars: {stars}\n'
-        result += f'Hotel Address: {hotelAddress}\n'
-        result += f'Price: From ${priceFrom} {currency}\n'
-        result += f'Click here to see details: {link}\n'
-        result += f'(The following information do not show to the user, keep only for you and use it to filter according to users needs)\n'
-        result += f'Hotel Category: {data["category"]["name"]}\n'
-        result += f'Hotel Ammenities: {ammenities}\n\n'
+        result += verbose_hotel_summary(data, payload)
+    if remaining:
+        result += f'There are {remaining} more hotels matching the search. Call the tool again with a higher limit or other filters to see them.\n'
+    return result
+
+def verbose_hotel_summary(data, payload):
+    result = ''
+    hotelId = data['id']
+    hotelName = data['name']
+    rating = data['category']['rating']
+    stars = ''
+    for i in range(rating):
+        stars += '★'
+    hotelAddress = data['address']
+    priceFrom = hotel_price(data)
+    currency = 'CLP' if payload['currency'] == 1 else 'USD'
+    ammenities = ', '.join([amenity['name'] for amenity in data['ammenities']])
+    link = hotel_link(data, payload)
+    result += f'Hotel ID: {hotelId}\n'
+    result += f'Hotel Name: {hotelName}\n'
+    result += f'Hotel Stars: {stars}\n'
+    result += f'Hotel Address: {hotelAddress}\n'
+    result += f'Price: From {money(priceFrom, currency, "$")}\n'
+    result += f'Click here to see details: {link}\n'
+    result += f'(The following information do not show to the user, keep only for you and use it to filter according to users needs)\n'
+    result += f'Hotel Category: {data["category"]["name"]}\n'
+    result += f'Hotel Ammenities: {ammenities}\n\n'
+    return result
+
+def generate_hotels_search_response(matches, remaining=0, failures=()):
+    return render('hotels_search', verbose_hotels_search_response, compact_hotels_search_response, matches, remaining, failures)
+
+def hotels_search_footer(remaining, failures):
+    lines = []
+    if remaining:
+        lines.append(f'+{remaining} more matching hotels; call again with a higher limit or other filters to see them.')
+    lines += [f'Search failed for {failure}' for failure in failures]
+    return '\n'.join(lines)
+
+def compact_hotels_search_response(matches, remaining=0, failures=()):
+    if not matches:
+        return '\n'.join(['No hotels match any of the searches. Try relaxing the filters or other dates.'] + [f'Search failed for {failure}' for failure in failures]) + '\n'
+    rows = [
+        (townName, payload['checkin'], payload['checkout'], occupancy_label(payload['rooms'][0]), data['id'], data['name'],
+         data['category']['rating'], money(hotel_price(data), 'CLP' if payload['currency'] == 1 else 'USD'), hotel_link(data, payload))
+        for townName, payload, data in matches
+    ]
+    return table(
+        'Best hotels across the searches. Show town, dates, guests, name, stars, price (from) and link; id is only for you.',
+        ['town', 'checkin', 'checkout', 'guests', 'id', 'name', 'stars', 'price_from', 'link'],
+        rows,
+        hotels_search_footer(remaining, failures),
+    )
+
+def verbose_hotels_search_response(matches, remaining=0, failures=()):
+    if not matches:
+        result = 'No hotels match any of the searches. Try relaxing the filters or other dates.\n'
+    else:
+        result = 'The best hotels across the searches are the following: \n\n'
+    for townName, payload, data in matches:
+        result += f'Town: {townName}\n'
+        result += f'Dates: {payload["checkin"]} to {payload["checkout"]}\n'
+        result += f'Guests: {occupancy_label(payload["rooms"][0])}\n'
+        result += verbose_hotel_summary(data, payload)
+    if remaining:
+        result += f'There are {remaining} more hotels matching the searches. Call the tool again with a higher limit or other filters to see them.\n'
+    for failure in failures:
+        result += f'The search for {failure} failed.\n'
+    return result
+
+def generate_hotel_info_response(response):
+    return render('hotel_info', verbose_hotel_info_response, compact_hotel_info_response, response)
+
+def compact_hotel_info_response(response):
+    hotelData = response['data']
+    description = hotelData['policies_description'] if session_language() == 'es' else hotelData['policies_description_en']
+    amenities = ', '.join(amenity['name'] for amenity in hotelData['ammenities'])
+    result = f'Hotel {hotelData["name"]} (id {hotelData["id"]}, only for you). Reply in the user\'s language.\n'
+    result += f'Address: {hotelData["address"]}; category: {hotelData["category"]["name"]}; stars: {hotelData["category"]["rating"]}\n'
+    result += f'Description: {description}\n'
+    result += f'Amenities: {amenities}\n'
+    return result
+
+def verbose_hotel_info_response(response):
+    hotelData = response['data']
+    hotelId = hotelData['id']
+    hotelName = hotelData['name']
+    hotelAdress = hotelData['address']
+    hotelCategory = hotelData['category']['name']
+    hotelStars = hotelData['category']['rating']
+    hotelDescriptionSpanish = hotelData['policies_description']
+    hotelDescriptionEnglish = hotelData['policies_description_en']
+    hotelAmmenities = ', '.join([amenity['name'] for amenity in hotelData['ammenities']])
+
+    result = f'The hotel {hotelName} has the following information: \n\n'
+    result += f'Hotel ID: {hotelId} (Never show this item to the user, keep only for you)\n'
+    result += f'Hotel Name: {hotelName}\n'
+    result += f'Hotel Address: {hotelAdress}\n'
+    result += f'Hotel Category: {hotelCategory}\n'
+    result += f'Hotel Stars: {hotelStars}\n'
+    result += f'Hotel Description (Spanish): {hotelDescriptionSpanish}\n'
+    result += f'Hotel Description (English): {hotelDescriptionEnglish}\n'
+    result += f'(Use the hotel description acording to the language used by the user. If you are not sure, just translate to the related language)\n\n'
+    result += f'(Also, if necesary, translate the labels to the language used by the user)\n'
+    result += f'Hotel Ammenities: {hotelAmmenities}\n\n'
+
     return result
 
+def generate_hotel_rooms_response(response, checkin_date, checkout_date):
+    return render('hotel_rooms', verbose_hotel_rooms_response, compact_hotel_rooms_response, response, checkin_date, checkout_date)
+
+def compact_hotel_rooms_response(response, checkin_date, checkout_date):
+    cancellationTime = datetime.strptime(checkin_date, '%Y-%m-%d') - timedelta(hours=response['data']['cancellation'])
+    rows = []
+    seen = set()
+    for available in response['data']['availability']:
+        currency = 'CLP' if available['currency_id'] == 1 else 'USD'
+        price = money(available.get('price_value_with_tax'), currency) + (' tax incl.' if currency == 'CLP' and available.get('price_value_with_tax') is not None else '')
+        for room in available['rooms']:
+            if room['roomtype_id'] in seen:
+                continue
+            seen.add(room['roomtype_id'])
+            rows.append((room['roomtype_id'], room['roomtype'], price, room['rateplan_name'], room['cancellation_type'],
+                         cancellationTime.strftime('%Y-%m-%d'), room['mealplan'], room['adults'], f'{room["bed_options"]} ({room["size"]})'))
+    return table(
+        f'Rooms available in {response["data"]["name"]} from {checkin_date} to {checkout_date}. Show every room as ROOM n.',
+        ['room_id', 'type', 'price', 'rate_plan', 'cancellation', 'cancel_until', 'meal_plan', 'adults', 'beds'],
+        rows,
+    )
+
+def verbose_hotel_rooms_response(response, checkin_date, checkout_date):
+    hotelName = response['data']['name']
+    availability = response['data']['availability']
+    result = f'The rooms available in {hotelName} from {checkin_date} to {checkout_date} are: \n\n'
+    roomsList = []
+    i = 1
+    for available in availability:
+        currency = 'CLP' if available['currency_id'] == 1 else 'USD'
+        for room in available['rooms']:
+            if room['roomtype_id'] in roomsList:
+                continue
+            result += f'ROOM {i}: \n'
+            roomId = room['roomtype_id']
+            result += f'Room Id: {roomId}\n'
+            roomType = room['roomtype']
+            result += f'Room type or name: {roomType}\n'
+            price = available.get('price_value_with_tax')
+            if price is None:
+                result += 'Price: n/a\n'
+            elif currency == 'CLP':
+                result += f'Price: ${price} {currency}, tax included.\n'
+            else:
+                result += f'Price: ${price} {currency}.\n'
+            ratePlan = room['rateplan_name']
+            result += f'Rate plan: {ratePlan}\n'
+            cancellation = room['cancellation_type']
+            result += f'Cancellation policy: {cancellation}\n'
+            cancellationTime = datetime.strptime(checkin_date, '%Y-%m-%d') - timedelta(hours=response['data']['cancellation'])
+            result += f'Cancellation time: {cancellationTime.strftime("%d de %B de %Y")}\n'
+            mealPlan = room['mealplan']
+            result += f'Meal plan: {mealPlan}\n'
+            adults = room['adults']
+            result += f'Adults: {adults}\n'
+            bedOptions = room['bed_options']
+            size = room['size']
+            result += f'Bed options: {bedOptions} ({size})\n\n'
+            roomsList.append(roomId)
+            i += 1
+
+    return result
+
+def build_hotel_booking_payload(
+    hotelAvailability,
+    hotelId,
+    checkin_date,
+    checkout_date,
+    adults,
+    children,
+    infants,
+    roomId,
+    name,
+    lastName,
+    email,
+    phone,
+    passportOrDni,
+    country,
+    referenceNumber,
+    notes,
+) -> dict:
+    currency = session.currency_id()
+    if not hotelAvailability:
+        raise ValueError("No availabilty found for this hotel.")
+    hotelData = hotelAvailability['data']
+    townName = hotelData['town']['name']
+    hotelName = hotelData['name']
+    ammenities = hotelData['ammenities']
+    concepts = ', '.join([amenity['name'] for amenity in ammenities])
+    user = 1
+    currency = 'CLP' if currency == 1 else 'USD'
+    avail = hotelData['availability']
+    availability = None
+    for dispo in avail:
+        for room in dispo['rooms']:
+            if room['roomtype_id'] == roomId:
+                availability = dispo
+    if not availability:
+        raise ValueError("Room with the specified roomId not found in availability data.")
+    markup = availability['markup'][0]
+    bookingAvailabilityList = []
+    availabilityDetails = availability['details']
+    primary_image_url = next((image["url"] for image in hotelData["images"] if image["is_primary"]), None)
+    rooms = availability['rooms']
+    #convert checkin_date and checkout_date from 'YYY-mm-dd' to 'dd-mm-YYY'
+    checkin_date_inv = datetime.strptime(checkin_date, '%Y-%m-%d').strftime('%d-%m-%Y')
+    checkout_date_inv = datetime.strptime(checkout_date, '%Y-%m-%d').strftime('%d-%m-%Y')
+
+    # Collecting booking information
+    for room in rooms:
+        inventory_ids = []
+        for detail in room['details']:
+            inventory_id = detail['inventory_id']
+            rate_id = detail['rate_id']
+            room_name = room['roomtype']
+            inventory_ids.append({
+                'inventoryId': inventory_id,
+                'roomName': room_name,
+                'rateIds': [rate_id],
+                'adults': [room['adults']],
+                'amount': 1  # Assuming one room per inventory
+            })
+
+        bookingAvailabilityList.append({
+            'hotelId': hotelData['id'],
+            'hotelName': hotelData['name'],
+            'inventoryIds': inventory_ids
+        })
+
+    # Extracting pricing and guest details
+    priceBase = availability['price_base']
+    priceValue = availability['price_value']
+    priceValueWithTax = availability['price_value_with_tax']
+    additionalBase = availability['additional_base']
+    additionalTotalBase = availability['additional_total_base']
+    additionalValueWithTax = availability['additional_value_with_tax']
+
+    # Defining payload details
+    payload_detail = [
+        {
+            "date": detail['date'],
+            "total": detail['total'],
+            "total_base": detail['total_base'],
+            "total_with_tax": detail['total_with_tax'],
+            "additional_base": detail['additional_base'],
+            "additional_total_base": detail['additional_total_base'],
+            "additional_total_with_tax": detail['additional_total_with_tax'],
+            "rooms": detail['rooms']
+        } for detail in availabilityDetails
+    ]
+
+    payload = {
+        "name": name,
+        "last_name": lastName,
+        "passport_or_dni": passportOrDni,
+        "email": email,
+        "phone": phone,
+        "country": country,
+        "notes": notes,
+        "currency": currency,
+        "adults": adults,
+        "children": children,
+        "infants": infants,
+        "total_amount": priceValueWithTax,
+        "total_net_amount": priceValue,
+        "total_collect_amount": priceValueWithTax,
+        "reference_number": referenceNumber,
+        "user": user,
+        "booking_availability": bookingAvailabilityList,
+        "cart_items": {
+            "count": 1,
+            "hotels": [
+                {
+                    "dtt_hotel_code": hotelId,
+                    "dtt_hotel_markup": markup,
+                    "glosa_visualizer": hotelName,
+                    "glosa_soptur": hotelName,
+                    "provider": "DTT",
+                    "city": townName,
+                    "concepts": concepts,
+                    "country": townName,
+                    "service_type": "hotel",
+                    "adults": adults,
+                    "children": children,
+                    "infants": infants,
+                    "adult_total_amount": priceValueWithTax,
+                    "children_total_amount": additionalValueWithTax,
+                    "amount": priceValueWithTax,
+                    "net_amount": priceValue,
+                    "pull_inventory": "false",
+                    "hotel_additional_total": additionalTotalBase,
+                    "hotel_additional_base": additionalBase,
+                    "hotel_total": priceBase,
+                    "travel_date": checkin_date_inv,
+                    "checkout": checkout_date_inv,
+                    "cover_image": primary_image_url,
+                    "payload_detail": payload_detail,
+                    "dtt_fee_percent": 0,
+                    "dtt_fee_value": 0,
+                    "total_dtt": 0,
+                    "rooms": rooms,
+                    "id": 3,
+                    "nights": 2,
+                    "hotelName": hotelName,
+                    "roomType": room_name,
+                    "subTotalPrice": priceValue,
+                    "taxPrice": priceValueWithTax - priceValue,
+                    "totalPrice": priceValueWithTax,
+                    "serviceUrl": f"/results/hotels/{hotelId}?townId=51&checkin={checkin_date}&checkout={checkout_date}&rooms=[{{%22adults%22:{adults},%22children%22:{children},%22infants%22:{infants},%22ages%22:[]}}]#rooms",
+                    "item_extras": {
+                        "address": hotelData['address'],
+                        "description": hotelData['policies_description'],
+                        "checkinHour": hotelData['checkin'],
+                        "checkoutHour": hotelData['checkout'],
+                        "hotelPhone": hotelData['phone']
+                    },
+                    "cancellationTime": hotelData['cancellation'],
+                    "additional_information": notes
+                }
+            ],
+            "services": [],
+            "packages": [],
+            "createdAt": datetime.now().isoformat(),
+            "discount": {}
+        },
+        "language": "es",
+        "company": None
+    }
+    return payload
+
+def generate_hotel_booking_response(response):
+    if response:
+        booking_id = response['file_number']
+        slug = response['slug']
+        booking_link = os.getenv("FRONT_HOST") + f'/bookings/{slug}'
+        return f'Se ha realizado la reserva con éxito. El número de reserva es {booking_id}. Puede ver los detalles de la reserva en el siguiente enlace: {booking_link}'
+    else:
+        print("Empty response received")
+        return "Error: Empty response received from the server"
+
+def generate_hotel_booking_update_response(response, bookingId, bookingSlug):
+    if response['file_number']:
+        return f'La reserva con el número {bookingId} ha sido actualizada con éxito. Puede ver los detalles de la reserva en el siguiente enlace: {os.getenv("FRONT_HOST")}/bookings/{bookingSlug}'
+    else:
+        return 'No se ha podido actualizar la reserva.'
+
+def generate_hotel_cancel_response(response, bookingId):
+    if response.is_success:
+        return f'La reserva con el número {bookingId} ha sido cancelada con éxito.'
+    else:
+        return 'No se ha podido cancelar la reserva.'
+
+# get_hotel_info, get_hotel_rooms_available and create_hotel_booking all read
+# the same hotel document, so it is fetched once per search.
+hotel_cache = ResultCache(
+    'hotel',
+    ttl=float(os.getenv('CTS_HOTEL_TTL', '120')),
+    max_entries=int(os.getenv('CTS_HOTEL_MAX_ENTRIES', '256')),
+    max_bytes=int(os.getenv('CTS_HOTEL_MAX_BYTES', str(64 * 1024 * 1024))),
+)
+
+def hotel_cache_key(url, payload, headers):
+    return url, json.dumps(payload, sort_keys=True), token_scope(headers['Authorization'])
+
 def get_data_for_booking(
     hotelId: str,
     townId: Optional[str] = None,
@@ -555,6 +932,7 @@ def get_data_for_booking(
     children: Optional[int] = 0,
     infants: Optional[int] = 0,
     ages: Optional[list[int]] = [],
+    refresh: bool = False,
 ) -> list[dict]:
     """
     Get availability of hotels in a given town.
@@ -568,6 +946,8 @@ def get_data_for_booking(
     children: The number of children. Default is 0.
     infants: The number of infants. Default is 0.
     ages: The ages of the children. Default is [].
+    refresh: Skip the cached document and fetch it again, so prices are
+    current. Used at booking time.
 
     Use this function when the user wants to know more information of the hotel
     or has already selected a hotel.
@@ -579,23 +959,58 @@ def get_data_for_booking(
     Example:
     get_availability(hotelId = '196', townId='1234', checkin_date='2022-12-01', checkout_date='2022-12-05', adults=2, children=1)
     """
-    url = f'{os.getenv("CTS_API_V1")}/hotel/{hotelId}/'
-
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}'}
-    currency = 1 if os.getenv('CURRENCY') == 'CLP' else 2
-    json = {'townId': townId, 'checkin': checkin_date, 'checkout': checkout_date, 'rooms': [{'adults': adults, 'children': children, 'infants': infants, 'ages': ages}], 'currency': currency}
-    response = requests.post(url, json=json, headers=headers)
-    result = response.json()
-    return result
+    url, json, headers = hotel_request(f'{hotelId}/', townId, checkin_date, checkout_date, adults, children, infants, ages)
+    key = hotel_cache_key(url, json, headers)
+    if refresh:
+        hotel_cache.invalidate(key)
+
+    def load():
+        response = yield steps.post(url, json=json, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    return (yield steps.Cached(hotel_cache, key, load))
+
+# file_number -> booking summary, per CTS token. Lets an update go straight to
+# /booking/{slug}/ instead of paging through the agency's booking history.
+booking_index = ResultCache(
+    'booking_index',
+    ttl=float(os.getenv('CTS_BOOKING_INDEX_TTL', '900')),
+    max_entries=int(os.getenv('CTS_BOOKING_INDEX_MAX_ENTRIES', '10000')),
+)
+
+def normalize_file_number(value):
+    """File numbers compare as trimmed text: the API and the model may send numbers or padded strings."""
+    return str(value).strip()
 
 def get_booking_details(bookingId) -> list[dict]:
-    url = f'{os.getenv("CTS_API_V1")}/booking/?showOnlyMyBookings=true'
-    ctsToken = os.getenv("CTS_TOKEN")
-    headers = {'Authorization': f'token {ctsToken}', 'origin': 'localhost'}
-    response = requests.get(url, headers=headers).json()
-    response = response['results']
-    for booking in response:
-        if booking['file_number'] == bookingId:
+    bookingId = normalize_file_number(bookingId)
+    url, headers = booking_request('/booking/?showOnlyMyBookings=true')
+    scope = token_scope(headers['Authorization'])
+    indexed = booking_index.get((scope, bookingId))
+    if indexed:
+        detail_url, _ = booking_request(f'/booking/{indexed["slug"]}/')
+        response = yield steps.get(detail_url, headers=headers)
+        if response.is_success and normalize_file_number(response.json().get('file_number')) == bookingId:
+            return {**indexed, **response.json()}
+        booking_index.invalidate((scope, bookingId))
+    # Stream the pages and stop at the first match.
+    while url:
+        response = (yield steps.get(url, headers=headers)).json()
+        booking = index_bookings(scope, response['results'], bookingId)
+        if booking:
+            return booking
+        url = response.get('next')
+    return None
+
+def index_bookings(scope, bookings, bookingId):
+    result = None
+    for booking in bookings:
+        booking_index.put((scope, normalize_file_number(booking['file_number'])), {
+            'file_number': booking['file_number'],
+            'slug': booking['slug'],
+            'items': [{'id': item['id']} for item in booking.get('items', [])],
+        })
+        if normalize_file_number(booking['file_number']) == bookingId:
             result = booking
-    return result
\ No newline at end of file
+    return result
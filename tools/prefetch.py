@@ -0,0 +1,70 @@
+"""
+Speculative prefetch for delegated searches.
+
+When the primary assistant delegates to a specialist, the delegation tool
+call already carries the location (and, for hotels, the dates). The entry
+node hands those arguments to a prefetch function that runs here, in the
+background, while the specialist's first LLM call is in flight, so its first
+tool calls are served from warm caches. The caches collapse concurrent loads,
+so a tool call that arrives before the prefetch finishes waits for it instead
+of calling CTS again.
+
+Prefetches are best effort: failures are only counted. CTS_PREFETCH=false
+disables them and CTS_PREFETCH_WORKERS (default 2) bounds the worker threads.
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.getenv('CTS_PREFETCH', 'true').lower() != 'false'
+
+
+def submit(name: str, fn: Callable[..., Any], *args) -> Optional[Future]:
+    """Run fn(*args) in the background. Returns None when prefetching is disabled."""
+    if not enabled():
+        return None
+    _count(name, 'started')
+    return _pool().submit(contextvars.copy_context().run, _run, name, fn, *args)
+
+
+def stats() -> dict[str, dict[str, int]]:
+    with _stats_lock:
+        return {name: dict(values) for name, values in _stats.items()}
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('CTS_PREFETCH_WORKERS', '2')),
+                    thread_name_prefix='cts-prefetch',
+                )
+    return _executor
+
+
+def _run(name: str, fn: Callable[..., Any], *args) -> Any:
+    try:
+        result = fn(*args)
+    except Exception as e:
+        print(f'Prefetch {name} failed: {e}')
+        _count(name, 'failed')
+        return None
+    _count(name, 'completed')
+    return result
+
+
+def _count(name: str, field: str) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(name, {'started': 0, 'completed': 0, 'failed': 0})
+        stats[field] += 1
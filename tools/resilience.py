@@ -0,0 +1,120 @@
+"""
+Building blocks for the CTS client's resilience layer.
+
+CircuitBreaker fails fast once an upstream keeps failing, LatencyWindow keeps
+recent latencies to compute percentiles (for hedging and metrics), and
+backoff() returns jittered retry delays. They are generic; the policies that
+use them live in tools/cts_client.py.
+"""
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff delay for a 0-based retry attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failures in a row the circuit opens and calls
+    are refused for `reset_timeout` seconds. Then one trial call is let
+    through (half open): a success closes the circuit, a failure opens it
+    again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+        self._stats = {'successes': 0, 'failures': 0, 'opened': 0, 'rejected': 0}
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self._stats['rejected'] += 1
+                    return False
+                self._state = HALF_OPEN
+                self._trial = False
+            if self._state == HALF_OPEN:
+                if self._trial:
+                    self._stats['rejected'] += 1
+                    return False
+                self._trial = True
+            return True
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def release(self) -> None:
+        """Give back a trial call that ended without an answer (e.g. cancelled)."""
+        with self._lock:
+            self._trial = False
+
+    def success(self) -> None:
+        with self._lock:
+            self._stats['successes'] += 1
+            self._state = CLOSED
+            self._failures = 0
+            self._trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._stats['opened'] += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'state': self._state, 'consecutive_failures': self._failures}
+
+
+class LatencyWindow:
+    """The last `size` latencies of an endpoint, in seconds."""
+
+    def __init__(self, size: int = 256):
+        self._samples: deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < max(min_samples, 1):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+    def stats(self) -> dict:
+        return {
+            'samples': len(self._samples),
+            'p50_ms': _ms(self.percentile(50)),
+            'p95_ms': _ms(self.percentile(95)),
+            'p99_ms': _ms(self.percentile(99)),
+        }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 1)
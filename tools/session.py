@@ -0,0 +1,82 @@
+"""
+Per-session request context.
+
+The CTS token, currency and language belong to one websocket session, not to
+the process. They travel in the run config (configurable 'cts_token',
+'currency' and 'language') and are exposed to the tools and prompts through
+a context variable, so concurrent sessions in the same process (threads or
+asyncio tasks) never see each other's values.
+
+Graph nodes bind the context from their config (bind()); code outside a graph
+run can set it directly with use(). When nothing is bound, the CTS_TOKEN,
+CURRENCY and LANGUAGE environment variables are used, which keeps scripts
+and notebooks working.
+"""
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from typing import Iterator, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+
+@dataclass(frozen=True)
+class Session:
+    token: Optional[str] = None
+    currency: Optional[str] = None
+    language: Optional[str] = None
+
+
+_session: ContextVar[Optional[Session]] = ContextVar('cts_session', default=None)
+
+
+def current() -> Session:
+    session = _session.get()
+    if session is None:
+        return Session(os.getenv('CTS_TOKEN'), os.getenv('CURRENCY'), os.getenv('LANGUAGE'))
+    return session
+
+
+def token() -> Optional[str]:
+    return current().token
+
+
+def currency() -> Optional[str]:
+    return current().currency
+
+
+def currency_id() -> int:
+    """CTS currency ID: 1 for CLP, 2 for USD."""
+    return 1 if currency() == 'CLP' else 2
+
+
+def language() -> Optional[str]:
+    return current().language
+
+
+def from_config(config: Optional[RunnableConfig]) -> Session:
+    """The session in config's configurable, completed with the current one."""
+    configurable = (config or {}).get('configurable', {})
+    values = {
+        field: configurable[key]
+        for field, key in (('token', 'cts_token'), ('currency', 'currency'), ('language', 'language'))
+        if configurable.get(key) is not None
+    }
+    return replace(current(), **values)
+
+
+@contextmanager
+def use(session: Session) -> Iterator[Session]:
+    reset = _session.set(session)
+    try:
+        yield session
+    finally:
+        _session.reset(reset)
+
+
+@contextmanager
+def bind(config: Optional[RunnableConfig]) -> Iterator[Session]:
+    """Bind the session carried by a run config for the duration of the block."""
+    with use(from_config(config)) as session:
+        yield session
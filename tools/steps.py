@@ -0,0 +1,142 @@
+"""
+CTS tool logic written once for the sync and async tools.
+
+A tool's logic is a generator of steps: it yields each call that does I/O
+(a CTS request, a cached load, a town lookup, a fan-out) and gets back its
+result, or its exception raised at the yield. run() performs the steps with
+the blocking client and threads, arun() with the async client and asyncio,
+so the two implementations share everything but the waiting and can't drift:
+
+    def booking(bookingId):
+        url, headers = booking_request(f'/booking/{bookingId}/')
+        response = yield steps.get(url, headers=headers)
+        return response.json()
+
+    get_booking = steps.blocking(booking)
+    aget_booking = steps.awaitable(booking)
+
+cts_tool() is @tool for such a generator: the tool's func runs it with run()
+and its coroutine with arun().
+"""
+import functools
+from typing import Any, Awaitable, Callable, Generator, Hashable, Iterable
+
+from langchain_core.tools import StructuredTool, tool
+
+from tools import cts_client, fanout
+from tools.cache import ResultCache
+
+Steps = Generator[Any, Any, Any]
+
+
+class Call:
+    """fn(*args, **kwargs) under run(), afn(*args, **kwargs) under arun()."""
+
+    def __init__(self, fn: Callable[..., Any], afn: Callable[..., Awaitable[Any]], *args, **kwargs):
+        self.fn = fn
+        self.afn = afn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self) -> Any:
+        return self.fn(*self.args, **self.kwargs)
+
+    async def arun(self) -> Any:
+        return await self.afn(*self.args, **self.kwargs)
+
+
+class Cached:
+    """The cached value for key, loaded by the steps of load() on a miss."""
+
+    def __init__(self, cache: ResultCache, key: Hashable, load: Callable[[], Steps]):
+        self.cache = cache
+        self.key = key
+        self.load = load
+
+    def run(self) -> Any:
+        return self.cache.get_or_load(self.key, lambda: run(self.load()))
+
+    async def arun(self) -> Any:
+        return await self.cache.aget_or_load(self.key, lambda: arun(self.load()))
+
+
+class Fanout:
+    """The steps of fn(*args) for every args in calls, concurrently, through tools.fanout."""
+
+    def __init__(self, fn: Callable[..., Steps], calls: Iterable[tuple]):
+        self.fn = fn
+        self.calls = list(calls)
+
+    def run(self) -> list:
+        return fanout.run(blocking(self.fn), self.calls)
+
+    async def arun(self) -> list:
+        return await fanout.arun(awaitable(self.fn), self.calls)
+
+
+def get(url: str, **kwargs) -> Call:
+    return Call(cts_client.get, cts_client.aget, url, **kwargs)
+
+
+def post(url: str, **kwargs) -> Call:
+    return Call(cts_client.post, cts_client.apost, url, **kwargs)
+
+
+def put(url: str, **kwargs) -> Call:
+    return Call(cts_client.put, cts_client.aput, url, **kwargs)
+
+
+def delete(url: str, **kwargs) -> Call:
+    return Call(cts_client.delete, cts_client.adelete, url, **kwargs)
+
+
+def run(steps: Steps) -> Any:
+    """Perform every step with blocking calls. Returns the generator's result."""
+    try:
+        step = next(steps)
+        while True:
+            try:
+                result = step.run()
+            except Exception as e:
+                step = steps.throw(e)
+            else:
+                step = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def arun(steps: Steps) -> Any:
+    try:
+        step = next(steps)
+        while True:
+            try:
+                result = await step.arun()
+            except Exception as e:
+                step = steps.throw(e)
+            else:
+                step = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+def blocking(fn: Callable[..., Steps]) -> Callable[..., Any]:
+    """fn as a plain function, that runs its steps."""
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        return run(fn(*args, **kwargs))
+    return call
+
+
+def awaitable(fn: Callable[..., Steps]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(fn)
+    async def call(*args, **kwargs):
+        return await arun(fn(*args, **kwargs))
+    return call
+
+
+def cts_tool(fn: Callable[..., Steps]) -> StructuredTool:
+    """@tool for a generator of steps, with a sync and an async implementation."""
+    structured = tool(fn)
+    structured.func = blocking(fn)
+    structured.coroutine = awaitable(fn)
+    return structured
@@ -1,8 +1,17 @@
+import asyncio
+import json
+import os
+import threading
+import weakref
 from langchain_core.messages import ToolMessage
-from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langchain_core.tools import StructuredTool
 from langgraph.prebuilt import ToolNode
-from typing import Callable
+from typing import Any, Callable, Optional
 from state import State
+from assistants.assistant import Assistant
+from tools import prefetch, session
+from assistants import routing
 
 
 def handle_tool_error(state) -> dict:
@@ -19,12 +28,76 @@ def handle_tool_error(state) -> dict:
     }
 
 
+def tool_concurrency() -> int:
+    """Tool calls of one session run at the same time, CTS_TOOL_CONCURRENCY (default 4)."""
+    return max(int(os.getenv("CTS_TOOL_CONCURRENCY", "4")), 1)
+
+
+# Per-session limits, by thread_id, kept while some call holds them.
+_limits = weakref.WeakValueDictionary()
+_async_limits = weakref.WeakValueDictionary()
+_limits_lock = threading.Lock()
+
+
+def _session_limit(limits: weakref.WeakValueDictionary, config: RunnableConfig, factory: Callable):
+    key = (config.get("configurable") or {}).get("thread_id")
+    with _limits_lock:
+        limit = limits.get(key)
+        if limit is None:
+            limit = limits[key] = factory(tool_concurrency())
+        return limit
+
+
+def session_tool(tool: StructuredTool) -> StructuredTool:
+    """
+    A copy of tool that runs with the session of its run config bound, at
+    most tool_concurrency() calls at a time per session.
+
+    ToolNode runs the parallel tool calls of an assistant step concurrently
+    and gives each its own reply (errors included); this caps how many of one
+    session reach CTS at once.
+    """
+    func, coroutine = tool.func, tool.coroutine
+
+    def run(*args, config: RunnableConfig, **kwargs):
+        with _session_limit(_limits, config, threading.BoundedSemaphore), session.bind(config):
+            return func(*args, **kwargs)
+
+    async def arun(*args, config: RunnableConfig, **kwargs):
+        async with _session_limit(_async_limits, config, asyncio.Semaphore):
+            with session.bind(config):
+                return await coroutine(*args, **kwargs)
+
+    # Without a coroutine the tool runs run() on a worker thread.
+    return tool.model_copy(update={"func": run, "coroutine": arun if coroutine else None})
+
+
+def skipped_tool_calls(tool_calls: list, handled_id: str, reason: str) -> list[ToolMessage]:
+    """
+    A reply for each tool call of a parallel batch that was not run, because
+    another call of the batch moved the dialog. The API wants every
+    tool_call_id answered.
+    """
+    return [
+        ToolMessage(content=f"Not run: {reason}", tool_call_id=tc["id"])
+        for tc in tool_calls
+        if tc["id"] != handled_id
+    ]
+
+
 def create_tool_node_with_fallback(tools: list) -> dict:
-    return ToolNode(tools).with_fallbacks(
+    return ToolNode([session_tool(tool) for tool in tools]).with_fallbacks(
         [RunnableLambda(handle_tool_error)], exception_key="error"
     )
 
 
+def create_assistant_node(runnable: Runnable, name: str, cache_answers: bool = False) -> RunnableLambda:
+    # Give the graph both entry points, so astream awaits the LLM call instead
+    # of parking it on a worker thread.
+    assistant = Assistant(runnable, name, cache_answers)
+    return RunnableLambda(assistant, afunc=assistant.acall)
+
+
 def _print_event(event: dict, _printed: set, max_length=1500):
     current_state = event.get("dialog_state")
     if current_state:
@@ -41,9 +114,28 @@ def _print_event(event: dict, _printed: set, max_length=1500):
             _printed.add(message.id)
 
 
-def create_entry_node(assistant_name: str, new_dialog_state: str) -> Callable:
-    def entry_node(state: State) -> dict:
-        tool_call_id = state["messages"][-1].tool_calls[0]["id"]
+def create_entry_node(
+    assistant_name: str,
+    new_dialog_state: str,
+    tool_name: str,
+    prefetch_fn: Optional[Callable[[dict], Any]] = None,
+) -> Callable:
+    def entry_node(state: State, config: RunnableConfig) -> dict:
+        # The delegation call this node enters for; the others of the batch are not run.
+        tool_calls = state["messages"][-1].tool_calls
+        tool_call = next((tc for tc in tool_calls if tc["name"] == tool_name), tool_calls[0])
+        tool_call_id = tool_call["id"]
+        # A specialist on top of the stack is handing off to a sibling: replace it.
+        dialog_state = state.get("dialog_state") or []
+        handoff = bool(dialog_state) and dialog_state[-1] != new_dialog_state
+        details = ""
+        if handoff:
+            routing.record("handoffs")
+            details = f" The previous assistant handed over with these details: {json.dumps(tool_call['args'], ensure_ascii=False)}."
+        if prefetch_fn:
+            # Start warming the specialist's caches while it makes its first LLM call.
+            with session.bind(config):
+                prefetch.submit(new_dialog_state, prefetch_fn, tool_call["args"])
         return {
             "messages": [
                 ToolMessage(
@@ -51,11 +143,16 @@ def create_entry_node(assistant_name: str, new_dialog_state: str) -> Callable:
                     f" The user's intent is unsatisfied. Use the provided tools to assist the user. Remember, you are {assistant_name},"
                     " and the booking, update, other other action is not complete until after you have successfully invoked the appropriate tool."
                     " If the user changes their mind or needs help for other tasks, call the CompleteOrEscalate function to let the primary host assistant take control."
-                    " Do not mention who you are - just act as the proxy for the assistant.",
+                    " Do not mention who you are - just act as the proxy for the assistant." + details,
                     tool_call_id=tool_call_id,
                 )
-            ],
-            "dialog_state": new_dialog_state,
+            ]
+            + skipped_tool_calls(
+                tool_calls,
+                tool_call_id,
+                f"the {assistant_name} took over the dialog. Call it again from there if it is still needed.",
+            ),
+            "dialog_state": ["pop", new_dialog_state] if handoff else new_dialog_state,
         }
 
     return entry_node
\ No newline at end of file